@@ -1,56 +1,21 @@
-import platform
-import sys
-
-# Check if running on Linux
-if platform.system() == "Linux":
-    __import__("pysqlite3")
-    sys.modules["sqlite3"] = sys.modules.pop("pysqlite3")
-
 import logging
 import os
 from datetime import datetime
-from pathlib import Path
 
 import streamlit as st
-import yaml
 from st_pages import Page, show_pages
 
 from docmind.auth.authenticator import AuthenticatorConfig, Authenticator
-from docmind.utils.common import setup_user_directory, setup_page, export_and_download_user_data
-from docmind.utils.config import ProjectConfiguration
+from docmind.utils.common import setup_user_directory, setup_page, export_and_download_user_data, get_project_config, \
+    start_page_profiling, warm_up_user_store
 from docmind.utils.env import EnvironmentLoader
 from docmind.utils.log import LogConfig
 
 # Setup Streamlit page
 setup_page("DocMind", "🧠")
 
-# write authenticator_config file
-authenticator_config = Path(".").resolve() / "authenticator_config.yaml"
-if not authenticator_config.exists():
-    default_config = {
-        "cookie": {"expiry_days": 30, "key": "docmind_dm", "name": "docmind"},
-        "credentials": {
-            "usernames": {
-                "docmind": {
-                    "email": "docmind@gmail.com",
-                    "failed_login_attempts": 0,
-                    "logged_in": True,
-                    "name": "docmind",
-                    "password": "docmind",  # This should ideally be a hashed password in production
-                }
-            }
-        },
-        "pre-authorized": {"emails": ["docmind@gmail.com"]},
-    }
-
-    try:
-        with open(authenticator_config, "w") as f:
-            yaml.safe_dump(default_config, f, default_flow_style=False)
-    except (IOError, yaml.YAMLError) as e:
-        st.error(f"Error writing authenticator config: {e}")
-
 # User authentication
-config_manager = AuthenticatorConfig(config_path=authenticator_config)
+config_manager = AuthenticatorConfig()
 authenticator = Authenticator(config_manager)
 name, authentication_status, username = authenticator.login()
 if not authentication_status:
@@ -62,16 +27,18 @@ if not authentication_status:
 if not authentication_status:
     st.stop()
 
+# Profile this run when enabled in the config or by an admin
+start_page_profiling("app", username)
+
 # Set up user directory
 user_data_dir = setup_user_directory()
 
 # Setup config
-config_file_path = Path(".") / "config.yaml"
-ProjectConfiguration.create_default_config_file(config_file_path, Path(".").resolve())
-config = ProjectConfiguration.load_config(config_file_path)
+config = get_project_config()
 
-# Setup logger
-log = LogConfig(log_file_path=config.log_path / "docmind.log", level=config.log_level)
+# Setup logger, only the first run of the process configures the handlers
+log = LogConfig(log_file_path=config.log_path / "docmind.log", level=config.log_level,
+                max_bytes=config.log_max_bytes, backup_count=config.log_backup_count, json_format=config.log_json)
 log.get_logger()
 logger = logging.getLogger(__name__)
 
@@ -94,6 +61,9 @@ if os.environ.get("COHERE_API_KEY") is None:
     EnvironmentLoader(env_file_path=env_file_path).load_envs()
     st.stop()
 
+# Load the user's documents while they read the welcome page, the first question does not wait for it
+warm_up_user_store(username, user_data_dir)
+
 # Navigate between pages
 show_pages(
     [
@@ -166,5 +136,5 @@ elif st.session_state["authentication_status"] is False:
 elif st.session_state["authentication_status"] is None:
     st.warning('Please enter your username and password')
 
-# Save config
+# Save config, only written when the login or registration changed the credentials
 config_manager.save_config()
@@ -0,0 +1,116 @@
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+@dataclass
+class Job:
+    id: str
+    username: str
+    kind: str
+    status: str = QUEUED
+    created: float = field(default_factory=time.time)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    progress: Dict[str, Any] = field(default_factory=dict)
+    result: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+class JobManager:
+    """
+    Background jobs (ingests) of the API on a worker pool of their own.
+
+    Jobs of one user run one after the other, jobs of different users in parallel, so two
+    uploads never write the same collection at once: a user's next job is only handed to the
+    pool when the previous one finished, queued jobs never hold a worker. Finished jobs are kept
+    `retention` seconds for their status to be polled.
+    """
+
+    def __init__(self, max_workers: int = 2, retention: float = 3600.0):
+        self.retention = retention
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="docmind-job")
+        self._jobs: Dict[str, Job] = {}
+        # jobs of a user waiting for the one of theirs on the pool, the key exists while one is there
+        self._user_queues: Dict[str, Deque[Tuple[Job, Callable[[Job], Dict[str, Any]]]]] = {}
+        self._lock = threading.Condition()
+
+    def submit(self, username: str, kind: str, work: Callable[[Job], Dict[str, Any]]) -> Job:
+        """Queue `work(job)`, its return value becomes the result of the job."""
+        job = Job(id=uuid.uuid4().hex, username=username, kind=kind)
+        with self._lock:
+            self._evict()
+            self._jobs[job.id] = job
+            queue = self._user_queues.get(username)
+            if queue is not None:
+                # a worker is only taken once the previous job of the user finished
+                queue.append((job, work))
+                return job
+            self._user_queues[username] = deque()
+        self._executor.submit(self._run, job, work)
+        return job
+
+    def _run(self, job: Job, work: Callable[[Job], Dict[str, Any]]) -> None:
+        job.status, job.started = RUNNING, time.time()
+        try:
+            job.result = work(job) or {}
+            job.status = DONE
+        except Exception as error:
+            logger.exception(f"{job.kind} job {job.id} of {job.username} failed")
+            job.status, job.error = FAILED, str(error)
+        finally:
+            job.finished = time.time()
+            self._submit_next(job.username)
+
+    def _submit_next(self, username: str) -> None:
+        with self._lock:
+            queue = self._user_queues[username]
+            if not queue:
+                del self._user_queues[username]
+                self._lock.notify_all()
+                return
+            job, work = queue.popleft()
+        try:
+            self._executor.submit(self._run, job, work)
+        except RuntimeError as error:
+            # the manager shut down, the remaining jobs of the user are not run
+            job.status, job.error, job.finished = FAILED, str(error), time.time()
+            self._submit_next(username)
+
+    def get(self, job_id: str, username: str) -> Optional[Job]:
+        """The job, only for the user who submitted it."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return job if job is not None and job.username == username else None
+
+    def list(self, username: str) -> List[Job]:
+        with self._lock:
+            return sorted((job for job in self._jobs.values() if job.username == username),
+                          key=lambda job: job.created)
+
+    def _evict(self) -> None:
+        cutoff = time.time() - self.retention
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished and job.finished < cutoff]:
+            del self._jobs[job_id]
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop the workers, with `wait` once every queued job ran."""
+        if wait:
+            with self._lock:
+                self._lock.wait_for(lambda: not self._user_queues)
+        self._executor.shutdown(wait=wait)
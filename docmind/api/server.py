@@ -0,0 +1,417 @@
+"""
+Headless HTTP API of DocMind: upload and ingest documents, follow the ingest jobs, list and delete
+documents and ask questions with the answer streamed as server-sent events.
+
+Usage: python -m docmind.api.server [--port 8600] [--config config.yaml]
+
+Every endpoint but /token takes `Authorization: Bearer <token>`:
+
+    POST   /api/v1/token               {"username": ..., "password": ...} -> {"token": ..., "expires_in": ...}
+    POST   /api/v1/documents           multipart PDF files ("files") -> 202 {"job": ...}
+    GET    /api/v1/jobs                the jobs of the user
+    GET    /api/v1/jobs/<id>           status, progress and result of a job
+    GET    /api/v1/documents           the uploaded documents
+    DELETE /api/v1/documents/<name>    delete a document and its chunks
+    POST   /api/v1/ask                 {"question": ..., "chat_history": [{"human": ..., "ai": ...}],
+                                        "documents": [...], "model": ..., "temperature": ..., "rerank_model": ...}
+                                       -> text/event-stream of "token" events, then "done" or "error"
+
+Users and passwords are the ones of the Streamlit app. Ingests run on a pool of `api_ingest_workers`
+threads, one at a time per user, and questions on `api_query_workers` threads, so the IO loop only
+serves requests.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import bcrypt
+import tornado.ioloop
+import tornado.web
+from dotenv import dotenv_values
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from tornado.iostream import StreamClosedError
+
+from docmind.api.jobs import Job, JobManager
+from docmind.auth.store import (
+    CredentialsStore,
+    default_store_path,
+    get_credentials_store,
+)
+from docmind.utils.config import ProjectConfiguration
+from docmind.utils.helper import (
+    move_files,
+    rmdir_recursive,
+    sanitize_file_name,
+    truncate_files_in_folder,
+)
+from docmind.utils.usage import DEFAULT_USAGE_DB_PATH, UsageLedger, get_usage_ledger
+from docmind.utils.user_writes import get_user_writer
+from docmind.vectorstore.base import VectorStore
+
+logger = logging.getLogger(__name__)
+
+TOKEN_NAME = "docmind_api_token"
+API_PREFIX = "/api/v1"
+
+EmbeddingFactory = Callable[[str, str], Embeddings]
+ChatModelFactory = Callable[[str, str, float, Optional[int]], BaseChatModel]
+
+
+class DocMindService:
+    """
+    State shared by the request handlers: configuration, credentials, the open stores of the
+    users, the job manager and the worker pools.
+
+    `embedding_factory(model, username)` and `llm_factory(model, username, temperature, max_tokens)`
+    default to Cohere with the API key of the user (`user_data/<user>/.env`, else COHERE_API_KEY).
+    """
+
+    def __init__(self, config: ProjectConfiguration, credentials: CredentialsStore,
+                 user_data_root: Union[str, Path] = Path("user_data"), ledger: Optional[UsageLedger] = None,
+                 embedding_factory: Optional[EmbeddingFactory] = None,
+                 llm_factory: Optional[ChatModelFactory] = None):
+        self.config = config
+        self.credentials = credentials
+        self.user_data_root = Path(user_data_root).resolve()
+        self.ledger = ledger or get_usage_ledger(config.usage_db_path or DEFAULT_USAGE_DB_PATH)
+        self.embedding_factory = embedding_factory or self._cohere_embeddings
+        self.llm_factory = llm_factory or self._cohere_chat
+        self.jobs = JobManager(max_workers=config.api_ingest_workers)
+        self.query_executor = ThreadPoolExecutor(max_workers=config.api_query_workers,
+                                                 thread_name_prefix="docmind-query")
+        self._stores: Dict[str, VectorStore] = {}
+        self._rerankers: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    # --- users -------------------------------------------------------------------------
+
+    @property
+    def _secret(self) -> str:
+        return self.credentials.load()["cookie"]["key"]
+
+    def issue_token(self, username: str, password: str) -> Optional[str]:
+        """A signed token for the user, None when the credentials are wrong. Blocking, bcrypt is slow."""
+        from docmind.auth.authenticator import prehash_credentials
+
+        config = self.credentials.load()
+        if prehash_credentials(config["credentials"]):
+            self.credentials.save()
+        user = config["credentials"]["usernames"].get(username.lower())
+        if user is None or not bcrypt.checkpw(password.encode(), str(user["password"]).encode()):
+            return None
+        return tornado.web.create_signed_value(self._secret, TOKEN_NAME, username.lower()).decode()
+
+    def verify_token(self, token: str) -> Optional[str]:
+        """The user of a valid token."""
+        value = tornado.web.decode_signed_value(self._secret, TOKEN_NAME, token,
+                                                max_age_days=self.config.api_token_days)
+        if value is None:
+            return None
+        username = value.decode()
+        return username if username in self.credentials.load()["credentials"]["usernames"] else None
+
+    def user_dir(self, username: str) -> Path:
+        user_dir = self.user_data_root / username
+        user_dir.mkdir(parents=True, exist_ok=True)
+        return user_dir
+
+    def _api_key(self, username: str) -> Optional[str]:
+        return dotenv_values(self.user_dir(username) / ".env").get("COHERE_API_KEY") or \
+            os.environ.get("COHERE_API_KEY")
+
+    def _cohere_embeddings(self, model: str, username: str) -> Embeddings:
+        from docmind.llm.embeddings import DocMindCohereEmbeddings
+
+        return DocMindCohereEmbeddings(model=model, ledger=self.ledger, username=username,
+                                       cohere_api_key=self._api_key(username))
+
+    def _cohere_chat(self, model: str, username: str, temperature: float, max_tokens: Optional[int]) -> BaseChatModel:
+        from docmind.llm.chat_models import DocMindChatCohere
+
+        return DocMindChatCohere(model_name=model, temperature=temperature, max_tokens=max_tokens,
+                                 cohere_api_key=self._api_key(username), username=username)
+
+    # --- stores ------------------------------------------------------------------------
+
+    def store(self, username: str) -> VectorStore:
+        """
+        The store of the user, opened once and shared by the requests. A collection holds the
+        vectors of one model, the API embeds with `api_embedding_model`.
+        """
+        from docmind.vectorstore.factory import open_user_vectorstore
+
+        with self._lock:
+            if username not in self._stores:
+                self._stores[username] = open_user_vectorstore(
+                    self.config, username, self.user_dir(username),
+                    self.embedding_factory(self.config.api_embedding_model, username))
+            return self._stores[username]
+
+    def reranker(self, model: str):
+        from docmind.llm.rerank import CohereReranker
+
+        with self._lock:
+            if model not in self._rerankers:
+                self._rerankers[model] = CohereReranker(model=model)
+            return self._rerankers[model]
+
+    def documents(self, username: str) -> List[Dict[str, Any]]:
+        reference_dir = self.user_dir(username) / "reference"
+        if not reference_dir.is_dir():
+            return []
+        return [{"name": path.name} for path in sorted(reference_dir.iterdir()) if path.is_file()]
+
+    # --- jobs --------------------------------------------------------------------------
+
+    def ingest(self, username: str, files: List[Tuple[str, bytes]]) -> Job:
+        """Save the uploaded files and queue their ingest."""
+        from docmind.upload_and_process_files import ingest_files
+
+        user_dir = self.user_dir(username)
+
+        def work(job: Job) -> Dict[str, Any]:
+            store = self.store(username)
+            upload_dir = user_dir / "temp" / job.id
+            upload_dir.mkdir(parents=True, exist_ok=True)
+            try:
+                for name, body in files:
+                    sanitize_file_name(upload_dir / Path(name).name).write_bytes(body)
+                with get_user_writer(user_dir).write("API ingest") as writer:
+                    stats = ingest_files(store, user_dir, sorted(upload_dir.glob("*.pdf")),
+                                         on_batch=lambda running: job.progress.update(files=running.files,
+                                                                                      chunks=running.chunks))
+                    writer.flush_later(store)
+                    # the reference copies only keep the names, like the uploads of the Streamlit app
+                    truncate_files_in_folder(upload_dir)
+                    move_files(upload_dir, user_dir / "reference")
+            finally:
+                rmdir_recursive(upload_dir)
+            return {"files": [path.name for path in stats.processed_files], "pages": stats.pages,
+                    "chunks": stats.chunks, "duplicates": stats.duplicates,
+                    "boilerplate_lines": stats.boilerplate_lines, "tokens_saved": stats.tokens_saved}
+
+        return self.jobs.submit(username, "ingest", work)
+
+    def close(self) -> None:
+        self.jobs.shutdown()
+        self.query_executor.shutdown(wait=True)
+        with self._lock:
+            for store in self._stores.values():
+                store.close()
+            self._stores.clear()
+
+
+class BaseHandler(tornado.web.RequestHandler):
+    """JSON handlers authenticated with a bearer token."""
+
+    requires_user = True
+
+    def initialize(self, service: DocMindService):
+        self.service = service
+
+    def get_current_user(self) -> Optional[str]:
+        header = self.request.headers.get("Authorization", "")
+        if not header.startswith("Bearer "):
+            return None
+        return self.service.verify_token(header[len("Bearer "):].strip())
+
+    def prepare(self):
+        if self.requires_user and self.current_user is None:
+            raise tornado.web.HTTPError(401, reason="A valid bearer token is required")
+
+    def json_body(self) -> Dict[str, Any]:
+        try:
+            body = json.loads(self.request.body or b"{}")
+        except json.JSONDecodeError:
+            raise tornado.web.HTTPError(400, reason="The body is not valid JSON")
+        if not isinstance(body, dict):
+            raise tornado.web.HTTPError(400, reason="The body should be a JSON object")
+        return body
+
+    def write_error(self, status_code: int, **kwargs):
+        self.finish({"error": self._reason})
+
+
+class TokenHandler(BaseHandler):
+    requires_user = False
+
+    async def post(self):
+        body = self.json_body()
+        if not body.get("username") or not body.get("password"):
+            raise tornado.web.HTTPError(400, reason="username and password are required")
+        token = await tornado.ioloop.IOLoop.current().run_in_executor(
+            self.service.query_executor, self.service.issue_token, str(body["username"]), str(body["password"]))
+        if token is None:
+            raise tornado.web.HTTPError(401, reason="Invalid username or password")
+        self.write({"token": token, "expires_in": int(self.service.config.api_token_days * 86400)})
+
+
+class DocumentsHandler(BaseHandler):
+    def get(self):
+        self.write({"documents": self.service.documents(self.current_user)})
+
+    def post(self):
+        files = [(upload.filename, upload.body) for upload in self.request.files.get("files", [])]
+        if not files:
+            raise tornado.web.HTTPError(400, reason="Upload the documents as multipart files named 'files'")
+        rejected = [name for name, _ in files if Path(name).suffix.lower() != ".pdf"]
+        if rejected:
+            raise tornado.web.HTTPError(415, reason=f"Only PDF files are supported: {rejected}")
+        job = self.service.ingest(self.current_user, files)
+        self.set_status(202)
+        self.set_header("Location", f"{API_PREFIX}/jobs/{job.id}")
+        self.write({"job": job.to_dict()})
+
+
+class DocumentHandler(BaseHandler):
+    async def delete(self, name: str):
+        from docmind.upload_and_process_files import delete_document
+
+        if name not in {document["name"] for document in self.service.documents(self.current_user)}:
+            raise tornado.web.HTTPError(404, reason=f"No document {name}")
+        username = self.current_user
+        user_dir = self.service.user_dir(username)
+
+        def delete() -> int:
+            with get_user_writer(user_dir).write("API delete"):
+                return delete_document(self.service.store(username), user_dir, name)
+
+        deleted = await tornado.ioloop.IOLoop.current().run_in_executor(self.service.query_executor, delete)
+        self.write({"document": name, "chunks": deleted})
+
+
+class JobsHandler(BaseHandler):
+    def get(self, job_id: Optional[str] = None):
+        if job_id is None:
+            self.write({"jobs": [job.to_dict() for job in self.service.jobs.list(self.current_user)]})
+            return
+        job = self.service.jobs.get(job_id, self.current_user)
+        if job is None:
+            raise tornado.web.HTTPError(404, reason=f"No job {job_id}")
+        self.write({"job": job.to_dict()})
+
+
+class AskHandler(BaseHandler):
+    """Answer a question over the documents of the user, streamed as server-sent events."""
+
+    def _chain_and_inputs(self, body: Dict[str, Any]):
+        from docmind.llm.chat_models import DocMindChatCohere
+        from docmind.llm.create_llm_chain import create_llm_with_retriever_chain
+        from docmind.llm.rerank import DEFAULT_TOP_N
+        from docmind.upload_and_process_files import GetRetriever, documents_filter
+
+        config = self.service.config
+        documents = body.get("documents") or []
+        store = self.service.store(self.current_user)
+        retriever = GetRetriever(vectorstore=store, filter_criteria=documents_filter(
+            self.service.user_dir(self.current_user), documents) if documents else {}).get_retriever()
+        llm = self.service.llm_factory(body.get("model") or config.api_chat_model, self.current_user,
+                                       float(body.get("temperature", 0.3)), body.get("max_tokens"))
+        reranker = self.service.reranker(body["rerank_model"]) if body.get("rerank_model") else None
+        condense_llm = llm.condenser() if isinstance(llm, DocMindChatCohere) else None
+        chain = create_llm_with_retriever_chain(llm, retriever, reranker=reranker,
+                                                top_n=int(body.get("top_n", DEFAULT_TOP_N)), condense_llm=condense_llm)
+        return chain, {"question": body["question"], "chat_history": body.get("chat_history") or []}
+
+    async def post(self):
+        from docmind.llm.callbacks import StageTimingCallback, UsageCallback
+
+        body = self.json_body()
+        if not str(body.get("question") or "").strip():
+            raise tornado.web.HTTPError(400, reason="question is required")
+        loop = asyncio.get_running_loop()
+        # opening the store of the user may read it from disk
+        chain, inputs = await loop.run_in_executor(self.service.query_executor, self._chain_and_inputs, body)
+        timings = StageTimingCallback()
+        usage = UsageCallback(self.service.ledger, self.current_user,
+                              conversation=f"api/{body.get('conversation') or 'default'}")
+
+        events: "asyncio.Queue[Tuple[str, Any]]" = asyncio.Queue()
+        cancelled = threading.Event()
+
+        def emit(event: str, data: Any) -> None:
+            loop.call_soon_threadsafe(events.put_nowait, (event, data))
+
+        def answer() -> None:
+            try:
+                for chunk in chain.stream(inputs, config={"callbacks": [timings, usage]}):
+                    if cancelled.is_set():
+                        return
+                    emit("token", chunk)
+                emit("done", {"timings": timings.breakdown()})
+            except Exception as error:
+                logger.exception(f"Answering a question of {self.current_user} failed")
+                emit("error", str(error))
+
+        self.set_header("Content-Type", "text/event-stream")
+        self.set_header("Cache-Control", "no-cache")
+        worker = loop.run_in_executor(self.service.query_executor, answer)
+        try:
+            while True:
+                event, data = await events.get()
+                self.write(f"event: {event}\ndata: {json.dumps(data)}\n\n")
+                await self.flush()
+                if event != "token":
+                    break
+        except StreamClosedError:
+            logger.info(f"{self.current_user} closed the stream before the answer was complete")
+        finally:
+            cancelled.set()
+            await worker
+
+
+def make_app(service: DocMindService) -> tornado.web.Application:
+    options = {"service": service}
+    return tornado.web.Application([
+        (rf"{API_PREFIX}/token", TokenHandler, options),
+        (rf"{API_PREFIX}/documents", DocumentsHandler, options),
+        (rf"{API_PREFIX}/documents/([^/]+)", DocumentHandler, options),
+        (rf"{API_PREFIX}/jobs", JobsHandler, options),
+        (rf"{API_PREFIX}/jobs/([0-9a-f]+)", JobsHandler, options),
+        (rf"{API_PREFIX}/ask", AskHandler, options),
+    ])
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config", type=Path, default=Path("config.yaml"))
+    parser.add_argument("--port", type=int, default=None, help="defaults to api_port of the configuration")
+    parser.add_argument("--address", default="127.0.0.1")
+    args = parser.parse_args(argv)
+
+    from docmind.llm.resilience import ResilienceSettings, configure_resilience
+    from docmind.llm.scheduler import configure_scheduler
+    from docmind.utils.log import LogConfig
+
+    ProjectConfiguration.create_default_config_file(args.config, Path(".").resolve())
+    config = ProjectConfiguration.load_config(args.config)
+    configure_scheduler(config.cohere_max_concurrency, config.cohere_tokens_per_minute)
+    configure_resilience(ResilienceSettings.from_config(config))
+    LogConfig(log_file_path=config.log_path / "docmind-api.log", level=config.log_level,
+              max_bytes=config.log_max_bytes, backup_count=config.log_backup_count,
+              json_format=config.log_json).get_logger()
+    credentials = get_credentials_store(default_store_path(Path(__file__).resolve().parent.parent.parent))
+    service = DocMindService(config, credentials)
+    app = make_app(service)
+    port = args.port or config.api_port
+    app.listen(port, address=args.address, max_body_size=config.api_max_upload_mb * 1024 * 1024)
+    logger.info(f"DocMind API listening on http://{args.address}:{port}{API_PREFIX}")
+    try:
+        tornado.ioloop.IOLoop.current().start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
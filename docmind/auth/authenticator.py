@@ -1,32 +1,126 @@
+import re
+import threading
 from pathlib import Path
+from typing import Dict, Tuple
 
+import bcrypt
 import streamlit as st
 import streamlit_authenticator as stauth
-import yaml
+from streamlit_authenticator.authenticate.authentication import AuthenticationHandler
+from streamlit_authenticator.authenticate.cookie import CookieHandler
 from streamlit_authenticator.utilities.exceptions import LoginError, RegisterError
-from yaml.loader import SafeLoader
+from streamlit_authenticator.utilities.validator import Validator
 
-authenticator_config_path = (Path(__file__).resolve().parent.parent.parent /
-                             "authenticator_config.yaml")
+from docmind.auth.store import (
+    CredentialsStore,
+    default_store_path,
+    get_credentials_store,
+)
+
+authenticator_config_path = default_store_path(Path(__file__).resolve().parent.parent.parent)
+
+BCRYPT_HASH = re.compile(r'^\$2[aby]\$\d+\$.{53}$')
+# user directories are named after the username, names with this prefix are kept for the folders
+# of the application next to them in user_data, e.g. the shared corpora
+RESERVED_USERNAME_PREFIX = "_"
+
+# AuthenticationHandler instances shared by every session, keyed by store path
+_handlers: Dict[str, Tuple[int, AuthenticationHandler]] = {}
+_handlers_lock = threading.Lock()
+
+
+def prehash_credentials(credentials: dict) -> bool:
+    """
+    Apply the defaults streamlit_authenticator expects and bcrypt any plaintext password in place,
+    so building the authenticator afterwards does no hashing. Returns True if anything changed.
+    """
+    changed = False
+    usernames = credentials['usernames']
+    if any(username != username.lower() for username in usernames):
+        credentials['usernames'] = usernames = {key.lower(): value for key, value in usernames.items()}
+        changed = True
+
+    for user in usernames.values():
+        if 'logged_in' not in user:
+            user['logged_in'] = False
+            changed = True
+        if 'failed_login_attempts' not in user:
+            user['failed_login_attempts'] = 0
+            changed = True
+        password = str(user['password'])
+        if not BCRYPT_HASH.match(password):
+            user['password'] = bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+            changed = True
+    return changed
+
+
+class UsernameValidator(Validator):
+    """Validator refusing to register the usernames reserved for the folders of the application."""
+
+    def validate_username(self, username: str) -> bool:
+        return super().validate_username(username) and not username.startswith(RESERVED_USERNAME_PREFIX)
+
+
+def get_authentication_handler(store: CredentialsStore) -> AuthenticationHandler:
+    """
+    Return the process wide AuthenticationHandler for `store`, the credentials are hashed once and
+    the handler is only rebuilt after `invalidate_authentication_handler` or when another process
+    changed the store.
+    """
+    key = str(store.path)
+    with _handlers_lock:
+        cached = _handlers.get(key)
+        if cached is not None and cached[0] == store.revision:
+            return cached[1]
+
+        config = store.load()
+        if prehash_credentials(config['credentials']):
+            # persist the hashes so plaintext passwords are never hashed again
+            store.save()
+        handler = AuthenticationHandler(config['credentials'], config['pre-authorized'], UsernameValidator())
+        _handlers[key] = (store.revision, handler)
+        return handler
+
+
+def invalidate_authentication_handler(store: CredentialsStore) -> None:
+    """Drop the shared handler of `store`, it is rebuilt on the next run."""
+    with _handlers_lock:
+        _handlers.pop(str(store.path), None)
+
+
+class SharedAuthenticate(stauth.Authenticate):
+    """
+    stauth.Authenticate reusing a shared AuthenticationHandler, only the cookie handler
+    (a Streamlit component) is created per run.
+    """
+
+    def __init__(self, authentication_handler: AuthenticationHandler, cookie_name: str, cookie_key: str,
+                 cookie_expiry_days: float = 30.0):
+        self.authentication_handler = authentication_handler
+        self.cookie_handler = CookieHandler(cookie_name, cookie_key, cookie_expiry_days)
+        # AuthenticationHandler initializes these only for the session that created it
+        for key in ('name', 'authentication_status', 'username', 'logout'):
+            st.session_state.setdefault(key, None)
 
 
 class AuthenticatorConfig:
     def __init__(self, config_path=authenticator_config_path):
         self.config_path = Path(config_path)
+        self.store = get_credentials_store(self.config_path)
         self.config = self.load_config()
 
     def load_config(self):
+        """Return the process wide configuration, it is only read from disk once."""
         try:
-            with self.config_path.open('r', encoding='utf-8') as file:
-                return yaml.load(file, Loader=SafeLoader)
+            return self.store.load()
         except FileNotFoundError:
             st.error("Configuration file not found.")
             raise
 
     def save_config(self):
+        """Persist the configuration, this is a no-op unless it actually changed."""
         try:
-            with self.config_path.open('w', encoding='utf-8') as file:
-                yaml.dump(self.config, file, default_flow_style=False)
+            return self.store.save()
         except Exception as e:
             st.error(f"Failed to save configuration: {e}")
 
@@ -34,12 +128,11 @@ class AuthenticatorConfig:
 class Authenticator:
     def __init__(self, config_manager):
         self.config_manager = config_manager
-        self.authenticator = stauth.Authenticate(
-            self.config_manager.config['credentials'],
+        self.authenticator = SharedAuthenticate(
+            get_authentication_handler(self.config_manager.store),
             self.config_manager.config['cookie']['name'],
             self.config_manager.config['cookie']['key'],
             self.config_manager.config['cookie']['expiry_days'],
-            self.config_manager.config['pre-authorized']
         )
 
     def login(self):
@@ -54,10 +147,13 @@ class Authenticator:
 
     def register(self):
         try:
-            return self.authenticator.register_user(
+            email, username, name = self.authenticator.register_user(
                 location='main', pre_authorization=False, clear_on_submit=True
             )
-            # return email, username, name
+            if email:
+                self.config_manager.save_config()
+                invalidate_authentication_handler(self.config_manager.store)
+            return email, username, name
         except RegisterError as e:
             st.error(e)
 
@@ -66,6 +162,8 @@ class Authenticator:
         if st.session_state.get("authentication_status"):
             try:
                 if self.authenticator.update_user_details(st.session_state["username"]):
+                    self.config_manager.save_config()
+                    invalidate_authentication_handler(self.config_manager.store)
                     st.success('Entries updated successfully')
             except stauth.UpdateError as e:
                 st.error(f"Update failed: {e}")
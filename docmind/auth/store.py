@@ -0,0 +1,235 @@
+import copy
+import json
+import logging
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+
+import yaml
+
+from docmind.utils.filelock import FileLock
+from docmind.utils.helper import atomic_write
+
+logger = logging.getLogger(__name__)
+
+SQLITE_SUFFIXES = (".db", ".sqlite", ".sqlite3")
+
+DEFAULT_AUTH_CONFIG = {
+    "cookie": {"expiry_days": 30, "key": "docmind_dm", "name": "docmind"},
+    "credentials": {
+        "usernames": {
+            "docmind": {
+                "email": "docmind@gmail.com",
+                "failed_login_attempts": 0,
+                "logged_in": True,
+                "name": "docmind",
+                "password": "docmind",  # This should ideally be a hashed password in production
+            }
+        }
+    },
+    "pre-authorized": {"emails": ["docmind@gmail.com"]},
+}
+
+
+def _canonical(value) -> str:
+    return json.dumps(value, sort_keys=True, default=str)
+
+
+def _users(config: Dict) -> Dict:
+    return config.setdefault("credentials", {}).setdefault("usernames", {})
+
+
+class CredentialsStore(ABC):
+    """
+    Process wide holder of the authenticator configuration.
+
+    The configuration is read once per process and shared by every session.
+    `save` persists it only when its content differs from what was last written, and
+    merges users changed by other processes instead of overwriting them.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.config: Optional[Dict] = None
+        # bumped when changes of other processes are merged in, used to invalidate derived caches
+        self.revision = 0
+        self._lock = threading.RLock()
+        self._persisted: Dict = {}
+        self._snapshot = ""
+
+    def load(self) -> Dict:
+        """Returns the shared configuration, reading it from the backend on first use."""
+        with self._lock:
+            if self.config is None:
+                config = self._read()
+                if config is None:
+                    logger.info(f"Creating default authenticator config at {self.path}")
+                    config = copy.deepcopy(DEFAULT_AUTH_CONFIG)
+                    self._write(config, {})
+                self._remember(config)
+                self.config = config
+            return self.config
+
+    def save(self) -> bool:
+        """Persists the configuration if it changed, returns True when something was written."""
+        with self._lock:
+            if self.config is None:
+                return False
+            if _canonical(self.config) == self._snapshot:
+                return False
+            self._write(self.config, self._persisted)
+            self._remember(self.config)
+            return True
+
+    def _remember(self, config: Dict) -> None:
+        self._persisted = copy.deepcopy(config)
+        self._snapshot = _canonical(config)
+
+    def _apply_external(self, disk: Dict, base: Dict) -> None:
+        """Merges changes made by other processes into the shared config, keeping our own changes."""
+        ours = self.config
+        our_users, base_users, disk_users = _users(ours), _users(base), _users(disk)
+        changed = {name for name in set(our_users) | set(base_users) if our_users.get(name) != base_users.get(name)}
+        for name, user in disk_users.items():
+            if name not in changed and our_users.get(name) != user:
+                our_users[name] = user
+        for name in [name for name in our_users if name not in disk_users and name in base_users]:
+            if name not in changed:
+                del our_users[name]
+
+        for key, value in disk.items():
+            if key != "credentials" and ours.get(key) == base.get(key):
+                ours[key] = value
+        self.revision += 1
+
+    @abstractmethod
+    def _read(self) -> Optional[Dict]:
+        """Reads the configuration from the backend, None if it does not exist yet."""
+
+    @abstractmethod
+    def _write(self, config: Dict, base: Dict) -> None:
+        """Writes `config`, where `base` is the state this process last persisted."""
+
+
+class YamlCredentialsStore(CredentialsStore):
+    """Stores the configuration in a YAML file, rewritten atomically under a file lock."""
+
+    def __init__(self, path: Union[str, Path]):
+        super().__init__(path)
+        self.file_lock = FileLock(self.path.with_name(f"{self.path.name}.lock"))
+        self._disk_signature: Optional[Tuple[int, int]] = None
+
+    def _signature(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _read(self) -> Optional[Dict]:
+        with self.file_lock:
+            signature = self._signature()
+            if signature is None:
+                return None
+            with self.path.open("r", encoding="utf-8") as file:
+                config = yaml.safe_load(file)
+            self._disk_signature = signature
+            return config
+
+    def _write(self, config: Dict, base: Dict) -> None:
+        with self.file_lock:
+            if base and self._signature() not in (None, self._disk_signature):
+                logger.info(f"{self.path} was modified by another process, merging changes.")
+                with self.path.open("r", encoding="utf-8") as file:
+                    self._apply_external(yaml.safe_load(file) or {}, base)
+            atomic_write(self.path, yaml.dump(config, default_flow_style=False))
+            self._disk_signature = self._signature()
+
+
+class SqliteCredentialsStore(CredentialsStore):
+    """
+    Stores one row per user in a SQLite database, so saving touches only changed users.
+    Better suited than YAML for deployments with many users.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        super().__init__(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False,
+                                           isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, data TEXT NOT NULL)")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._data_version: Optional[int] = None
+
+    def _current_data_version(self) -> int:
+        return self._connection.execute("PRAGMA data_version").fetchone()[0]
+
+    def _read(self) -> Optional[Dict]:
+        settings = dict(self._connection.execute("SELECT key, value FROM settings").fetchall())
+        if not settings:
+            return None
+        config = {key: json.loads(value) for key, value in settings.items()}
+        config["credentials"] = {
+            "usernames": {
+                username: json.loads(data)
+                for username, data in self._connection.execute("SELECT username, data FROM users").fetchall()
+            }
+        }
+        self._data_version = self._current_data_version()
+        return config
+
+    def _write(self, config: Dict, base: Dict) -> None:
+        connection = self._connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            if base and self._current_data_version() != self._data_version:
+                logger.info(f"{self.path} was modified by another process, merging changes.")
+                self._apply_external(self._read(), base)
+
+            users, base_users = _users(config), _users(base)
+            for username, data in users.items():
+                if base_users.get(username) != data:
+                    connection.execute("INSERT OR REPLACE INTO users (username, data) VALUES (?, ?)",
+                                       (username, json.dumps(data, default=str)))
+            for username in set(base_users) - set(users):
+                connection.execute("DELETE FROM users WHERE username = ?", (username,))
+
+            for key, value in config.items():
+                if key != "credentials" and base.get(key) != value:
+                    connection.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+                                       (key, json.dumps(value, default=str)))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        self._data_version = self._current_data_version()
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+_stores: Dict[str, CredentialsStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_credentials_store(path: Union[str, Path]) -> CredentialsStore:
+    """
+    Returns the process wide store for `path`. The backend is chosen from the file suffix:
+    `.db`, `.sqlite` and `.sqlite3` use SQLite, anything else YAML.
+    """
+    path = Path(path).resolve()
+    with _stores_lock:
+        store = _stores.get(str(path))
+        if store is None:
+            store_cls = SqliteCredentialsStore if path.suffix.lower() in SQLITE_SUFFIXES else YamlCredentialsStore
+            store = _stores[str(path)] = store_cls(path)
+        return store
+
+
+def default_store_path(project_path: Path) -> Path:
+    """Store location, overridable with the DOCMIND_AUTH_STORE environment variable."""
+    return Path(os.environ.get("DOCMIND_AUTH_STORE", project_path / "authenticator_config.yaml"))
@@ -0,0 +1,312 @@
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from docmind.utils.usage import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+DEDUP_DB_FILE = "dedup.db"
+# metadata key of the id of a chunk other documents repeat, how a filter on them names it
+CHUNK_ID_KEY = "chunk_id"
+
+# page numbers, dates and revision counters differ on every page of a running header
+_DIGITS = re.compile(r"\d+")
+_WHITESPACE = re.compile(r"\s+")
+_WORD = re.compile(r"\w+")
+_MERSENNE_PRIME = (1 << 61) - 1
+
+
+def _normalize_line(line: str) -> str:
+    return _DIGITS.sub("#", _WHITESPACE.sub(" ", line.strip().lower()))
+
+
+class BoilerplateStripper:
+    """
+    Learns the lines repeated across the pages of a document (running headers, footers, legal
+    disclaimers) and strips them from every page.
+
+    A line, normalized for case, spacing and digits, is boilerplate once it appeared on at
+    least `min_ratio` of the pages seen of its document, and on `min_pages` of them. The first
+    `window` pages of every document are held back until they are learned, so they are stripped
+    too; later pages keep refining the counts. Documents are told apart by `metadata["source"]`.
+    """
+
+    def __init__(self, window: int = 8, min_ratio: float = 0.5, min_pages: int = 3, max_line_length: int = 200):
+        self.window = window
+        self.min_ratio = min_ratio
+        self.min_pages = min_pages
+        self.max_line_length = max_line_length
+        self.removed_lines = 0
+        self.removed_tokens = 0
+
+    def _count(self, counts: Counter, doc: Document) -> None:
+        counts.update({_normalize_line(line) for line in doc.page_content.splitlines()
+                       if line.strip() and len(line) <= self.max_line_length})
+
+    def _strip(self, doc: Document, counts: Counter, pages: int) -> Document:
+        threshold = max(self.min_pages, self.min_ratio * pages)
+        kept = []
+        for line in doc.page_content.splitlines():
+            if line.strip() and len(line) <= self.max_line_length and counts[_normalize_line(line)] >= threshold:
+                self.removed_lines += 1
+                self.removed_tokens += estimate_tokens(line)
+                continue
+            kept.append(line)
+        if len(kept) != len(doc.page_content.splitlines()):
+            doc.page_content = "\n".join(kept).strip()
+        return doc
+
+    def strip(self, docs: Iterable[Document]) -> Iterator[Document]:
+        source, counts, pages, held = None, Counter(), 0, []
+        for doc in docs:
+            if doc.metadata.get("source") != source:
+                for page in held:
+                    yield self._strip(page, counts, pages)
+                source, counts, pages, held = doc.metadata.get("source"), Counter(), 0, []
+            self._count(counts, doc)
+            pages += 1
+            if pages <= self.window:
+                held.append(doc)
+                if pages == self.window:
+                    for page in held:
+                        yield self._strip(page, counts, pages)
+                    held = []
+            else:
+                yield self._strip(doc, counts, pages)
+        for page in held:
+            yield self._strip(page, counts, pages)
+
+
+class ChunkDeduplicator:
+    """
+    Near-duplicate detection of the chunks of a user's collection with MinHash and LSH.
+
+    Every chunk is reduced to the MinHash signature of its word `shingle`-grams. The signature
+    is cut in `bands` bands; chunks sharing a band are candidates, and a candidate whose
+    estimated Jaccard similarity reaches `threshold` is a duplicate. The bands and signatures of
+    inserted chunks are kept in SQLite, next to the user's vector store, so a revision of an
+    already uploaded document, under the same name or a new one, only embeds the pages that changed.
+
+    A chunk skipped because it repeats a chunk of another document is recorded as an alias of
+    the stored one, with the metadata it would have had. `source_filter` extends a filter on
+    documents to the chunks they repeat, which carry their id in `metadata["chunk_id"]` once the
+    pipeline wrote it (`unmarked`, `mark`). `remove_source` tells which chunks of a deleted
+    document another one still repeats, they are moved to it instead of being deleted.
+
+    `check` remembers the chunks it lets through until `commit` persists them once they are
+    inserted, so a failed ingest does not hide its chunks from the next one.
+
+    Example:
+        dedup = ChunkDeduplicator(Path("user_data/alice/dedup.db"))
+        signature = dedup.check(chunk.page_content, chunk.metadata)
+        if signature is not None:
+            ids = store.add_documents([chunk])
+            dedup.commit(ids, [signature], [chunk.metadata["source"]])
+    """
+
+    def __init__(self, db_path: Path, num_perm: int = 128, bands: int = 16, shingle: int = 5,
+                 threshold: float = 0.8, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) should be a multiple of bands ({bands})")
+        self.db_path = Path(db_path)
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle = shingle
+        self.threshold = threshold
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        # chunks let through but not inserted yet with their source, and the aliases found for them
+        self._pending: Dict[bytes, Tuple[np.ndarray, Optional[str]]] = {}
+        self._pending_buckets: Dict[Tuple[int, str], Set[bytes]] = {}
+        self._pending_aliases: Dict[bytes, Dict[str, Dict[str, Any]]] = {}
+        self.duplicates = 0
+        self.duplicate_tokens = 0
+        self._lock = threading.Lock()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS signatures (chunk_id TEXT PRIMARY KEY, "
+                               "signature BLOB NOT NULL, source TEXT)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS bands (band INTEGER NOT NULL, bucket TEXT NOT NULL, "
+                               "chunk_id TEXT NOT NULL)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS aliases (chunk_id TEXT NOT NULL, source TEXT NOT NULL, "
+                               "metadata TEXT NOT NULL, marked INTEGER NOT NULL DEFAULT 0, "
+                               "PRIMARY KEY (chunk_id, source))")
+            self._migrate()
+            self._conn.execute("CREATE INDEX IF NOT EXISTS bands_bucket ON bands (band, bucket)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS aliases_source ON aliases (source)")
+
+    def _migrate(self) -> None:
+        if "source" not in {row[1] for row in self._conn.execute("PRAGMA table_info(signatures)")}:
+            # the source of chunks recorded before it was kept is unknown, they stay NULL
+            self._conn.execute("ALTER TABLE signatures ADD COLUMN source TEXT")
+        if "source" in {row[1] for row in self._conn.execute("PRAGMA table_info(bands)")}:
+            # bands were scoped to their document for a while, the source now lives with the signature
+            self._conn.execute("UPDATE signatures SET source = (SELECT source FROM bands WHERE bands.chunk_id = "
+                               "signatures.chunk_id AND bands.source IS NOT NULL LIMIT 1) WHERE source IS NULL")
+            self._conn.execute("DROP INDEX IF EXISTS bands_bucket")
+            self._conn.execute("ALTER TABLE bands RENAME TO bands_scoped")
+            self._conn.execute("CREATE TABLE bands (band INTEGER NOT NULL, bucket TEXT NOT NULL, "
+                               "chunk_id TEXT NOT NULL)")
+            self._conn.execute("INSERT INTO bands (band, bucket, chunk_id) SELECT band, bucket, chunk_id "
+                               "FROM bands_scoped")
+            self._conn.execute("DROP TABLE bands_scoped")
+
+    def signature(self, text: str) -> np.ndarray:
+        words = _WORD.findall(text.lower())
+        shingles = {" ".join(words[i:i + self.shingle]) for i in range(max(1, len(words) - self.shingle + 1))}
+        hashes = np.array([int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=4).digest(), "little")
+                           for shingle in shingles], dtype=np.uint64)
+        # (a * x + b) mod p, a * x wraps around 2 ** 64 like the usual MinHash implementations
+        with np.errstate(over="ignore"):
+            permuted = (np.outer(hashes, self._a) + self._b) % np.uint64(_MERSENNE_PRIME)
+        return (permuted & np.uint64(0xFFFFFFFF)).min(axis=0)
+
+    def _buckets(self, signature: np.ndarray) -> List[str]:
+        return [hashlib.blake2b(signature[band * self.rows:(band + 1) * self.rows].tobytes(),
+                                digest_size=8).hexdigest() for band in range(self.bands)]
+
+    def _similar(self, signature: np.ndarray, other: np.ndarray) -> bool:
+        return float(np.mean(signature == other)) >= self.threshold
+
+    def _match(self, signature: np.ndarray,
+               buckets: Sequence[str]) -> Optional[Tuple[Optional[str], Optional[str], Optional[bytes]]]:
+        """The chunk id, source and pending key of the chunk `signature` nearly duplicates."""
+        candidates: Set[bytes] = set()
+        for band, bucket in enumerate(buckets):
+            candidates |= self._pending_buckets.get((band, bucket), set())
+        for key in candidates:
+            pending, source = self._pending[key]
+            if self._similar(signature, pending):
+                return None, source, key
+        stored = set()
+        for band, bucket in enumerate(buckets):
+            stored.update(chunk_id for chunk_id, in self._conn.execute(
+                "SELECT chunk_id FROM bands WHERE band = ? AND bucket = ?", (band, bucket)))
+        for chunk_id in stored:
+            row = self._conn.execute("SELECT signature, source FROM signatures WHERE chunk_id = ?",
+                                     (chunk_id,)).fetchone()
+            if row is not None and self._similar(signature, np.frombuffer(row[0], dtype=np.uint64)):
+                return chunk_id, row[1], None
+        return None
+
+    def check(self, text: str, metadata: Optional[Dict[str, Any]] = None) -> Optional[np.ndarray]:
+        """
+        The signature of `text`, or None when it nearly duplicates a chunk already seen. A chunk
+        of another document than `metadata["source"]` is then recorded as repeated by it.
+        """
+        source = (metadata or {}).get("source")
+        signature = self.signature(text)
+        buckets = self._buckets(signature)
+        with self._lock:
+            match = self._match(signature, buckets)
+            if match is not None:
+                self.duplicates += 1
+                self.duplicate_tokens += estimate_tokens(text)
+                chunk_id, kept_source, key = match
+                if source is not None and source != kept_source:
+                    if chunk_id is None:
+                        self._pending_aliases.setdefault(key, {})[source] = dict(metadata)
+                    else:
+                        with self._conn:
+                            self._conn.execute("INSERT OR IGNORE INTO aliases (chunk_id, source, metadata) "
+                                               "VALUES (?, ?, ?)", (chunk_id, source, json.dumps(metadata)))
+                return None
+            key = signature.tobytes()
+            self._pending[key] = (signature, source)
+            for band, bucket in enumerate(buckets):
+                self._pending_buckets.setdefault((band, bucket), set()).add(key)
+        return signature
+
+    def commit(self, chunk_ids: Sequence[str], signatures: Sequence[np.ndarray],
+               sources: Sequence[Optional[str]]) -> None:
+        """Persist the signatures of inserted chunks and the documents found repeating them meanwhile."""
+        aliases = []
+        with self._lock, self._conn:
+            for chunk_id, signature, source in zip(chunk_ids, signatures, sources):
+                key = signature.tobytes()
+                self._pending.pop(key, None)
+                for band, bucket in enumerate(self._buckets(signature)):
+                    self._pending_buckets.get((band, bucket), set()).discard(key)
+                aliases.extend((chunk_id, alias, json.dumps(metadata))
+                               for alias, metadata in self._pending_aliases.pop(key, {}).items() if alias != source)
+            self._conn.executemany("INSERT OR REPLACE INTO signatures (chunk_id, signature, source) VALUES (?, ?, ?)",
+                                   [(chunk_id, signature.tobytes(), source) for chunk_id, signature, source in
+                                    zip(chunk_ids, signatures, sources)])
+            self._conn.executemany("INSERT INTO bands (band, bucket, chunk_id) VALUES (?, ?, ?)",
+                                   [(band, bucket, chunk_id) for chunk_id, signature in zip(chunk_ids, signatures)
+                                    for band, bucket in enumerate(self._buckets(signature))])
+            self._conn.executemany("INSERT OR IGNORE INTO aliases (chunk_id, source, metadata) VALUES (?, ?, ?)",
+                                   aliases)
+
+    def unmarked(self) -> List[str]:
+        """The stored chunks repeated by other documents whose metadata does not carry their id yet."""
+        return [chunk_id for chunk_id, in self._conn.execute("SELECT DISTINCT chunk_id FROM aliases WHERE marked = 0")]
+
+    def mark(self, chunk_ids: Iterable[str]) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany("UPDATE aliases SET marked = 1 WHERE chunk_id = ?",
+                                   [(chunk_id,) for chunk_id in chunk_ids])
+
+    def source_filter(self, sources: Sequence[str]) -> Dict[str, Any]:
+        """
+        A `where` filter on the chunks of the documents `sources`, including the chunks of other
+        documents they repeat.
+        """
+        where: Dict[str, Any] = {"source": {"$in": list(sources)}}
+        chunk_ids = [chunk_id for chunk_id, in self._conn.execute(
+            f"SELECT DISTINCT chunk_id FROM aliases WHERE source IN ({', '.join('?' * len(sources))})",
+            list(sources))] if sources else []
+        return {"$or": [where, {CHUNK_ID_KEY: {"$in": chunk_ids}}]} if chunk_ids else where
+
+    def remove_source(self, source: str, chunk_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Forget the document `source`. Of its chunks `chunk_ids`, the ones another document repeats
+        are returned with the metadata they take when they move to it, the others can be deleted.
+        """
+        moved = {}
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM aliases WHERE source = ?", (source,))
+            for chunk_id in chunk_ids:
+                row = self._conn.execute("SELECT source, metadata FROM aliases WHERE chunk_id = ? ORDER BY rowid "
+                                         "LIMIT 1", (chunk_id,)).fetchone()
+                if row is None:
+                    continue
+                self._conn.execute("DELETE FROM aliases WHERE chunk_id = ? AND source = ?", (chunk_id, row[0]))
+                self._conn.execute("UPDATE signatures SET source = ? WHERE chunk_id = ?", (row[0], chunk_id))
+                moved[chunk_id] = {**json.loads(row[1]), CHUNK_ID_KEY: chunk_id}
+        return moved
+
+    def forget(self, chunk_ids: Iterable[str]) -> None:
+        """Forget deleted chunks, so uploading them again embeds them."""
+        chunk_ids = [(chunk_id,) for chunk_id in chunk_ids]
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM signatures WHERE chunk_id = ?", chunk_ids)
+            self._conn.executemany("DELETE FROM bands WHERE chunk_id = ?", chunk_ids)
+            self._conn.executemany("DELETE FROM aliases WHERE chunk_id = ?", chunk_ids)
+
+    def clear(self) -> None:
+        """Forget every chunk, to be called when the user's vector store is dropped."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM signatures")
+            self._conn.execute("DELETE FROM bands")
+            self._conn.execute("DELETE FROM aliases")
+            self._pending.clear()
+            self._pending_buckets.clear()
+            self._pending_aliases.clear()
+
+    def close(self) -> None:
+        self._conn.close()
@@ -0,0 +1,302 @@
+"""
+Bulk load an archive of PDFs into the knowledge base of a user.
+
+Usage: python -m docmind.ingest.indexer --username alice [--config config.yaml] [--user-data-root user_data]
+                                        [--workers 8] [--embed-workers 4] [--batch-size 96] [--group-size 64]
+                                        PATH [PATH ...]
+
+A PATH is a directory (searched recursively for PDFs), a file or a glob such as "archive/**/*.pdf".
+Files are parsed by `--workers` processes and embedded `--embed-workers` batches at a time.
+
+Every file is hashed and recorded in `user_data/<user>/indexed.db` once its group of `--group-size`
+files is inserted: files already indexed with the same content are skipped, so an interrupted run
+resumes where it stopped, and the chunks of a group left half done are deleted before it is
+indexed again. A file whose content changed replaces the chunks of its previous version. Documents
+are told apart by file name, like uploads.
+"""
+import argparse
+import glob
+import hashlib
+import logging
+import os
+import sqlite3
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from docmind.ingest.cleaning import (
+    DEDUP_DB_FILE,
+    BoilerplateStripper,
+    ChunkDeduplicator,
+)
+from docmind.ingest.pipeline import IngestPipeline, batched, parse_pdf
+from docmind.utils.user_writes import get_user_writer
+from docmind.vectorstore.base import VectorStore
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "indexed.db"
+# the most texts Cohere embeds in one call
+DEFAULT_BATCH_SIZE = 96
+DEFAULT_GROUP_SIZE = 64
+_HASH_BLOCK_SIZE = 1024 * 1024
+
+STARTED = "started"
+DONE = "done"
+
+
+def file_hash(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(_HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def find_files(patterns: Iterable[str], suffix: str = ".pdf") -> List[Path]:
+    """The files of directories (recursively), globs and plain paths, sorted and without repeats."""
+    files = set()
+    for pattern in patterns:
+        path = Path(pattern)
+        if path.is_dir():
+            files.update(file for file in path.rglob("*") if file.is_file() and file.suffix.lower() == suffix)
+        elif path.is_file():
+            files.add(path)
+        else:
+            files.update(Path(match) for match in glob.glob(pattern, recursive=True)
+                         if Path(match).is_file() and Path(match).suffix.lower() == suffix)
+    return sorted(file.resolve() for file in files)
+
+
+class IndexManifest:
+    """The files indexed into a collection, by name (the `source` of their chunks) and content hash."""
+
+    def __init__(self, db_path: Path):
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS files (source TEXT PRIMARY KEY, sha256 TEXT NOT NULL, "
+                               "path TEXT NOT NULL, size INTEGER NOT NULL, status TEXT NOT NULL, "
+                               "updated REAL NOT NULL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS files_sha256 ON files (sha256)")
+
+    def indexed(self, sha256: str) -> bool:
+        return self._conn.execute("SELECT 1 FROM files WHERE sha256 = ? AND status = ?", (sha256, DONE)).fetchone() \
+            is not None
+
+    def version(self, source: str) -> Optional[str]:
+        """The hash of the indexed version of `source`."""
+        row = self._conn.execute("SELECT sha256 FROM files WHERE source = ? AND status = ?", (source, DONE)).fetchone()
+        return row[0] if row else None
+
+    def path(self, source: str) -> Optional[Path]:
+        """Where the indexed version of `source` was read from."""
+        row = self._conn.execute("SELECT path FROM files WHERE source = ? AND status = ?", (source, DONE)).fetchone()
+        return Path(row[0]) if row else None
+
+    def sources_under(self, directory: Path) -> Dict[str, Path]:
+        """The indexed sources read from `directory` or below, with their path."""
+        directory = Path(directory).resolve()
+        return {source: Path(path) for source, path in self._conn.execute(
+            "SELECT source, path FROM files WHERE status = ?", (DONE,)) if Path(path).is_relative_to(directory)}
+
+    def interrupted(self) -> List[str]:
+        return [source for source, in self._conn.execute("SELECT source FROM files WHERE status = ?", (STARTED,))]
+
+    def mark(self, files: Sequence[Tuple[Path, str]], status: str) -> None:
+        with self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO files (source, sha256, path, size, status, updated) "
+                                   "VALUES (?, ?, ?, ?, ?, ?)",
+                                   [(path.name, sha256, str(path), path.stat().st_size, status, time.time())
+                                    for path, sha256 in files])
+
+    def forget(self, source: str) -> None:
+        with self._conn:
+            self._conn.execute("DELETE FROM files WHERE source = ?", (source,))
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+@dataclass
+class IndexReport:
+    files: int = 0
+    skipped: int = 0
+    replaced: int = 0
+    pages: int = 0
+    chunks: int = 0
+    bytes: int = 0
+    duplicates: int = 0
+    seconds: float = 0.0
+
+    def format(self) -> str:
+        seconds = max(self.seconds, 1e-9)
+        return (f"{self.files} files indexed ({self.skipped} unchanged skipped, {self.replaced} replaced), "
+                f"{self.pages} pages, {self.chunks} chunks, {self.duplicates} duplicates skipped, "
+                f"{self.bytes / 1e6:.1f} MB in {self.seconds:.1f} s: {self.files / seconds:.2f} files/s, "
+                f"{self.pages / seconds:.1f} pages/s, {self.chunks / seconds:.1f} chunks/s, "
+                f"{self.bytes / 1e6 / seconds:.2f} MB/s")
+
+
+class BulkIndexer:
+    """
+    Index many files into a user's store in groups, recording every finished group in the
+    IndexManifest so an interrupted run can resume.
+
+    Example:
+        indexer = BulkIndexer(userdb, Path("user_data/alice"), parse_workers=8, embed_workers=4)
+        report = indexer.run(find_files(["archive/"]))
+    """
+
+    def __init__(self, vectorstore: VectorStore, user_data_dir: Path, parse_workers: int = 1,
+                 embed_workers: int = 1, batch_size: int = DEFAULT_BATCH_SIZE, group_size: int = DEFAULT_GROUP_SIZE,
+                 parser: Callable[[Path], Iterable] = parse_pdf,
+                 on_indexed: Optional[Callable[[List[str]], None]] = None,
+                 on_removed: Optional[Callable[[str], None]] = None):
+        self.vectorstore = vectorstore
+        self.user_data_dir = Path(user_data_dir)
+        self.parse_workers = parse_workers
+        self.embed_workers = embed_workers
+        self.batch_size = batch_size
+        self.group_size = group_size
+        self.parser = parser
+        # notified of the documents added and removed, e.g. to list them in a corpus
+        self.on_indexed = on_indexed
+        self.on_removed = on_removed
+        self.manifest = IndexManifest(self.user_data_dir / MANIFEST_FILE)
+        # groups are written in turns with the sessions and jobs writing to the same directory
+        self.writer = get_user_writer(self.user_data_dir)
+
+    def remove(self, source: str) -> None:
+        """Delete the chunks of a document and forget it."""
+        from docmind.upload_and_process_files import delete_document
+
+        with self.writer.write(f"removing {source}"):
+            chunks = delete_document(self.vectorstore, self.user_data_dir, source)
+            self.manifest.forget(source)
+        if self.on_removed is not None:
+            self.on_removed(source)
+        logger.info(f"Removed {chunks} chunks of {source}")
+
+    def plan(self, paths: Iterable[Path], report: IndexReport) -> List[Tuple[Path, str]]:
+        """The files to index with their hash; unchanged files are skipped, replaced ones removed first."""
+        todo: List[Tuple[Path, str]] = []
+        names: Dict[str, Path] = {}
+        for path in paths:
+            sha256 = file_hash(path)
+            if self.manifest.indexed(sha256):
+                report.skipped += 1
+                continue
+            if path.name in names:
+                logger.warning(f"Skipping {path}, {names[path.name]} has the same name and documents are told "
+                               f"apart by name")
+                report.skipped += 1
+                continue
+            names[path.name] = path
+            if self.manifest.version(path.name) is not None:
+                self.remove(path.name)
+                report.replaced += 1
+            todo.append((path, sha256))
+        return todo
+
+    def run(self, paths: Iterable[Path], progress: Optional[Callable[[IndexReport], None]] = None) -> IndexReport:
+        report = IndexReport()
+        start = time.perf_counter()
+        for source in self.manifest.interrupted():
+            # inserted by a group that did not finish, indexed again from scratch
+            self.remove(source)
+        todo = self.plan(paths, report)
+        logger.info(f"Indexing {len(todo)} files into {self.user_data_dir}, {report.skipped} skipped")
+        reference_dir = self.user_data_dir / "reference"
+        reference_dir.mkdir(parents=True, exist_ok=True)
+        deduplicator = ChunkDeduplicator(self.user_data_dir / DEDUP_DB_FILE)
+        try:
+            for group in batched(todo, self.group_size):
+                with self.writer.write("indexing"):
+                    self.manifest.mark(group, STARTED)
+                    pipeline = IngestPipeline(self.vectorstore, batch_size=self.batch_size, parser=self.parser,
+                                              boilerplate=BoilerplateStripper(), deduplicator=deduplicator,
+                                              parse_workers=self.parse_workers, embed_workers=self.embed_workers)
+                    stats = pipeline.run([path for path, _ in group])
+                    if hasattr(self.vectorstore, "flush"):
+                        self.vectorstore.flush()
+                    self.manifest.mark(group, DONE)
+                    for path, _ in group:
+                        # empty placeholders, how the documents of a user are listed
+                        (reference_dir / path.name).touch()
+                if self.on_indexed is not None:
+                    self.on_indexed([path.name for path, _ in group])
+                report.files += stats.files
+                report.pages += stats.pages
+                report.chunks += stats.chunks
+                report.bytes += stats.bytes
+                report.duplicates += stats.duplicates
+                report.seconds = time.perf_counter() - start
+                if progress is not None:
+                    progress(report)
+        finally:
+            deduplicator.close()
+        report.seconds = time.perf_counter() - start
+        return report
+
+    def close(self) -> None:
+        self.manifest.close()
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="directories, files or globs of PDFs")
+    parser.add_argument("--username", required=True)
+    parser.add_argument("--config", type=Path, default=Path("config.yaml"))
+    parser.add_argument("--user-data-root", type=Path, default=Path("user_data"))
+    parser.add_argument("--embedding-model", default="embed-english-v3.0",
+                        help="the model the user chats with in DocumentsChat")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="parsing processes")
+    parser.add_argument("--embed-workers", type=int, default=4, help="batches embedded concurrently")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="chunks per embedding call")
+    parser.add_argument("--group-size", type=int, default=DEFAULT_GROUP_SIZE, help="files per resumable group")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    from docmind.llm.embeddings import DocMindCohereEmbeddings
+    from docmind.llm.resilience import ResilienceSettings, configure_resilience
+    from docmind.llm.scheduler import configure_scheduler
+    from docmind.utils.config import ProjectConfiguration
+    from docmind.utils.env import EnvironmentLoader
+    from docmind.utils.usage import DEFAULT_USAGE_DB_PATH, get_usage_ledger
+    from docmind.vectorstore.factory import open_user_vectorstore
+
+    config = ProjectConfiguration.load_config(args.config)
+    configure_scheduler(config.cohere_max_concurrency, config.cohere_tokens_per_minute)
+    configure_resilience(ResilienceSettings.from_config(config))
+    user_dir = (args.user_data_root / args.username.lower()).resolve()
+    user_dir.mkdir(parents=True, exist_ok=True)
+    if not os.environ.get("COHERE_API_KEY") and (user_dir / ".env").is_file():
+        EnvironmentLoader(env_file_path=user_dir / ".env").load_envs()
+    files = find_files(args.paths)
+    if not files:
+        print(f"No PDF found in {args.paths}")  # noqa: T201
+        return 1
+
+    embedding = DocMindCohereEmbeddings(model=args.embedding_model, username=args.username.lower(),
+                                        ledger=get_usage_ledger(config.usage_db_path or DEFAULT_USAGE_DB_PATH))
+    store = open_user_vectorstore(config, args.username.lower(), user_dir, embedding)
+    indexer = BulkIndexer(store, user_dir, parse_workers=args.workers, embed_workers=args.embed_workers,
+                          batch_size=args.batch_size, group_size=args.group_size)
+    print(f"{len(files)} files found")  # noqa: T201
+    try:
+        report = indexer.run(files, progress=lambda running: print(running.format()))  # noqa: T201
+    except KeyboardInterrupt:
+        print("Interrupted, run the same command again to resume")  # noqa: T201
+        return 130
+    finally:
+        indexer.close()
+        store.close()
+    print(f"Done: {report.format()}")  # noqa: T201
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
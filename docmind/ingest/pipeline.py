@@ -0,0 +1,333 @@
+import logging
+import multiprocessing
+import queue
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import (
+    Callable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_text_splitters import TextSplitter
+
+from docmind.ingest.cleaning import CHUNK_ID_KEY, BoilerplateStripper, ChunkDeduplicator
+from docmind.utils.metrics import REGISTRY, Span, span
+from docmind.vectorstore.base import VectorStore
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+# chunks with their MinHash signature (None without deduplication) and their embeddings
+Batch = Tuple[List[Tuple[Document, Optional[np.ndarray]]], List[List[float]]]
+
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_QUEUE_SIZE = 4
+
+_DONE = object()
+
+
+@dataclass
+class IngestStats:
+    """Running totals of an ingest, passed to the progress callback after every inserted batch."""
+    files: int = 0
+    pages: int = 0
+    chunks: int = 0
+    bytes: int = 0
+    boilerplate_lines: int = 0
+    duplicates: int = 0
+    tokens_saved: int = 0  # estimated tokens of the stripped lines and skipped chunks, not embedded
+    processed_files: List[Path] = field(default_factory=list)
+
+
+class _Failure:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def prefetch(items: Iterable[T], maxsize: int = DEFAULT_QUEUE_SIZE, name: str = "prefetch") -> Iterator[T]:
+    """
+    Iterate `items` in a background thread, at most `maxsize` items ahead of the consumer.
+
+    The producer blocks while the queue is full, so a slow consumer bounds the memory of a fast
+    producer. Errors of the producer are raised in the consumer; when the consumer stops early
+    the producer is stopped at its next item.
+    """
+    buffer: "queue.Queue" = queue.Queue(maxsize=maxsize)
+    stopped = threading.Event()
+
+    def put(item) -> bool:
+        while not stopped.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        try:
+            for item in items:
+                if not put(item):
+                    return
+            put(_DONE)
+        except BaseException as error:  # raised again in the consumer
+            put(_Failure(error))
+        finally:
+            # stops the stages upstream of `items` when the consumer left early
+            close = getattr(items, "close", None)
+            if close is not None:
+                close()
+
+    thread = threading.Thread(target=produce, name=f"docmind-{name}", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def batched(items: Iterable[T], size: int) -> Iterator[List[T]]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def parse_pdf(path: Path) -> Iterator[Document]:
+    """Pages of a PDF, one at a time, with the file name as `source`."""
+    from langchain_community.document_loaders import PyMuPDFLoader
+
+    for doc in PyMuPDFLoader(str(path)).lazy_load():
+        # filter the RAG on the document name instead of the full path
+        doc.metadata["source"] = path.name
+        yield doc
+
+
+def _parse_file(parser: Callable[[Path], Iterable[Document]], path: Path) -> Tuple[List[Document], float]:
+    """All the pages of a file and the seconds spent parsing them, run in a worker process."""
+    start = time.perf_counter()
+    docs = list(parser(path))
+    return docs, time.perf_counter() - start
+
+
+class IngestPipeline:
+    """
+    Streaming ingest of files into a vector store: parse → clean → chunk → embed → insert.
+
+    Pages flow through generators and bounded queues, parsing runs ahead of embedding in its own
+    thread and embedding ahead of inserting, by at most `queue_size` batches of `batch_size`
+    chunks each. Memory therefore depends on those two numbers, not on the size of the upload,
+    and every batch is searchable as soon as it is inserted, before the last file is parsed.
+
+    For bulk loads `parse_workers` processes parse whole files in parallel (the parser must be
+    picklable) and `embed_workers` batches are embedded concurrently, both keeping the file order.
+
+    Example:
+        pipeline = IngestPipeline(userdb, batch_size=64)
+        stats = pipeline.run(Path("user_data/alice/temp").glob("*.pdf"))
+    """
+
+    def __init__(self, vectorstore: VectorStore, batch_size: int = DEFAULT_BATCH_SIZE,
+                 queue_size: int = DEFAULT_QUEUE_SIZE, splitter: Optional[TextSplitter] = None,
+                 escape_parts: Optional[Sequence[str]] = None,
+                 parser: Callable[[Path], Iterable[Document]] = parse_pdf,
+                 boilerplate: Optional[BoilerplateStripper] = None,
+                 deduplicator: Optional[ChunkDeduplicator] = None, parse_workers: int = 1, embed_workers: int = 1):
+        if batch_size < 1 or queue_size < 1 or parse_workers < 1 or embed_workers < 1:
+            raise ValueError("batch_size, queue_size, parse_workers and embed_workers should be at least 1")
+        self.vectorstore = vectorstore
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.splitter = splitter
+        # one scan of every page for all the parts
+        self.escape_pattern = re.compile("|".join(map(re.escape, escape_parts))) if escape_parts else None
+        self.parser = parser
+        self.boilerplate = boilerplate
+        self.deduplicator = deduplicator
+        self.parse_workers = parse_workers
+        self.embed_workers = embed_workers
+
+    # --- stages ------------------------------------------------------------------------
+
+    def parse(self, paths: Iterable[Path], stats: IngestStats) -> Iterator[Document]:
+        if self.parse_workers > 1:
+            yield from self._parse_in_processes(paths, stats)
+            return
+        for path in paths:
+            logger.info(f"Processing file: {path}")
+            size = path.stat().st_size
+            pages = self.parser(path)
+            # only the time spent parsing, not the time waiting for the next stages
+            parse_span = Span("parse", attributes={"documents": 0, "bytes": size})
+            while True:
+                start = time.perf_counter()
+                doc = next(pages, None)
+                parse_span.duration += time.perf_counter() - start
+                if doc is None:
+                    break
+                parse_span.attributes["documents"] += 1
+                yield doc
+            REGISTRY.record(parse_span)
+            stats.files += 1
+            stats.pages += parse_span.attributes["documents"]
+            stats.bytes += size
+            stats.processed_files.append(path)
+
+    def _parse_in_processes(self, paths: Iterable[Path], stats: IngestStats) -> Iterator[Document]:
+        # spawned, forking a process with running threads may deadlock on the locks they hold
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(self.parse_workers, mp_context=context) as executor:
+            pending: "deque[Tuple[Path, Future]]" = deque()
+            for path in paths:
+                logger.info(f"Processing file: {path}")
+                pending.append((path, executor.submit(_parse_file, self.parser, path)))
+                if len(pending) >= 2 * self.parse_workers:
+                    yield from self._parsed(*pending.popleft(), stats)
+            while pending:
+                yield from self._parsed(*pending.popleft(), stats)
+
+    @staticmethod
+    def _parsed(path: Path, future: Future, stats: IngestStats) -> List[Document]:
+        docs, seconds = future.result()
+        size = path.stat().st_size
+        REGISTRY.record(Span("parse", duration=seconds, attributes={"documents": len(docs), "bytes": size}))
+        stats.files += 1
+        stats.pages += len(docs)
+        stats.bytes += size
+        stats.processed_files.append(path)
+        return docs
+
+    def clean(self, docs: Iterable[Document]) -> Iterator[Document]:
+        """
+        Strip the boilerplate lines, then drop empty pages, the embedding endpoint rejects empty
+        strings, and pages with `escape_parts`.
+        """
+        if self.boilerplate is not None:
+            docs = self.boilerplate.strip(docs)
+        for doc in docs:
+            if not doc.page_content.strip():
+                continue
+            if self.escape_pattern is not None and self.escape_pattern.search(doc.page_content):
+                continue
+            yield doc
+
+    def chunk(self, docs: Iterable[Document]) -> Iterator[Document]:
+        """Split every page with the splitter, a page is one chunk without it."""
+        for doc in docs:
+            if self.splitter is None:
+                yield doc
+            else:
+                yield from self.splitter.split_documents([doc])
+
+    def dedupe(self, docs: Iterable[Document]) -> Iterator[Tuple[Document, Optional[np.ndarray]]]:
+        """Skip the near-duplicates of chunks already in the collection, each chunk comes with its signature."""
+        for doc in docs:
+            if self.deduplicator is None:
+                yield doc, None
+                continue
+            signature = self.deduplicator.check(doc.page_content, doc.metadata)
+            if signature is not None:
+                yield doc, signature
+
+    def _embed(self, batch: List[Tuple[Document, Optional[np.ndarray]]]) -> List[List[float]]:
+        return self.vectorstore.embedding.embed_documents([doc.page_content for doc, _ in batch])
+
+    def embed(self, batches: Iterable[List[Tuple[Document, Optional[np.ndarray]]]]) -> Iterator[Batch]:
+        if self.embed_workers == 1:
+            for batch in batches:
+                yield batch, self._embed(batch)
+            return
+        with ThreadPoolExecutor(self.embed_workers, thread_name_prefix="docmind-embed") as executor:
+            pending: "deque[Tuple[list, Future]]" = deque()
+            for batch in batches:
+                pending.append((batch, executor.submit(self._embed, batch)))
+                if len(pending) >= self.embed_workers:
+                    batch, future = pending.popleft()
+                    yield batch, future.result()
+            while pending:
+                batch, future = pending.popleft()
+                yield batch, future.result()
+
+    def insert(self, batch: List[Tuple[Document, Optional[np.ndarray]]], embeddings: List[List[float]]) -> List[str]:
+        docs = [doc for doc, _ in batch]
+        with span("insert", documents=len(docs), bytes=sum(len(doc.page_content.encode()) for doc in docs)):
+            ids = self.vectorstore.add_embeddings([doc.page_content for doc in docs], embeddings,
+                                                  [doc.metadata for doc in docs])
+        if self.deduplicator is not None:
+            self.deduplicator.commit(ids, [signature for _, signature in batch],
+                                     [doc.metadata.get("source") for doc in docs])
+        return ids
+
+    def mark_repeated(self) -> None:
+        """Write their id into the metadata of the chunks other documents repeat, filters name them by it."""
+        if self.deduplicator is None:
+            return
+        chunk_ids = self.deduplicator.unmarked()
+        if not chunk_ids:
+            return
+        found, docs, vectors = self.vectorstore.get_chunks(chunk_ids)
+        rows = [i for i, doc in enumerate(docs) if doc.metadata.get(CHUNK_ID_KEY) != found[i]]
+        if rows:
+            self.vectorstore.add_embeddings([docs[i].page_content for i in rows], vectors[rows],
+                                            [{**docs[i].metadata, CHUNK_ID_KEY: found[i]} for i in rows],
+                                            [found[i] for i in rows])
+        self.deduplicator.mark(chunk_ids)
+
+    # --- run ---------------------------------------------------------------------------
+
+    def run(self, paths: Iterable[Path], on_batch: Optional[Callable[[IngestStats], None]] = None) -> IngestStats:
+        """Ingest `paths` and return the totals, `on_batch` is called after every inserted batch."""
+        stats = IngestStats()
+        baseline = self._savings()
+        chunks = self.dedupe(self.chunk(self.clean(self.parse(paths, stats))))
+        batches = prefetch(batched(chunks, self.batch_size), self.queue_size, name="parse")
+        for batch, embeddings in prefetch(self.embed(batches), self.queue_size, name="embed"):
+            self.insert(batch, embeddings)
+            stats.chunks += len(batch)
+            self._update_savings(stats, baseline)
+            if on_batch is not None:
+                on_batch(stats)
+        self._update_savings(stats, baseline)
+        self.mark_repeated()
+        logger.info(f"Ingested {stats.chunks} chunks from {stats.pages} pages of {stats.files} files, "
+                    f"{stats.boilerplate_lines} boilerplate lines stripped, {stats.duplicates} duplicate chunks "
+                    f"skipped, about {stats.tokens_saved} tokens saved")
+        return stats
+
+    def _savings(self) -> Tuple[int, int, int]:
+        """Boilerplate lines, duplicates and tokens saved by the cleaners since they were created."""
+        lines = self.boilerplate.removed_lines if self.boilerplate is not None else 0
+        duplicates = self.deduplicator.duplicates if self.deduplicator is not None else 0
+        tokens = (self.boilerplate.removed_tokens if self.boilerplate is not None else 0) \
+            + (self.deduplicator.duplicate_tokens if self.deduplicator is not None else 0)
+        return lines, duplicates, tokens
+
+    def _update_savings(self, stats: IngestStats, baseline: Tuple[int, int, int]) -> None:
+        lines, duplicates, tokens = self._savings()
+        stats.boilerplate_lines = lines - baseline[0]
+        stats.duplicates = duplicates - baseline[1]
+        stats.tokens_saved = tokens - baseline[2]
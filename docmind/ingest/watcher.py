@@ -0,0 +1,195 @@
+"""
+Keep collections in sync with drop folders: PDFs added, changed or deleted in a watched folder are
+ingested, replaced or removed without anyone uploading them.
+
+Usage: python -m docmind.ingest.watcher [--config config.yaml] [--user-data-root user_data]
+
+The folders are configured in `watch_folders`, keyed by the user or, prefixed with "corpus:", the
+shared corpus they feed:
+
+    watch_folders:
+      alice: /mnt/shared/alice
+      corpus:manuals: /mnt/shared/manuals
+
+Events (inotify on Linux, through watchdog) are debounced for `watch_debounce` seconds, so a file
+is ingested once it stopped being written. Files are indexed with the BulkIndexer: the manifest of
+the collection tells unchanged files from changed ones, and the chunks of deleted files are
+removed. Every folder is reconciled with its collection on start, catching up with what changed
+while the watcher was not running.
+"""
+import argparse
+import logging
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+from docmind.ingest.indexer import BulkIndexer, find_files
+
+logger = logging.getLogger(__name__)
+
+CORPUS_PREFIX = "corpus:"
+DEFAULT_DEBOUNCE = 5.0
+_SUFFIX = ".pdf"
+
+
+class DropFolder:
+    """
+    A watched folder and the collection it feeds, through `indexer`.
+
+    `notify` records the paths events were seen for; `due` hands out those quiet for `debounce`
+    seconds and `sync` indexes the ones still there and removes the deleted ones.
+    """
+
+    def __init__(self, directory: Path, indexer: BulkIndexer, debounce: float = DEFAULT_DEBOUNCE):
+        self.directory = Path(directory).resolve()
+        self.indexer = indexer
+        self.debounce = debounce
+        self._pending: Dict[Path, float] = {}
+        self._lock = threading.Lock()
+
+    def notify(self, path: Path) -> None:
+        path = Path(path)
+        if path.suffix.lower() != _SUFFIX:
+            return
+        with self._lock:
+            self._pending[path.resolve()] = time.monotonic()
+
+    def due(self, now: Optional[float] = None) -> List[Path]:
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            ready = sorted(path for path, seen in self._pending.items() if now - seen >= self.debounce)
+            for path in ready:
+                del self._pending[path]
+        return ready
+
+    def sync(self, paths: Sequence[Path]) -> None:
+        for path in paths:
+            if not path.is_file() and self.indexer.manifest.path(path.name) == path:
+                logger.info(f"{path} was deleted from {self.directory}")
+                self.indexer.remove(path.name)
+        existing = [path for path in paths if path.is_file()]
+        if existing:
+            report = self.indexer.run(existing)
+            logger.info(f"Synced {self.directory}: {report.format()}")
+
+    def reconcile(self) -> None:
+        """Catch up with the changes made while nobody was watching."""
+        present = set(find_files([str(self.directory)]))
+        gone = [path for path in self.indexer.manifest.sources_under(self.directory).values() if path not in present]
+        self.sync(gone + sorted(present))
+
+
+class FolderWatcher:
+    """Watches drop folders with a watchdog observer and syncs them from one thread."""
+
+    def __init__(self, folders: Sequence[DropFolder], poll_interval: float = 1.0):
+        self.folders = list(folders)
+        self.poll_interval = poll_interval
+        self._stopped = threading.Event()
+
+    def _handler(self, folder: DropFolder):
+        from watchdog.events import FileSystemEventHandler
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if event.is_directory:
+                    return
+                folder.notify(Path(event.src_path))
+                # a move is a deletion of the source and a creation of the destination
+                if getattr(event, "dest_path", None):
+                    folder.notify(Path(event.dest_path))
+
+        return Handler()
+
+    def run(self) -> None:
+        from watchdog.observers import Observer
+
+        observer = Observer()
+        for folder in self.folders:
+            folder.directory.mkdir(parents=True, exist_ok=True)
+            observer.schedule(self._handler(folder), str(folder.directory), recursive=True)
+        observer.start()
+        try:
+            for folder in self.folders:
+                self._safely(folder, folder.reconcile)
+            while not self._stopped.wait(self.poll_interval):
+                for folder in self.folders:
+                    paths = folder.due()
+                    if paths:
+                        self._safely(folder, lambda: folder.sync(paths))
+        finally:
+            observer.stop()
+            observer.join()
+
+    @staticmethod
+    def _safely(folder: DropFolder, sync) -> None:
+        # a broken file or an unreachable embedding endpoint must not stop the other folders
+        try:
+            sync()
+        except Exception:
+            logger.exception(f"Syncing {folder.directory} failed, it is retried on its next change")
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config", type=Path, default=Path("config.yaml"))
+    parser.add_argument("--user-data-root", type=Path, default=Path("user_data"))
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    from docmind.llm.embeddings import DocMindCohereEmbeddings
+    from docmind.llm.resilience import ResilienceSettings, configure_resilience
+    from docmind.llm.scheduler import configure_scheduler
+    from docmind.utils.config import ProjectConfiguration
+    from docmind.utils.usage import DEFAULT_USAGE_DB_PATH, get_usage_ledger
+    from docmind.vectorstore.factory import open_user_vectorstore
+    from docmind.vectorstore.shared import DEFAULT_SHARED_DIR, CorpusRegistry
+
+    config = ProjectConfiguration.load_config(args.config)
+    configure_scheduler(config.cohere_max_concurrency, config.cohere_tokens_per_minute)
+    configure_resilience(ResilienceSettings.from_config(config))
+    if not config.watch_folders:
+        print("No watch_folders in the configuration")  # noqa: T201
+        return 1
+    ledger = get_usage_ledger(config.usage_db_path or DEFAULT_USAGE_DB_PATH)
+    registry = CorpusRegistry(config.shared_corpora_dir or DEFAULT_SHARED_DIR)
+    folders, stores = [], []
+    for owner, directory in config.watch_folders.items():
+        if owner.startswith(CORPUS_PREFIX):
+            name = owner[len(CORPUS_PREFIX):]
+            embedding = DocMindCohereEmbeddings(model=registry.get(name).embedding_model, ledger=ledger,
+                                                username=owner)
+            store = registry.open_for_ingest(name, embedding)
+            indexer = BulkIndexer(store, registry.directory / name,
+                                  on_indexed=lambda sources, name=name: registry.add_documents(name, sources),
+                                  on_removed=lambda source, name=name: registry.remove_documents(name, [source]))
+        else:
+            user_dir = (args.user_data_root / owner.lower()).resolve()
+            user_dir.mkdir(parents=True, exist_ok=True)
+            embedding = DocMindCohereEmbeddings(model=config.api_embedding_model, ledger=ledger, username=owner)
+            store = open_user_vectorstore(config, owner.lower(), user_dir, embedding)
+            indexer = BulkIndexer(store, user_dir)
+        stores.append(store)
+        folders.append(DropFolder(Path(directory), indexer, debounce=config.watch_debounce))
+        logger.info(f"Watching {directory} for {owner}")
+
+    try:
+        FolderWatcher(folders).run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for folder in folders:
+            folder.indexer.close()
+        for store in stores:
+            store.close()
+        registry.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,246 @@
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.documents import Document
+from langchain_core.outputs import LLMResult
+
+from docmind.utils.metrics import REGISTRY, MetricsRegistry, Span
+from docmind.utils.usage import (
+    CHAT_STAGE,
+    GENERATE_STAGE,
+    REPHRASE_STAGE,
+    UsageLedger,
+    estimate_tokens,
+)
+
+# run names used in create_llm_chain mapped to the stage they are reported as
+CHAIN_STAGES = {
+    "CondenseQuestion": "condense_question",
+    "FindDocs": "retrieval",
+    "Rerank": "rerank",
+    "FormatDocs": "format_docs",
+    "GenerateResponse": "generate",
+}
+RETRIEVER_STAGE = "vector_search"
+LLM_STAGE = "llm"
+
+# run names mapped to the stages recorded in the usage ledger
+USAGE_STAGES = {
+    "CondenseQuestion": REPHRASE_STAGE,
+    "GenerateResponse": GENERATE_STAGE,
+}
+# model parameters stored with each usage entry
+USAGE_SETTINGS = ("temperature", "max_tokens", "prompt_truncation", "connectors")
+
+
+def token_usage(response: LLMResult) -> Tuple[int, int]:
+    """Extract (input, output) token counts from a Cohere chat response, (0, 0) when unknown."""
+    input_tokens = output_tokens = 0
+    for generations in response.generations:
+        for generation in generations:
+            message = getattr(generation, "message", None)
+            usage = getattr(message, "usage_metadata", None)
+            if usage:
+                input_tokens += int(usage.get("input_tokens") or 0)
+                output_tokens += int(usage.get("output_tokens") or 0)
+                continue
+            info = (generation.generation_info or {}).get("token_count") or {}
+            input_tokens += int(info.get("input_tokens") or info.get("prompt_tokens") or 0)
+            output_tokens += int(info.get("output_tokens") or info.get("response_tokens") or 0)
+    return input_tokens, output_tokens
+
+
+class StageTrackingCallback(BaseCallbackHandler):
+    """
+    Keeps the run tree of a chain invocation, so events of nested runs (LLM calls, retrievers)
+    can be attributed to the pipeline stage they belong to.
+    """
+
+    def __init__(self, stages: Optional[Dict[str, str]] = None):
+        self.stages = CHAIN_STAGES if stages is None else stages
+        self._parents: Dict[UUID, Optional[UUID]] = {}
+        self._stage_of_run: Dict[UUID, str] = {}
+
+    def _track(self, run_id: UUID, parent_run_id: Optional[UUID], name: Optional[str]) -> None:
+        self._parents[run_id] = parent_run_id
+        if name in self.stages:
+            self._stage_of_run[run_id] = self.stages[name]
+
+    def stage_of(self, run_id: UUID, default: str = LLM_STAGE) -> str:
+        """Return the innermost known stage `run_id` runs in."""
+        current: Optional[UUID] = run_id
+        while current is not None:
+            if current in self._stage_of_run:
+                return self._stage_of_run[current]
+            current = self._parents.get(current)
+        return default
+
+    def on_chain_start(self, serialized: Dict[str, Any], inputs: Dict[str, Any], *, run_id: UUID,
+                       parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        self._track(run_id, parent_run_id, kwargs.get("name") or (serialized or {}).get("name"))
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], *, run_id: UUID,
+                            parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        self._track(run_id, parent_run_id, None)
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID,
+                     parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        self._track(run_id, parent_run_id, None)
+
+    def on_retriever_start(self, serialized: Dict[str, Any], query: str, *, run_id: UUID,
+                           parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        self._track(run_id, parent_run_id, None)
+
+
+class StageTimingCallback(StageTrackingCallback):
+    """
+    Records a span per pipeline stage of a RAG or chat invocation: duration, tokens,
+    documents and bytes. Spans go to the metrics registry and are kept in `spans` for a
+    per-answer breakdown.
+
+    Example:
+        timings = StageTimingCallback()
+        for chunk in chain.stream(inputs, config={"callbacks": [timings]}):
+            ...
+        timings.breakdown()
+    """
+
+    def __init__(self, registry: MetricsRegistry = REGISTRY, stages: Optional[Dict[str, str]] = None):
+        super().__init__(stages)
+        self.registry = registry
+        self.spans: List[Span] = []
+        self._started: Dict[UUID, Tuple[float, Span]] = {}
+        self._llm_started: Dict[UUID, float] = {}
+
+    def _start(self, run_id: UUID, stage: str) -> None:
+        self._started[run_id] = (time.perf_counter(), Span(stage=stage))
+
+    def _end(self, run_id: UUID, **attributes: Any) -> None:
+        started = self._started.pop(run_id, None)
+        if started is None:
+            return
+        start, current = started
+        current.duration = time.perf_counter() - start
+        current.attributes.update({key: value for key, value in attributes.items() if value is not None})
+        self.spans.append(current)
+        self.registry.record(current)
+
+    def _add_to_stage(self, run_id: UUID, **attributes: int) -> None:
+        """Add counts to the stage span enclosing `run_id` that is still running."""
+        current: Optional[UUID] = run_id
+        while current is not None:
+            if current in self._stage_of_run and current in self._started:
+                stage_attributes = self._started[current][1].attributes
+                for key, value in attributes.items():
+                    stage_attributes[key] = stage_attributes.get(key, 0) + value
+                return
+            current = self._parents.get(current)
+
+    def on_chain_start(self, serialized: Dict[str, Any], inputs: Dict[str, Any], *, run_id: UUID,
+                       parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        super().on_chain_start(serialized, inputs, run_id=run_id, parent_run_id=parent_run_id, **kwargs)
+        if run_id in self._stage_of_run:
+            self._start(run_id, self._stage_of_run[run_id])
+
+    def on_chain_end(self, outputs: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        if run_id not in self._started:
+            return
+        if isinstance(outputs, str):
+            self._end(run_id, bytes=len(outputs.encode()))
+        elif isinstance(outputs, Sequence) and all(isinstance(doc, Document) for doc in outputs):
+            self._end(run_id, documents=len(outputs))
+        else:
+            self._end(run_id)
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, error=1)
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], *, run_id: UUID,
+                            parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        super().on_chat_model_start(serialized, messages, run_id=run_id, parent_run_id=parent_run_id, **kwargs)
+        self._llm_started[run_id] = time.perf_counter()
+        # a model called outside of a known stage, e.g. llm.stream in the chat page, is a stage itself
+        if self.stage_of(run_id, default="") == "":
+            self._stage_of_run[run_id] = LLM_STAGE
+            self._start(run_id, LLM_STAGE)
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        started = self._llm_started.pop(run_id, None)
+        if started is not None:
+            self._add_to_stage(run_id, first_token=round(time.perf_counter() - started, 3))
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        self._llm_started.pop(run_id, None)
+        input_tokens, output_tokens = token_usage(response)
+        self._add_to_stage(run_id, input_tokens=input_tokens, output_tokens=output_tokens)
+        self._end(run_id)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._llm_started.pop(run_id, None)
+        self._end(run_id, error=1)
+
+    def on_retriever_start(self, serialized: Dict[str, Any], query: str, *, run_id: UUID,
+                           parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        super().on_retriever_start(serialized, query, run_id=run_id, parent_run_id=parent_run_id, **kwargs)
+        self._start(run_id, RETRIEVER_STAGE)
+
+    def on_retriever_end(self, documents: Sequence[Document], *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, documents=len(documents), bytes=sum(len(doc.page_content.encode()) for doc in documents))
+
+    def on_retriever_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, error=1)
+
+    def breakdown(self) -> List[Dict[str, Any]]:
+        """Rows describing each recorded stage, in completion order."""
+        return [
+            {"stage": current.stage, "duration_ms": round(current.duration * 1000, 1), **current.attributes}
+            for current in self.spans
+        ]
+
+
+class UsageCallback(StageTrackingCallback):
+    """
+    Records the tokens of every LLM call in the usage ledger, attributed to the user, the
+    conversation and the pipeline stage (rephrase, generate, or chat outside of a chain).
+    Token counts are estimated from the text when the response carries no usage metadata.
+    """
+
+    def __init__(self, ledger: UsageLedger, username: str, conversation: Optional[str] = None,
+                 stages: Optional[Dict[str, str]] = None):
+        super().__init__(USAGE_STAGES if stages is None else stages)
+        self.ledger = ledger
+        self.username = username
+        self.conversation = conversation
+        self._calls: Dict[UUID, Tuple[float, int, Dict[str, Any]]] = {}
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], *, run_id: UUID,
+                            parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        super().on_chat_model_start(serialized, messages, run_id=run_id, parent_run_id=parent_run_id, **kwargs)
+        prompt_tokens = sum(estimate_tokens(str(message.content)) for batch in messages for message in batch)
+        self._calls[run_id] = (time.perf_counter(), prompt_tokens, kwargs.get("invocation_params") or {})
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        started, prompt_tokens, params = self._calls.pop(run_id, (time.perf_counter(), 0, {}))
+        input_tokens, output_tokens = token_usage(response)
+        estimated = not (input_tokens or output_tokens)
+        if estimated:
+            input_tokens = prompt_tokens
+            output_tokens = sum(estimate_tokens(generation.text) for batch in response.generations
+                                for generation in batch)
+
+        self.ledger.record(
+            self.username,
+            self.stage_of(run_id, default=CHAT_STAGE),
+            conversation=self.conversation,
+            model=params.get("model") or params.get("model_name"),
+            settings={key: params[key] for key in USAGE_SETTINGS if params.get(key) is not None},
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            estimated=estimated,
+            latency=time.perf_counter() - started,
+        )
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._calls.pop(run_id, None)
@@ -0,0 +1,171 @@
+import json
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+
+from docmind.utils.env import cohere_base_url
+from docmind.utils.helper import atomic_write
+
+logger = logging.getLogger(__name__)
+
+CATALOGUE_TTL = 24 * 60 * 60  # seconds
+RETRY_DELAY = 30.0  # seconds before a failed fetch is retried, doubled after every failure
+MAX_RETRY_DELAY = 30 * 60.0
+DEFAULT_CACHE_PATH = Path("user_data") / ".cache" / "cohere_models.json"
+
+# Served when the API is unreachable and no catalogue was ever cached.
+FALLBACK_MODELS = {
+    "command-r": {"context_length": 128000, "endpoints": ["generate", "chat", "summarize"]},
+    "command-r-plus": {"context_length": 128000, "endpoints": ["generate", "chat", "summarize"]},
+    "command": {"context_length": 4096, "endpoints": ["generate", "chat", "summarize"]},
+    "command-light": {"context_length": 4096, "endpoints": ["generate", "chat", "summarize"]},
+    "embed-english-v3.0": {"context_length": 512, "endpoints": ["embed"]},
+    "embed-multilingual-v3.0": {"context_length": 512, "endpoints": ["embed"]},
+    "embed-english-light-v3.0": {"context_length": 512, "endpoints": ["embed"]},
+    "embed-multilingual-light-v3.0": {"context_length": 512, "endpoints": ["embed"]},
+    "rerank-english-v3.0": {"context_length": 4096, "endpoints": ["rerank"]},
+    "rerank-multilingual-v3.0": {"context_length": 4096, "endpoints": ["rerank"]},
+}
+
+
+def _default_client_factory() -> Any:
+    import cohere
+
+    return cohere.Client(timeout=10, base_url=cohere_base_url())
+
+
+class ModelCatalogue:
+    """
+    Cohere model catalogue persisted to disk with a TTL.
+
+    `get` never waits for the API when a catalogue is known: a stale catalogue is returned
+    immediately and refreshed in a background thread. Only the very first call, with nothing
+    cached on disk, fetches synchronously. While it runs, or once it failed, `FALLBACK_MODELS`
+    is returned right away and the fetch is retried in the background with a growing delay.
+
+    Example:
+        catalogue = ModelCatalogue(Path("models.json"), client_factory=lambda: StubClient())
+        models = catalogue.get()
+    """
+
+    def __init__(
+            self,
+            cache_path: Union[str, Path] = DEFAULT_CACHE_PATH,
+            ttl: float = CATALOGUE_TTL,
+            client_factory: Optional[Callable[[], Any]] = None,
+    ):
+        self.cache_path = Path(cache_path)
+        self.ttl = ttl
+        self.client_factory = client_factory or _default_client_factory
+        self._models: Optional[Dict[str, Dict]] = None
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+        self._refresh_thread: Optional[threading.Thread] = None
+        self._fetching = False
+        self._failures = 0
+        self._retry_at = 0.0
+
+    @property
+    def is_stale(self) -> bool:
+        return time.time() - self._fetched_at > self.ttl
+
+    def get(self) -> Dict[str, Dict]:
+        """Return the last known catalogue, scheduling a refresh when it expired."""
+        with self._lock:
+            if self._models is None:
+                self._models, self._fetched_at = self._read_cache()
+
+            if self._models is not None:
+                if self.is_stale and time.time() >= self._retry_at:
+                    self._refresh_in_background()
+                return self._models
+            if self._fetching or self._failures:
+                # the first fetch failed or is running, do not queue every rerun behind the API
+                if not self._fetching and time.time() >= self._retry_at:
+                    self._refresh_in_background()
+                return dict(FALLBACK_MODELS)
+            self._fetching = True
+
+        try:
+            models = self._fetch()
+        except Exception as e:
+            logger.warning(f"Failed to fetch the Cohere model catalogue, using the fallback list: {e}")
+            with self._lock:
+                self._fetching = False
+                self._failed()
+            return dict(FALLBACK_MODELS)
+        with self._lock:
+            self._fetching = False
+            self._store(models)
+            return self._models
+
+    def refresh(self) -> Dict[str, Dict]:
+        """Fetch the catalogue from the API now and persist it."""
+        models = self._fetch()
+        with self._lock:
+            self._store(models)
+        return models
+
+    def wait_for_refresh(self, timeout: Optional[float] = None) -> None:
+        thread = self._refresh_thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def _refresh_in_background(self) -> None:
+        if self._refresh_thread is not None and self._refresh_thread.is_alive():
+            return
+        self._fetching = True
+        self._refresh_thread = threading.Thread(target=self._background_refresh, name="cohere-catalogue",
+                                                daemon=True)
+        self._refresh_thread.start()
+
+    def _background_refresh(self) -> None:
+        try:
+            self.refresh()
+            logger.info("Refreshed the Cohere model catalogue.")
+        except Exception as e:
+            with self._lock:
+                self._failed()
+            logger.warning(f"Failed to refresh the Cohere model catalogue, retrying in "
+                           f"{self._retry_at - time.time():.0f}s: {e}")
+        finally:
+            with self._lock:
+                self._fetching = False
+
+    def _failed(self) -> None:
+        self._failures += 1
+        self._retry_at = time.time() + min(RETRY_DELAY * 2 ** (self._failures - 1), MAX_RETRY_DELAY)
+
+    def _fetch(self) -> Dict[str, Dict]:
+        # {'summarize', 'chat', 'generate'}
+        response = self.client_factory().models.list()
+        models = {}
+        for model in response.models:
+            models[model.name] = {
+                'context_length': model.context_length,
+                'endpoints': list(model.endpoints or []),
+            }
+        return models
+
+    def _store(self, models: Dict[str, Dict]) -> None:
+        self._models = models
+        self._fetched_at = time.time()
+        self._failures, self._retry_at = 0, 0.0
+        try:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            atomic_write(self.cache_path, json.dumps({"fetched_at": self._fetched_at, "models": models}, indent=4))
+        except OSError as e:
+            logger.warning(f"Failed to persist the Cohere model catalogue to {self.cache_path}: {e}")
+
+    def _read_cache(self) -> Tuple[Optional[Dict[str, Dict]], float]:
+        try:
+            with self.cache_path.open("r", encoding="utf-8") as file:
+                cached = json.load(file)
+            return cached["models"], float(cached["fetched_at"])
+        except FileNotFoundError:
+            return None, 0.0
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Ignoring corrupted model catalogue cache {self.cache_path}: {e}")
+            return None, 0.0
@@ -0,0 +1,113 @@
+import logging
+import time
+from contextlib import closing
+from typing import Any, Iterator, List, Optional
+
+from langchain_cohere import ChatCohere
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from langchain_core.pydantic_v1 import Field
+
+from docmind.llm.resilience import (
+    CHAT,
+    NO_SDK_RETRIES,
+    LLMUnavailableError,
+    call_with_retries,
+    get_circuit_breaker,
+    get_settings,
+    hedged,
+    is_retryable,
+    timed_stream,
+)
+from docmind.llm.scheduler import INTERACTIVE, get_scheduler
+from docmind.utils.env import cohere_base_url
+from docmind.utils.usage import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+
+def prompt_tokens(messages: List[BaseMessage]) -> int:
+    return sum(estimate_tokens(str(message.content)) for message in messages)
+
+
+class DocMindChatCohere(ChatCohere):
+    """
+    ChatCohere whose calls wait for a slot of the process wide scheduler, charged to `username`.
+    A stream holds its slot until the last token is read or the stream is closed.
+
+    Calls go through the circuit breaker of the chat endpoint. A stream fails with StreamTimeoutError
+    when its first or next token is late and is retried only until its first token was produced,
+    non-streamed calls are retried and, with `hedge`, hedged after the configured delay.
+    """
+
+    username: Optional[str] = None
+    priority: int = INTERACTIVE
+    hedge: bool = False
+    base_url: Optional[str] = Field(default_factory=cohere_base_url)
+    timeout_seconds: Optional[float] = Field(default_factory=lambda: get_settings().request_timeout)
+
+    def condenser(self) -> "DocMindChatCohere":
+        """This model for the short non-streamed calls rewriting a follow up question, hedged when configured."""
+        # copy() would drop the excluded fields, e.g. callbacks, and a new instance would open new clients
+        return self.construct(_fields_set=self.__fields_set__,
+                              **{**self.__dict__, "disable_streaming": True, "hedge": True})
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        settings = get_settings()
+        breaker = get_circuit_breaker(CHAT)
+        kwargs.setdefault("request_options", NO_SDK_RETRIES)
+        attempt = 0
+        while True:
+            attempt += 1
+            breaker.allow()
+            started = False
+            try:
+                with get_scheduler().slot(self.username, self.priority, tokens=prompt_tokens(messages)) as slot:
+                    stream = super()._stream(messages, stop=stop, run_manager=run_manager, **kwargs)
+                    with closing(timed_stream(stream, settings.first_token_timeout,
+                                              settings.inter_token_timeout)) as chunks:
+                        for chunk in chunks:
+                            started = True
+                            if chunk.message.content and isinstance(chunk.message.content, str):
+                                slot.add_tokens(estimate_tokens(chunk.message.content))
+                            yield chunk
+            except GeneratorExit:
+                # closed by the reader, says nothing about the API
+                breaker.release()
+                raise
+            except Exception as error:
+                if not is_retryable(error):
+                    breaker.release()
+                    raise
+                breaker.failure()
+                # a user already reading the answer would see it start over
+                if started or attempt >= settings.attempts:
+                    if isinstance(error, LLMUnavailableError):
+                        raise
+                    raise LLMUnavailableError(f"Cohere chat failed after {attempt} attempts: {error!r}") from error
+                delay = settings.delay(attempt)
+                logger.warning(f"Cohere chat stream failed before its first token ({error!r}), "
+                               f"retry {attempt} in {delay:.2f}s")
+                time.sleep(delay)
+                continue
+            breaker.success()
+            return
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        if self.streaming:
+            # served by _stream, which takes the slot
+            return super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        kwargs.setdefault("request_options", NO_SDK_RETRIES)
+
+        def generate() -> ChatResult:
+            with get_scheduler().slot(self.username, self.priority, tokens=prompt_tokens(messages)) as slot:
+                result = super(DocMindChatCohere, self)._generate(messages, stop=stop, run_manager=run_manager,
+                                                                  **kwargs)
+                slot.add_tokens(sum(estimate_tokens(generation.text) for generation in result.generations))
+            return result
+
+        hedge_after = get_settings().hedge_after if self.hedge else None
+        return call_with_retries(lambda: hedged(generate, hedge_after), CHAT)
@@ -10,6 +10,8 @@ from langchain_core.pydantic_v1 import BaseModel
 from langchain_core.retrievers import BaseRetriever
 from langchain_core.runnables import Runnable, RunnableBranch, RunnableLambda, RunnablePassthrough
 
+from docmind.llm.rerank import DEFAULT_TOP_N, Reranker, create_rerank_chain
+
 REPHRASE_TEMPLATE = """\
 Given the following conversation and a follow up question, rephrase the follow up \
 question to be a standalone question.
@@ -100,10 +102,16 @@ def format_docs(docs: Sequence[Document]) -> str:
     return "\n".join(formatted_docs)
 
 
-def create_retriever_chain(llm: LanguageModelLike, retriever: BaseRetriever) -> Runnable:
+def create_retriever_chain(llm: LanguageModelLike, retriever: BaseRetriever, reranker: Optional[Reranker] = None,
+                           top_n: int = DEFAULT_TOP_N, condense_llm: Optional[LanguageModelLike] = None) -> Runnable:
+    # the question is condensed by `condense_llm` when given, e.g. a non-streaming hedged model
+    # only the top_n reranked candidates reach the prompt
+    if reranker is not None:
+        retriever = create_rerank_chain(retriever, reranker, top_n)
+
     condense_question_prompt = PromptTemplate.from_template(REPHRASE_TEMPLATE)
     condense_question_chain = (
-            condense_question_prompt | llm | StrOutputParser()
+            condense_question_prompt | (condense_llm or llm) | StrOutputParser()
     ).with_config(
         run_name="CondenseQuestion",
     )
@@ -125,15 +133,20 @@ def create_retriever_chain(llm: LanguageModelLike, retriever: BaseRetriever) ->
     ).with_config(run_name="RouteDependingOnChatHistory")
 
 
-def create_llm_with_retriever_chain(llm: LanguageModelLike, retriever: BaseRetriever) -> Runnable:
+def create_llm_with_retriever_chain(llm: LanguageModelLike, retriever: BaseRetriever,
+                                    reranker: Optional[Reranker] = None, top_n: int = DEFAULT_TOP_N,
+                                    condense_llm: Optional[LanguageModelLike] = None) -> Runnable:
     retriever_chain = create_retriever_chain(
         llm,
         retriever,
+        reranker=reranker,
+        top_n=top_n,
+        condense_llm=condense_llm,
     ).with_config(run_name="FindDocs")
 
     context = (
         RunnablePassthrough.assign(docs=retriever_chain)
-        .assign(context=lambda x: format_docs(x["docs"]))
+        .assign(context=RunnableLambda(lambda x: format_docs(x["docs"])).with_config(run_name="FormatDocs"))
         .with_config(run_name="RetrieveDocs")
     )
 
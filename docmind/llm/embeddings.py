@@ -0,0 +1,74 @@
+import logging
+from typing import Any, Optional
+
+from langchain_cohere.embeddings import CohereEmbeddings
+from langchain_core.pydantic_v1 import Field
+
+from docmind.llm.resilience import (
+    EMBED,
+    NO_SDK_RETRIES,
+    call_with_retries,
+    get_settings,
+)
+from docmind.llm.scheduler import BULK, INTERACTIVE, get_scheduler
+from docmind.utils.env import cohere_base_url
+from docmind.utils.metrics import span
+from docmind.utils.usage import (
+    EMBED_QUERY_STAGE,
+    EMBED_STAGE,
+    UsageLedger,
+    estimate_tokens,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def billed_input_tokens(response: Any) -> Optional[int]:
+    """Input tokens billed for an embed response, None when the API did not report them."""
+    billed_units = getattr(getattr(response, "meta", None), "billed_units", None)
+    tokens = getattr(billed_units, "input_tokens", None)
+    return None if tokens is None else int(tokens)
+
+
+class DocMindCohereEmbeddings(CohereEmbeddings):
+    """
+    CohereEmbeddings that times every embed call and records its billed input tokens in the
+    usage ledger for `username`. Calls go through the process wide scheduler: questions as
+    interactive calls, documents being ingested as bulk ones. Failed calls are retried with
+    jittered backoff through the circuit breaker of the embed endpoint.
+    """
+
+    ledger: Optional[UsageLedger] = None
+    username: Optional[str] = None
+    base_url: Optional[str] = Field(default_factory=cohere_base_url)
+    request_timeout: Optional[float] = Field(default_factory=lambda: get_settings().request_timeout)
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def embed_with_retry(self, **kwargs: Any) -> Any:
+        texts = kwargs.get("texts") or []
+        is_query = kwargs.get("input_type") == "search_query"
+        stage = EMBED_QUERY_STAGE if is_query else EMBED_STAGE
+        tokens = sum(estimate_tokens(text) for text in texts)
+
+        def embed() -> Any:
+            # each attempt takes its own slot so that backoff sleeps do not hold one, the span
+            # times the call only, the wait for the slot is recorded by the scheduler
+            with get_scheduler().slot(self.username, INTERACTIVE if is_query else BULK, tokens=tokens), \
+                    span(stage, documents=len(texts)) as embed_span:
+                response = self.client.embed(**kwargs, request_options=NO_SDK_RETRIES)
+                embedded = billed_input_tokens(response)
+                embed_span.attributes["embedded_tokens"] = tokens if embedded is None else embedded
+            return response, embedded, embed_span.duration
+
+        # retried here rather than by langchain and the SDK
+        response, embedded, latency = call_with_retries(embed, EMBED)
+        estimated = embedded is None
+        if not estimated:
+            tokens = embedded
+
+        if self.ledger is not None and self.username:
+            self.ledger.record(self.username, stage, model=self.model, embedded_tokens=tokens, estimated=estimated,
+                               latency=latency)
+        return response
@@ -0,0 +1,173 @@
+import hashlib
+import logging
+import re
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.runnables import (
+    Runnable,
+    RunnableLambda,
+    RunnableParallel,
+    RunnablePassthrough,
+)
+
+from docmind.llm.resilience import NO_SDK_RETRIES, RERANK, call_with_retries
+from docmind.llm.scheduler import get_scheduler
+from docmind.utils.env import cohere_base_url
+from docmind.utils.usage import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RERANK_MODEL = "rerank-english-v3.0"
+DEFAULT_TOP_N = 6
+
+
+def chunk_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class ScoreCache:
+    """Thread safe LRU cache of relevance scores keyed by (query, chunk hash)."""
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._scores: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, query: str, key: str) -> Optional[float]:
+        with self._lock:
+            score = self._scores.get((query, key))
+            if score is not None:
+                self._scores.move_to_end((query, key))
+            return score
+
+    def put(self, query: str, key: str, score: float) -> None:
+        with self._lock:
+            self._scores[(query, key)] = score
+            self._scores.move_to_end((query, key))
+            while len(self._scores) > self.max_size:
+                self._scores.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._scores)
+
+
+class Reranker(ABC):
+    """
+    Scores retrieved chunks against the query and keeps the best `top_n`.
+
+    Chunks are scored in batches of `batch_size`, scores already in the cache are not
+    requested again. Subclasses only implement `score`.
+    """
+
+    def __init__(self, batch_size: int = 96, cache: Optional[ScoreCache] = None):
+        self.batch_size = batch_size
+        self.cache = cache if cache is not None else ScoreCache()
+
+    @abstractmethod
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        """Relevance of each text to the query, higher is better."""
+
+    def scores(self, query: str, texts: Sequence[str]) -> List[float]:
+        keys = [chunk_hash(text) for text in texts]
+        scores: Dict[str, float] = {}
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            cached = self.cache.get(query, key)
+            if cached is None:
+                missing[key] = text
+            else:
+                scores[key] = cached
+
+        pending = list(missing.items())
+        for start in range(0, len(pending), self.batch_size):
+            batch = pending[start:start + self.batch_size]
+            for (key, _), score in zip(batch, self.score(query, [text for _, text in batch])):
+                scores[key] = float(score)
+                self.cache.put(query, key, float(score))
+        return [scores[key] for key in keys]
+
+    def rerank(self, query: str, docs: Sequence[Document], top_n: int = DEFAULT_TOP_N) -> List[Document]:
+        """Return the `top_n` most relevant documents, with their score in `metadata["relevance_score"]`."""
+        if not docs:
+            return []
+        scores = self.scores(query, [doc.page_content for doc in docs])
+        # sorted is stable, ties keep the retriever order
+        ranked = sorted(zip(docs, scores), key=lambda pair: pair[1], reverse=True)[:top_n]
+        return [Document(page_content=doc.page_content, metadata={**doc.metadata, "relevance_score": score})
+                for doc, score in ranked]
+
+
+class CohereReranker(Reranker):
+    """Reranker backed by the Cohere rerank endpoint."""
+
+    def __init__(self, model: str = DEFAULT_RERANK_MODEL, client: Any = None, batch_size: int = 96,
+                 cache: Optional[ScoreCache] = None):
+        super().__init__(batch_size=batch_size, cache=cache)
+        self.model = model
+        self._client = client
+
+    @property
+    def client(self) -> Any:
+        if self._client is None:
+            import cohere
+
+            self._client = cohere.Client(base_url=cohere_base_url())
+        return self._client
+
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        tokens = estimate_tokens(query) * len(texts) + sum(estimate_tokens(text) for text in texts)
+        with get_scheduler().slot(None, tokens=tokens):
+            response = call_with_retries(lambda: self.client.rerank(
+                model=self.model, query=query, documents=texts, top_n=len(texts),
+                request_options=NO_SDK_RETRIES), RERANK)
+        scores = [0.0] * len(texts)
+        for result in response.results:
+            scores[result.index] = result.relevance_score
+        return scores
+
+
+class LocalReranker(Reranker):
+    """
+    Reranker backed by a local scorer taking (query, text) pairs, e.g. the `predict` method
+    of a sentence-transformers CrossEncoder.
+    """
+
+    def __init__(self, scorer: Callable[[List[Tuple[str, str]]], Sequence[float]], batch_size: int = 32,
+                 cache: Optional[ScoreCache] = None):
+        super().__init__(batch_size=batch_size, cache=cache)
+        self.scorer = scorer
+
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        return [float(score) for score in self.scorer([(query, text) for text in texts])]
+
+
+_WORD = re.compile(r"\w+")
+
+
+class LexicalReranker(Reranker):
+    """Deterministic reranker scoring the share of query terms found in a chunk, for tests and offline use."""
+
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        terms = set(_WORD.findall(query.lower()))
+        if not terms:
+            return [0.0] * len(texts)
+        scores = []
+        for text in texts:
+            words = _WORD.findall(text.lower())
+            matched = terms.intersection(words)
+            # coverage of the query first, density of the matches breaks ties
+            density = sum(word in matched for word in words) / len(words) if words else 0.0
+            scores.append(len(matched) / len(terms) + density / 100)
+        return scores
+
+
+def create_rerank_chain(retriever: Runnable, reranker: Reranker, top_n: int = DEFAULT_TOP_N) -> Runnable:
+    """Runnable taking the search query and returning the `top_n` reranked documents of `retriever`."""
+    return (
+            RunnableParallel(query=RunnablePassthrough(), docs=retriever)
+            | RunnableLambda(lambda x: reranker.rerank(x["query"], x["docs"], top_n)).with_config(run_name="Rerank")
+    )
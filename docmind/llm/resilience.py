@@ -0,0 +1,260 @@
+import logging
+import queue
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextvars import copy_context
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, Optional, TypeVar
+
+import httpx
+
+if TYPE_CHECKING:
+    from docmind.utils.config import ProjectConfiguration
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# endpoints with a circuit breaker each, a failing rerank does not stop the chat
+CHAT = "chat"
+EMBED = "embed"
+RERANK = "rerank"
+# request options of the SDK calls: retries are made here, the SDK's own would multiply them
+NO_SDK_RETRIES = {"max_retries": 0}
+
+
+class LLMUnavailableError(RuntimeError):
+    """Cohere could not serve the call, after retries where the call allows them."""
+
+
+class CircuitOpenError(LLMUnavailableError):
+    """Calls fail fast while the circuit of their endpoint is open."""
+
+
+class StreamTimeoutError(LLMUnavailableError, TimeoutError):
+    """A stream did not produce its first or next token in time."""
+
+
+@dataclass
+class ResilienceSettings:
+    """Timeouts, retries and circuit breaking of the Cohere calls, None disables a timeout."""
+    first_token_timeout: Optional[float] = 30.0
+    inter_token_timeout: Optional[float] = 15.0
+    request_timeout: Optional[float] = 60.0
+    attempts: int = 3
+    base_delay: float = 0.5
+    max_delay: float = 8.0
+    failure_threshold: int = 5
+    reset_timeout: float = 30.0
+    hedge_after: Optional[float] = None
+
+    @classmethod
+    def from_config(cls, config: "ProjectConfiguration") -> "ResilienceSettings":
+        return cls(first_token_timeout=config.llm_first_token_timeout,
+                   inter_token_timeout=config.llm_inter_token_timeout, request_timeout=config.llm_request_timeout,
+                   attempts=config.llm_retries + 1, base_delay=config.llm_retry_delay,
+                   failure_threshold=config.circuit_failure_threshold, reset_timeout=config.circuit_reset_seconds,
+                   hedge_after=config.llm_hedge_after)
+
+    def delay(self, attempt: int) -> float:
+        """Full jitter backoff before retry `attempt` (1 for the first retry), spreads the retries of many sessions."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Transport errors, timeouts, rate limits and server errors may succeed when retried, client errors do not."""
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, (TimeoutError, httpx.TransportError)):
+        return True
+    status_code = getattr(error, "status_code", None)
+    return isinstance(status_code, int) and (status_code in (408, 409, 429) or status_code >= 500)
+
+
+class CircuitBreaker:
+    """
+    Closed while calls succeed. `failure_threshold` consecutive retryable failures open it, calls then
+    fail fast with CircuitOpenError instead of piling up on an unavailable API. After `reset_timeout`
+    seconds one trial call is let through (half open): its success closes the circuit, its failure
+    opens it again.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half-open" if time.monotonic() - self._opened_at >= self.reset_timeout else "open"
+
+    def allow(self) -> None:
+        """Raise CircuitOpenError unless a call may be made now."""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            retry_in = self._opened_at + self.reset_timeout - time.monotonic()
+            if retry_in <= 0 and not self._trial:
+                self._trial = True
+                return
+        raise CircuitOpenError(f"Cohere {self.name} is unavailable, retrying in {max(retry_in, 0):.0f}s")
+
+    def success(self) -> None:
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info(f"Circuit of Cohere {self.name} closed")
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._trial or (self._opened_at is None and self._failures >= self.failure_threshold):
+                logger.warning(f"Circuit of Cohere {self.name} opened after {self._failures} failures")
+                self._opened_at = time.monotonic()
+            self._trial = False
+
+    def release(self) -> None:
+        """End a call that neither succeeded nor failed in a way telling about the API, e.g. a client error."""
+        with self._lock:
+            self._trial = False
+
+
+_settings = ResilienceSettings()
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+_hedge_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="docmind-hedge")
+
+
+def get_settings() -> ResilienceSettings:
+    return _settings
+
+
+def configure_resilience(settings: ResilienceSettings) -> ResilienceSettings:
+    """Apply the settings of the project configuration to the process, the circuits start closed."""
+    global _settings
+    _settings = settings
+    with _breakers_lock:
+        _breakers.clear()
+    return settings
+
+
+def get_circuit_breaker(name: str) -> CircuitBreaker:
+    """The process wide breaker of a Cohere endpoint."""
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name, _settings.failure_threshold, _settings.reset_timeout)
+        return breaker
+
+
+def call_with_retries(call: Callable[[], T], endpoint: str, settings: Optional[ResilienceSettings] = None) -> T:
+    """
+    Run an idempotent call through the circuit breaker of `endpoint`, retrying retryable errors with
+    jittered backoff. Raises LLMUnavailableError once the attempts are exhausted, other errors as they are.
+    """
+    settings = settings or _settings
+    breaker = get_circuit_breaker(endpoint)
+    attempt = 0
+    while True:
+        attempt += 1
+        breaker.allow()
+        try:
+            result = call()
+        except Exception as error:
+            if not is_retryable(error):
+                breaker.release()
+                raise
+            breaker.failure()
+            if attempt >= settings.attempts:
+                if isinstance(error, LLMUnavailableError):
+                    raise
+                raise LLMUnavailableError(f"Cohere {endpoint} failed after {attempt} attempts: {error!r}") from error
+            delay = settings.delay(attempt)
+            logger.warning(f"Cohere {endpoint} call failed ({error!r}), retry {attempt} in {delay:.2f}s")
+            time.sleep(delay)
+            continue
+        breaker.success()
+        return result
+
+
+def hedged(call: Callable[[], T], hedge_after: Optional[float]) -> T:
+    """
+    Run `call` and, when it has not returned within `hedge_after` seconds, a second copy of it: the
+    first to succeed wins, the other one runs to completion unused. Only for short idempotent calls.
+    """
+    if not hedge_after:
+        return call()
+    futures = [_hedge_pool.submit(copy_context().run, call)]
+    done, _ = wait(futures, timeout=hedge_after)
+    if not done:
+        logger.info(f"Cohere call slower than {hedge_after}s, sending a hedged request")
+        futures.append(_hedge_pool.submit(copy_context().run, call))
+    pending = set(futures)
+    error: Optional[BaseException] = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+    raise error
+
+
+_DONE = object()
+
+
+def timed_stream(stream: Iterator[T], first_token_timeout: Optional[float],
+                 inter_token_timeout: Optional[float]) -> Iterator[T]:
+    """
+    Yield the items of `stream`, read in a worker thread, raising StreamTimeoutError when the first
+    item takes longer than `first_token_timeout` or a later one longer than `inter_token_timeout`.
+    The worker stops reading at its next item once the stream is abandoned.
+    """
+    items: "queue.Queue" = queue.Queue()
+    abandoned = threading.Event()
+
+    def read():
+        try:
+            for item in stream:
+                if abandoned.is_set():
+                    break
+                items.put((item, None))
+        except BaseException as error:
+            items.put((None, error))
+            return
+        finally:
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
+        items.put((_DONE, None))
+
+    context = copy_context()
+    threading.Thread(target=context.run, args=(read,), name="docmind-stream", daemon=True).start()
+    timeout, first = first_token_timeout, True
+    try:
+        while True:
+            try:
+                item, error = items.get(timeout=timeout)
+            except queue.Empty:
+                what = "first token" if first else "next token"
+                raise StreamTimeoutError(f"No {what} from Cohere within {timeout}s") from None
+            if error is not None:
+                raise error
+            if item is _DONE:
+                return
+            yield item
+            timeout, first = inter_token_timeout, False
+    finally:
+        abandoned.set()
+
@@ -0,0 +1,203 @@
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+from docmind.utils.metrics import REGISTRY, MetricsRegistry
+
+logger = logging.getLogger(__name__)
+
+# priorities, lower is served first
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+DEFAULT_MAX_CONCURRENCY = 8
+_WINDOW = 60.0  # seconds of the tokens per minute budget
+
+# waits of the calls made in the current context, see `track_waits`
+_tracked_waits: ContextVar[Optional[List[float]]] = ContextVar("docmind_queue_waits", default=None)
+
+
+@dataclass
+class Slot:
+    """A granted call, `tokens` are charged to the budget of the minute it started in."""
+    username: str
+    priority: int
+    tokens: int
+    waited: float = 0.0
+    _scheduler: Optional["CohereScheduler"] = field(default=None, repr=False)
+
+    def add_tokens(self, tokens: int) -> None:
+        """Charge tokens only known once the call ran, e.g. the generated ones."""
+        if tokens > 0 and self._scheduler is not None:
+            self._scheduler._charge(tokens)
+            self.tokens += tokens
+
+
+@dataclass
+class _Ticket:
+    username: str
+    priority: int
+    tokens: int
+    sequence: int
+    queued_at: float = field(default_factory=time.monotonic)
+
+
+class CohereScheduler:
+    """
+    Process wide gate for the Cohere calls of every session, ingest job and API request.
+
+    At most `max_concurrency` calls are in flight and, with `tokens_per_minute`, the tokens sent in
+    the last minute stay within the budget (a single call above the budget runs alone). Waiting
+    calls are served by priority, interactive chat before bulk ingest, then fairly between users:
+    the user granted the fewest calls goes first, so one user's upload of a thousand pages queues
+    behind the questions of the others instead of in front of them. None disables a limit.
+    """
+
+    def __init__(self, max_concurrency: Optional[int] = DEFAULT_MAX_CONCURRENCY,
+                 tokens_per_minute: Optional[int] = None, registry: MetricsRegistry = REGISTRY):
+        self.max_concurrency = max_concurrency
+        self.tokens_per_minute = tokens_per_minute
+        self.registry = registry
+        self._running = 0
+        self._waiting: List[_Ticket] = []
+        self._granted: Dict[str, int] = {}
+        self._spent: Deque[Tuple[float, int]] = deque()
+        self._sequence = 0
+        self._condition = threading.Condition()
+
+    def configure(self, max_concurrency: Optional[int] = DEFAULT_MAX_CONCURRENCY,
+                  tokens_per_minute: Optional[int] = None) -> None:
+        with self._condition:
+            self.max_concurrency = max_concurrency
+            self.tokens_per_minute = tokens_per_minute
+            self._condition.notify_all()
+
+    @property
+    def queued(self) -> int:
+        with self._condition:
+            return len(self._waiting)
+
+    @property
+    def running(self) -> int:
+        with self._condition:
+            return self._running
+
+    @contextmanager
+    def slot(self, username: Optional[str], priority: int = INTERACTIVE, tokens: int = 0,
+             timeout: Optional[float] = None) -> Iterator[Slot]:
+        """Wait for a free slot and hold it for the enclosed call."""
+        granted = self.acquire(username, priority, tokens, timeout)
+        try:
+            yield granted
+        finally:
+            self.release(granted)
+
+    def acquire(self, username: Optional[str], priority: int = INTERACTIVE, tokens: int = 0,
+                timeout: Optional[float] = None) -> Slot:
+        """Block until the call may start, raises TimeoutError after `timeout` seconds."""
+        username = username or ""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            self._sequence += 1
+            ticket = _Ticket(username, priority, tokens, self._sequence)
+            # a user coming back after a pause starts level with the users waiting, not ahead of them
+            if self._waiting:
+                level = min(self._granted.get(waiting.username, 0) for waiting in self._waiting)
+                self._granted[username] = max(self._granted.get(username, 0), level)
+            self._waiting.append(ticket)
+            try:
+                while True:
+                    retry_in = self._admissible(ticket)
+                    if retry_in == 0:
+                        break
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise TimeoutError(f"No Cohere slot for {username or 'anonymous'} within {timeout}s")
+                        retry_in = remaining if retry_in is None else min(retry_in, remaining)
+                    self._condition.wait(retry_in)
+            finally:
+                self._waiting.remove(ticket)
+                # the next in line may be admissible now
+                self._condition.notify_all()
+            self._running += 1
+            self._granted[username] = self._granted.get(username, 0) + 1
+            self._charge_locked(tokens)
+
+        waited = time.monotonic() - ticket.queued_at
+        self.registry.queue_wait.observe(waited, priority=PRIORITY_NAMES.get(priority, str(priority)))
+        tracked = _tracked_waits.get()
+        if tracked is not None:
+            tracked.append(waited)
+        if waited > 1.0:
+            logger.info(f"Cohere call of {username or 'anonymous'} waited {waited:.1f}s in the queue")
+        return Slot(username, priority, tokens, waited, self)
+
+    def release(self, granted: Slot) -> None:
+        with self._condition:
+            self._running -= 1
+            self._condition.notify_all()
+
+    def _next(self) -> Optional[_Ticket]:
+        return min(self._waiting, key=lambda ticket: (ticket.priority, self._granted.get(ticket.username, 0),
+                                                      ticket.sequence), default=None)
+
+    def _admissible(self, ticket: _Ticket) -> Optional[float]:
+        """0 when `ticket` may start now, else the seconds until the budget frees up (None: until notified)."""
+        if self._next() is not ticket:
+            return None
+        if self.max_concurrency is not None and self._running >= self.max_concurrency:
+            return None
+        if not self.tokens_per_minute:
+            return 0
+        now = time.monotonic()
+        while self._spent and self._spent[0][0] <= now - _WINDOW:
+            self._spent.popleft()
+        spent = sum(tokens for _, tokens in self._spent)
+        if not self._spent or spent + ticket.tokens <= self.tokens_per_minute:
+            return 0
+        # wait for the oldest charges to leave the window
+        return max(0.01, self._spent[0][0] + _WINDOW - now)
+
+    def _charge(self, tokens: int) -> None:
+        with self._condition:
+            self._charge_locked(tokens)
+
+    def _charge_locked(self, tokens: int) -> None:
+        if tokens > 0 and self.tokens_per_minute:
+            self._spent.append((time.monotonic(), tokens))
+
+
+@contextmanager
+def track_waits() -> Iterator[List[float]]:
+    """
+    Collect the queue waits of the Cohere calls made inside the block, including those made by
+    langchain in worker threads, e.g. to show a user how long their answer was queued.
+    """
+    waits: List[float] = []
+    token = _tracked_waits.set(waits)
+    try:
+        yield waits
+    finally:
+        _tracked_waits.reset(token)
+
+
+_scheduler = CohereScheduler()
+
+
+def get_scheduler() -> CohereScheduler:
+    """The scheduler every Cohere call of the process goes through."""
+    return _scheduler
+
+
+def configure_scheduler(max_concurrency: Optional[int] = DEFAULT_MAX_CONCURRENCY,
+                        tokens_per_minute: Optional[int] = None) -> CohereScheduler:
+    """Apply the limits of the project configuration to the process wide scheduler."""
+    _scheduler.configure(max_concurrency, tokens_per_minute)
+    return _scheduler
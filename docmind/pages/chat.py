@@ -2,18 +2,46 @@ import os
 from pathlib import Path
 
 import streamlit as st
-from langchain_cohere import ChatCohere
-from langchain_community.chat_message_histories import StreamlitChatMessageHistory
-from langchain_core.messages import HumanMessage, AIMessage
 
-from docmind.pages.docs_chat import setup_chat_history
-from docmind.utils.common import authenticate_user, get_cohere_models, setup_user_directory, setup_page
+from docmind.utils.common import (
+    add_queue_wait,
+    authenticate_user,
+    get_cohere_models,
+    get_project_config,
+    get_project_usage_ledger,
+    setup_chat_history,
+    setup_page,
+    setup_user_directory,
+    show_timing_breakdown,
+    show_usage_summary,
+    start_page_profiling,
+    stop_on_llm_error,
+    thinking_message,
+)
 
 # Setup Streamlit page
 setup_page("ChatBot", "💬")
 
 # User authentication
 name, authentication_status, username = authenticate_user()
+if not authentication_status:
+    st.stop()
+
+# Profile this run when enabled, the heavy imports below are part of it
+start_page_profiling("chat", username)
+
+# Heavy dependencies are imported only once the user is logged in
+from langchain_community.chat_message_histories import StreamlitChatMessageHistory  # noqa: E402
+from langchain_core.messages import AIMessage, HumanMessage  # noqa: E402
+
+from docmind.llm.callbacks import StageTimingCallback, UsageCallback  # noqa: E402
+from docmind.llm.chat_models import DocMindChatCohere  # noqa: E402
+from docmind.llm.resilience import LLMUnavailableError  # noqa: E402
+from docmind.llm.scheduler import track_waits  # noqa: E402
+
+# Load the project configuration
+config = get_project_config()
+usage_ledger = get_project_usage_ledger()
 
 # Retrieve and cache the list of Cohere models
 models = get_cohere_models()
@@ -46,6 +74,9 @@ with st.sidebar:
 
         st.toggle("Streaming:", "True", key="stream_output")
 
+        st.toggle("Show timings:", value=False, key="show_timings",
+                  help="Show how long each stage of the last answer took.")
+
         # cohere internet is enabled by default
         is_connector_enable = st.toggle("🔍 Connectors:", value="True",
                                         help="When specified, the model's reply will be enriched with information"
@@ -106,10 +137,14 @@ for msg in chat_history.messages:
     user_type = "human" if isinstance(msg, HumanMessage) else "ai"
     display_chat_message(msg, user_type)
 
-llm = ChatCohere(
+# usage is recorded per chat file
+conversation = f"{chat_history_folder.name}/{Path(st.session_state[current_chat_history_file_key]).name}"
+
+llm = DocMindChatCohere(
     model_name=st.session_state.model_name,
     temperature=st.session_state.temperature,
     max_tokens=st.session_state.max_tokens,
+    username=username,
 )
 
 
@@ -165,16 +200,22 @@ if user_input := st.chat_input(key="input"):
     chunks = []
 
     # Stream the response from the LLM
-    with st.spinner("Thinking..."):
-        for chunk in llm.stream(
-                user_input,
-                prompt_truncation=prompt_truncate,
-                connectors=connectors
-        ):
-            if is_search_enable:
-                chunks.append(chunk)
-            full_response += chunk.content
-            msg_placeholder.markdown(full_response + "▌")
+    timings = StageTimingCallback()
+    usage = UsageCallback(usage_ledger, username, conversation=conversation)
+    try:
+        with st.spinner(thinking_message()), track_waits() as waits:
+            for chunk in llm.stream(
+                    user_input,
+                    config={"callbacks": [timings, usage]},
+                    prompt_truncation=prompt_truncate,
+                    connectors=connectors
+            ):
+                if is_search_enable:
+                    chunks.append(chunk)
+                full_response += chunk.content
+                msg_placeholder.markdown(full_response + "▌")
+    except LLMUnavailableError as error:
+        stop_on_llm_error(error, answer_container)
 
     if is_search_enable:
         content = ""
@@ -193,9 +234,15 @@ if user_input := st.chat_input(key="input"):
         msg_placeholder.markdown(full_response)
     else:
         msg_placeholder.markdown(full_response)
+    st.session_state["chat_timings"] = add_queue_wait(timings.breakdown(), waits, answer_container)
 
     # Update chat history
     chat_history.add_user_message(user_input)
     chat_history.add_ai_message(full_response)
     setup_chat_history(chat_history_folder, action='save_chat', chat_history_session_state=chat_history,
                        current_chat_history_file_key=current_chat_history_file_key)
+
+if st.session_state.get("show_timings") and st.session_state.get("chat_timings"):
+    show_timing_breakdown(st.session_state["chat_timings"])
+
+show_usage_summary(usage_ledger, username, conversation)
@@ -3,17 +3,26 @@ import os
 from pathlib import Path
 
 import streamlit as st
-from langchain_cohere import ChatCohere
-from langchain_cohere.embeddings import CohereEmbeddings
-from langchain_community.chat_message_histories import StreamlitChatMessageHistory
-from langchain_core.messages import HumanMessage
-
-from docmind.llm.create_llm_chain import create_llm_with_retriever_chain
-from docmind.upload_and_process_files import DocumentProcessor, GetRetriever
-from docmind.utils.common import authenticate_user, get_cohere_models, setup_user_directory, setup_page, \
-    setup_chat_history
+
+from docmind.utils.common import (
+    add_queue_wait,
+    authenticate_user,
+    get_cohere_models,
+    get_corpus_registry,
+    get_project_config,
+    get_project_usage_ledger,
+    get_reranker,
+    setup_chat_history,
+    setup_page,
+    setup_user_directory,
+    show_timing_breakdown,
+    show_usage_summary,
+    start_page_profiling,
+    stop_on_llm_error,
+    thinking_message,
+)
 from docmind.utils.helper import rmdir_recursive
-from docmind.vectorstore.chromadb import create_userdb, collection_count, delete_user_collection
+from docmind.utils.user_writes import get_user_writer
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +31,34 @@ setup_page("DocumentsChat", "📚")
 
 # User authentication
 name, authentication_status, username = authenticate_user()
+if not authentication_status:
+    st.stop()
+
+# Profile this run when enabled, the heavy imports below are part of it
+start_page_profiling("docs_chat", username)
+
+# Heavy dependencies are imported only once the user is logged in
+from langchain_community.chat_message_histories import StreamlitChatMessageHistory  # noqa: E402
+from langchain_core.messages import HumanMessage  # noqa: E402
+
+from docmind.ingest.cleaning import DEDUP_DB_FILE, ChunkDeduplicator  # noqa: E402
+from docmind.llm.callbacks import StageTimingCallback, UsageCallback  # noqa: E402
+from docmind.llm.chat_models import DocMindChatCohere  # noqa: E402
+from docmind.llm.create_llm_chain import create_llm_with_retriever_chain  # noqa: E402
+from docmind.llm.embeddings import DocMindCohereEmbeddings  # noqa: E402
+from docmind.llm.resilience import LLMUnavailableError  # noqa: E402
+from docmind.llm.scheduler import track_waits  # noqa: E402
+from docmind.upload_and_process_files import DocumentProcessor, GetRetriever, documents_filter  # noqa: E402
+from docmind.vectorstore.cache import (  # noqa: E402
+    get_corpus_vectorstore,
+    get_store_cache,
+    get_user_vectorstore,
+)
+from docmind.vectorstore.shared import MergedStore  # noqa: E402
+
+# Load the project configuration
+config = get_project_config()
+usage_ledger = get_project_usage_ledger()
 
 # Retrieve and cache the list of Cohere models
 models = get_cohere_models()
@@ -54,6 +91,17 @@ with st.sidebar:
 
         st.toggle("Streaming:", "True", key="stream_output")
 
+        rerank_names = [name for name, model in models.items() if 'rerank' in model['endpoints']]
+        st.toggle("Rerank:", value=False, key="rerank", disabled=not rerank_names,
+                  help="Score the retrieved chunks against the question and only send the best ones to the model.")
+        if rerank_names:
+            st.selectbox("Rerank model:", rerank_names, key="rerank_model_name")
+        st.number_input("Top n:", min_value=1, max_value=50, value=6, step=1, key="rerank_top_n",
+                        help="Number of reranked chunks sent to the model.")
+
+        st.toggle("Show timings:", value=False, key="show_timings",
+                  help="Show how long each stage of the last answer took.")
+
     with st.expander("Chat Management:", expanded=True):
         chat_files = [f for f in os.listdir(chat_history_folder) if f.endswith('.json')]
         if not chat_files:
@@ -77,12 +125,25 @@ with st.sidebar:
                                current_chat_history_file_key=current_chat_history_file_key)
             st.session_state['selected_chat'] = st.session_state[current_chat_history_file_key].name
 
+    # Shared corpora the user may read, only those embedded with the selected model can be searched
+    corpus_registry = get_corpus_registry()
+    readable_corpora = [corpus.name for corpus in corpus_registry.corpora_for(username)
+                        if corpus.embedding_model == st.session_state["embedding_model_name"]]
+
     # Document Selection
     filter_documents = []  # initialize with empty list if the reference folder not found
+    mounted_corpora = []
     with st.container(border=True):
+        if readable_corpora:
+            mounted_corpora = st.multiselect(
+                "Shared corpora:", options=readable_corpora, default=readable_corpora,
+                help="Read-only documents shared with you, searched together with your own documents."
+            )
         reference_dir = Path(user_data_dir) / "reference"
-        if reference_dir.is_dir():
-            files_list = [file.name for file in reference_dir.iterdir() if file.is_file()]
+        files_list = [file.name for file in reference_dir.iterdir() if file.is_file()] if reference_dir.is_dir() \
+            else []
+        files_list += [source for name in mounted_corpora for source in corpus_registry.documents(name)]
+        if files_list:
             filter_documents = st.multiselect(
                 "Select documents:", options=files_list,
                 help="Select the documents you wish to use for obtaining answers. "
@@ -90,21 +151,43 @@ with st.sidebar:
             )
 
     # Document Processing
-    embedding_func = CohereEmbeddings(model=st.session_state["embedding_model_name"])
-    userdb = create_userdb(username, user_data_dir, embedding_func)
-    DocumentProcessor(chroma_instance=userdb, user_data_dir=user_data_dir).process_documents()
+    embedding_func = DocMindCohereEmbeddings(model=st.session_state["embedding_model_name"], ledger=usage_ledger,
+                                             username=username)
+    userdb = get_user_vectorstore(config, username, user_data_dir, embedding_func)
+    # stores of this run, kept open by the cache while an upload or an answer uses them
+    stores = [userdb]
+    if mounted_corpora:
+        # uploads still go to the private collection, the shared corpora are only searched
+        corpora = [get_corpus_vectorstore(corpus_registry, name, embedding_func, username,
+                                          document_routing=config.document_routing_top_n)
+                   for name in mounted_corpora]
+        try:
+            userdb = MergedStore(userdb, corpora)
+            stores += corpora
+        except ValueError as error:
+            st.warning(f"{error}, searching your documents only.")
+    with get_store_cache().pin(*stores):
+        DocumentProcessor(vectorstore=userdb, user_data_dir=user_data_dir).process_documents()
 
     # Retriever Logic
-    retriever = GetRetriever(chroma_instance=userdb, filter_criteria={
-        "source": {"$in": filter_documents}} if filter_documents else {}).get_retriever()
+    retriever = GetRetriever(vectorstore=userdb, filter_criteria=documents_filter(
+        user_data_dir, filter_documents) if filter_documents else {}).get_retriever()
 
     # Allow the user to destroy your own data
     st.button("Destroy user data", type="primary", use_container_width=True, key="destroy_data_button")
     if st.session_state["destroy_data_button"]:
-        if collection_count(userdb) > 0:
-            delete_user_collection(userdb, username)
-            st.success("User data destroyed successfully.")
-        rmdir_recursive(reference_dir)
+        # not while an upload of another tab or replica is adding documents
+        with get_user_writer(user_data_dir).write("destroy"):
+            if userdb.count() > 0:
+                userdb.drop()
+                # the dropped collection is opened again on the next run
+                get_store_cache().discard(Path(user_data_dir).resolve())
+                st.success("User data destroyed successfully.")
+            # forget the chunks of the dropped store, they would be skipped as duplicates otherwise
+            deduplicator = ChunkDeduplicator(Path(user_data_dir) / DEDUP_DB_FILE)
+            deduplicator.clear()
+            deduplicator.close()
+            rmdir_recursive(reference_dir)
 
 
 # Display chat history
@@ -119,16 +202,23 @@ for msg in chat_history.messages:
     user_type = "human" if isinstance(msg, HumanMessage) else "ai"
     display_chat_message(msg, user_type)
 
-llm = ChatCohere(
+# usage is recorded per chat file
+conversation = f"{chat_history_folder.name}/{Path(st.session_state[current_chat_history_file_key]).name}"
+
+llm = DocMindChatCohere(
     model_name=st.session_state.model_name,
     temperature=st.session_state.temperature,
     max_tokens=st.session_state.max_tokens,
+    username=username,
 )
 
 if llm and retriever:
     st.toast("Ready to chat with your document.")
 
-    answer_chain = create_llm_with_retriever_chain(llm, retriever)
+    reranker = get_reranker(st.session_state["rerank_model_name"]) if st.session_state.get("rerank") else None
+    answer_chain = create_llm_with_retriever_chain(llm, retriever, reranker=reranker,
+                                                   top_n=st.session_state["rerank_top_n"],
+                                                   condense_llm=llm.condenser())
 
     if user_input := st.chat_input(key="input"):
         output_container = st.container()
@@ -139,18 +229,30 @@ if llm and retriever:
         full_response = ""
         msg_placeholder = answer_container.container().markdown(full_response + "▌")
 
-        with st.spinner("Thinking..."):
-            for chunk in answer_chain.stream(
-                    {"question": user_input, "chat_history": chat_history.messages},
-            ):
-                full_response += chunk
-                msg_placeholder.markdown(full_response + "▌")
+        timings = StageTimingCallback()
+        usage = UsageCallback(usage_ledger, username, conversation=conversation)
+        try:
+            with st.spinner(thinking_message()), track_waits() as waits, get_store_cache().pin(*stores):
+                for chunk in answer_chain.stream(
+                        {"question": user_input, "chat_history": chat_history.messages},
+                        config={"callbacks": [timings, usage]},
+                ):
+                    full_response += chunk
+                    msg_placeholder.markdown(full_response + "▌")
+        except LLMUnavailableError as error:
+            stop_on_llm_error(error, answer_container)
 
         # Finalize the response
         msg_placeholder.markdown(full_response)
+        st.session_state["docs_chat_timings"] = add_queue_wait(timings.breakdown(), waits, answer_container)
 
         # Update chat history
         chat_history.add_user_message(user_input)
         chat_history.add_ai_message(full_response)
         setup_chat_history(chat_history_folder, action='save_chat', chat_history_session_state=chat_history,
                            current_chat_history_file_key=current_chat_history_file_key)
+
+if st.session_state.get("show_timings") and st.session_state.get("docs_chat_timings"):
+    show_timing_breakdown(st.session_state["docs_chat_timings"])
+
+show_usage_summary(usage_ledger, username, conversation)
@@ -1,22 +1,76 @@
 import logging
+import shutil
+import uuid
 from pathlib import Path
-from typing import List, Union, Tuple, Optional, Dict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Union
 
 import streamlit as st
-from langchain_community.document_loaders import PyMuPDFLoader
-from langchain_community.vectorstores import Chroma
 from langchain_core.documents import Document
-from langchain_core.vectorstores import VectorStoreRetriever
 
-from docmind.utils.helper import sanitize_file_name, refine_docs, truncate_files_in_folder, move_files, rmdir_recursive
+from docmind.ingest.cleaning import DEDUP_DB_FILE, BoilerplateStripper, ChunkDeduplicator
+from docmind.ingest.pipeline import IngestPipeline, IngestStats
+from docmind.utils.helper import sanitize_file_name, truncate_files_in_folder, move_files, rmdir_recursive
+from docmind.utils.metrics import span
+from docmind.utils.user_writes import get_user_writer
+from docmind.vectorstore.base import VectorStore, VectorStoreBackendRetriever
 
 logger = logging.getLogger(__name__)
 
+# uploads are copied to disk in blocks of this size instead of read whole
+_COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def ingest_files(vectorstore: VectorStore, user_data_dir: Union[Path, str], paths: Iterable[Path],
+                 on_batch: Optional[Callable[[IngestStats], None]] = None) -> IngestStats:
+    """
+    Stream files into the vector store of a user, stripping boilerplate and skipping the chunks
+    already in the collection. Shared by the Streamlit upload and the HTTP API.
+    """
+    deduplicator = ChunkDeduplicator(Path(user_data_dir) / DEDUP_DB_FILE)
+    try:
+        return IngestPipeline(vectorstore, boilerplate=BoilerplateStripper(), deduplicator=deduplicator).run(
+            paths, on_batch=on_batch)
+    finally:
+        deduplicator.close()
+
+
+def delete_document(vectorstore: VectorStore, user_data_dir: Union[Path, str], source: str) -> int:
+    """
+    Delete the chunks of an uploaded document and its reference file, returns the chunks deleted.
+    Chunks another document repeats are moved to it instead.
+    """
+    ids = vectorstore.ids_where({"source": source})
+    deduplicator = ChunkDeduplicator(Path(user_data_dir) / DEDUP_DB_FILE)
+    try:
+        moved = deduplicator.remove_source(source, ids)
+        deleted = [chunk_id for chunk_id in ids if chunk_id not in moved]
+        vectorstore.delete(deleted)
+        deduplicator.forget(deleted)
+        if moved:
+            # written again rather than updated, their new document may live in another shard
+            found, docs, vectors = vectorstore.get_chunks(list(moved))
+            vectorstore.delete(found)
+            vectorstore.add_embeddings([doc.page_content for doc in docs], vectors,
+                                       [moved[chunk_id] for chunk_id in found], found)
+    finally:
+        deduplicator.close()
+    (Path(user_data_dir) / "reference" / source).unlink(missing_ok=True)
+    return len(deleted)
+
+
+def documents_filter(user_data_dir: Union[Path, str], sources: Sequence[str]) -> Dict[str, Any]:
+    """The filter on the chunks of the documents `sources`, with the ones they share with other documents."""
+    deduplicator = ChunkDeduplicator(Path(user_data_dir) / DEDUP_DB_FILE)
+    try:
+        return deduplicator.source_filter(sources)
+    finally:
+        deduplicator.close()
+
 
 class GetRetriever:
     def __init__(
             self,
-            chroma_instance: Chroma,
+            vectorstore: VectorStore,
             documents: Optional[List[Document]] = None,
             filter_criteria: Optional[Dict] = None
     ):
@@ -28,14 +82,14 @@ class GetRetriever:
                  }
              }
         """
-        self.chroma_instance = chroma_instance
+        self.vectorstore = vectorstore
         self.documents = documents
         self.filter_criteria = filter_criteria
 
-    def get_retriever(self) -> VectorStoreRetriever:
+    def get_retriever(self) -> VectorStoreBackendRetriever:
         if self.documents:
             logger.info("Adding documents to the database.")
-            self.chroma_instance.add_documents(self.documents)
+            self.vectorstore.add_documents(self.documents)
 
         search_kwargs = {
             "k": 50,
@@ -47,7 +101,7 @@ class GetRetriever:
         if self.filter_criteria:
             search_kwargs['filter'] = self.filter_criteria
 
-        return self.chroma_instance.as_retriever(
+        return self.vectorstore.as_retriever(
             search_type="mmr",
             search_kwargs=search_kwargs,
         )
@@ -60,12 +114,12 @@ class DocumentProcessor:
 
     def __init__(
             self,
-            chroma_instance: Chroma,
+            vectorstore: VectorStore,
             user_data_dir: Union[Path, str],
     ):
         logger.info("Initializing DocumentProcessor...")
 
-        self.chroma_instance = chroma_instance
+        self.vectorstore = vectorstore
 
         if isinstance(user_data_dir, str):
             self.user_data_dir = Path(user_data_dir)
@@ -77,18 +131,20 @@ class DocumentProcessor:
                 f"{self.user_data_dir} is not a valid directory"
             )
 
-        self.temp_dir = self.user_data_dir / "temp"
+        self._initialize_session_state()
+        # every session saves its uploads to its own folder, two tabs of a user do not process each other's files
+        self.temp_dir = self.user_data_dir / "temp" / st.session_state["upload_session"]
         self.reference_dir = self.user_data_dir / "reference"
         self.temp_dir.mkdir(exist_ok=True, parents=True)
 
         self.file_upload_container = st.sidebar.expander("Documents Processing", expanded=True)
-        self._initialize_session_state()
 
     @staticmethod
     def _initialize_session_state():
         st.session_state.setdefault("uploaded_docs", [])
         st.session_state.setdefault("file_uploader_state", 0)
         st.session_state.setdefault("activate_uploader", True)
+        st.session_state.setdefault("upload_session", uuid.uuid4().hex)
 
     def process_documents(self):
         if st.session_state["activate_uploader"]:
@@ -112,77 +168,76 @@ class DocumentProcessor:
     def _process_uploaded_docs(self):
         """Process uploaded documents:
          - Save files to disk.
-         - Process PDF files.
-         - Add processed documents to the vector store.
+         - Stream the PDF pages through the ingest pipeline into the vector store.
          - Display success message and update session state.
         """
         with self.file_upload_container:
             with st.spinner("Processing documents..."):
                 self._save_files_to_disk()
-                docs, processed_files = self._process_docs()
-                GetRetriever(
-                    chroma_instance=self.chroma_instance, documents=docs
-                ).get_retriever()
-                self._log_and_display_results(docs, processed_files)
-                self._cleanup_if_all_files_processed(processed_files)
-
-    def _log_and_display_results(
-            self, docs: List[Document], processed_files: List[Path]
-    ):
-        logger.info(f"Saving {len(processed_files)} processed files to {self.temp_dir}")
+                progress = st.empty()
+                writer = get_user_writer(self.user_data_dir)
+                if writer.waiting:
+                    progress.caption("Waiting for your other uploads to be processed...")
+                # the documents of other tabs and replicas are added before or after these, not in between
+                with writer.write("upload"):
+                    stats = ingest_files(self.vectorstore, self.user_data_dir, sorted(self.temp_dir.glob("*.pdf")),
+                                         on_batch=lambda running: progress.caption(
+                                             f"{running.chunks} chunks of {running.files} files searchable"))
+                    writer.flush_later(self.vectorstore)
+                    all_processed = self._move_if_all_files_processed(stats.processed_files)
+                progress.empty()
+                self._log_and_display_results(stats)
+                if all_processed:
+                    self._reset_uploader()
+
+    def _log_and_display_results(self, stats: IngestStats):
+        logger.info(f"Saving {len(stats.processed_files)} processed files to {self.temp_dir}")
         logger.info(f"Processed files {len(st.session_state['uploaded_docs'])}")
-        if len(docs) > 0:
+        if stats.chunks > 0:
             self.file_upload_container.success("Success processed file!", icon="✅")
+        if stats.tokens_saved:
+            self.file_upload_container.caption(
+                f"Skipped {stats.duplicates} duplicate chunks and {stats.boilerplate_lines} repeated header/footer "
+                f"lines, about {stats.tokens_saved:,} tokens not embedded."
+            )
 
-    def _cleanup_if_all_files_processed(self, processed_files: List[Path]):
+    def _move_if_all_files_processed(self, processed_files: List[Path]) -> bool:
         """Clean up temporary directory:
-         - Move files to the reference directory.
          - Truncate files in the temp directory.
-         - Clear session state variables.
+         - Move files to the reference directory.
         """
-        if len(processed_files) == len(st.session_state["uploaded_docs"]):
-            logger.info("Cleaning up temp directory...")
-            # Instead of delete the files just make it's size zero
-            # to use the files as reference for the sources files in database.
+        if len(processed_files) != len(st.session_state["uploaded_docs"]):
+            return False
+        logger.info("Cleaning up temp directory...")
+        # Instead of delete the files just make it's size zero
+        # to use the files as reference for the sources files in database.
 
-            # Truncate files in the temp directory to save space
-            truncate_files_in_folder(self.temp_dir)
+        # Truncate files in the temp directory to save space
+        truncate_files_in_folder(self.temp_dir)
 
-            # Move processed files to the reference directory
-            move_files(self.temp_dir, self.reference_dir)
-            rmdir_recursive(self.temp_dir)
+        # Move processed files to the reference directory
+        move_files(self.temp_dir, self.reference_dir)
+        rmdir_recursive(self.temp_dir)
+        return True
 
-            # Clear session state variables
-            st.session_state.uploaded_docs.clear()
-            st.session_state.file_uploader_state += 1
-            st.session_state["activate_uploader"] = True
-            st.rerun()
+    @staticmethod
+    def _reset_uploader():
+        """Clear the uploads of the session and rerun with an empty uploader."""
+        st.session_state.uploaded_docs.clear()
+        st.session_state.file_uploader_state += 1
+        st.session_state["activate_uploader"] = True
+        st.rerun()
 
     def _save_files_to_disk(self) -> None:
         """Save uploaded files to the temporary directory."""
-        for file in st.session_state["uploaded_docs"]:
-            file_path = sanitize_file_name(self.temp_dir / file.name)
-            if not file_path.exists():
-                with open(file_path, mode="wb") as tmp_file:
-                    tmp_file.write(file.read())
-
-    def _process_docs(self) -> Tuple[List[Document], List[Path]]:
-        """Process PDF files in the temporary directory."""
-        docs = []
-        processed_files = []
-        for path in self.temp_dir.glob("*.pdf"):
-            logger.info(f"Processing PDF file: {path}")
-
-            reader = PyMuPDFLoader(str(path))
-            pdf_documents = reader.load()
-
-            # update the metadata to filter the RAG based on the document name
-            for doc in pdf_documents:
-                doc.metadata["source"] = path.name  # use the file name instead of full path
-            # create new docs list to hold the docs update
-            docs.extend(pdf_documents)
-            processed_files.append(path)
-        return refine_docs(docs), processed_files
+        with span("save_uploads", documents=len(st.session_state["uploaded_docs"])) as save_span:
+            for file in st.session_state["uploaded_docs"]:
+                file_path = sanitize_file_name(self.temp_dir / file.name)
+                save_span.attributes["bytes"] = save_span.attributes.get("bytes", 0) + file.size
+                if not file_path.exists():
+                    file.seek(0)
+                    with open(file_path, mode="wb") as tmp_file:
+                        shutil.copyfileobj(file, tmp_file, _COPY_BUFFER_SIZE)
 
     def upload_documents(self):
         """Upload documents using the Streamlit file uploader."""
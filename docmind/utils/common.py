@@ -1,17 +1,30 @@
 import json
 import os
+import sys
 from datetime import datetime
 from io import BytesIO
 from pathlib import Path
-from typing import Union
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Union
 from zipfile import ZipFile
 
-import cohere
 import streamlit as st
-from langchain_community.chat_message_histories import StreamlitChatMessageHistory
-from langchain_core.messages import HumanMessage, AIMessage
 
-from docmind.auth.authenticator import AuthenticatorConfig, Authenticator
+from docmind.auth.authenticator import Authenticator, AuthenticatorConfig
+from docmind.llm.catalogue import ModelCatalogue
+from docmind.llm.resilience import ResilienceSettings, configure_resilience
+from docmind.llm.scheduler import configure_scheduler, get_scheduler
+from docmind.utils.config import ProjectConfiguration
+from docmind.utils.helper import atomic_write
+from docmind.utils.metrics import start_metrics_exporter
+from docmind.utils.profiling import RerunProfiler
+from docmind.utils.usage import DEFAULT_USAGE_DB_PATH, UsageLedger, get_usage_ledger
+from docmind.utils.user_writes import get_user_writer
+
+if TYPE_CHECKING:
+    from langchain_community.chat_message_histories import StreamlitChatMessageHistory
+
+    from docmind.llm.rerank import CohereReranker
+    from docmind.vectorstore.shared import CorpusRegistry
 
 
 def authenticate_user():
@@ -27,18 +40,137 @@ def authenticate_user():
 
 
 @st.cache_resource
+def get_model_catalogue() -> ModelCatalogue:
+    """Process wide Cohere model catalogue, persisted on disk."""
+    return ModelCatalogue()
+
+
 def get_cohere_models():
-    """Retrieve and cache the list of Cohere models"""
-    # {'summarize', 'chat', 'generate'}
-    co = cohere.Client()
-    response = co.models.list()
-    models = {}
-    for model in response.models:
-        models[model.name] = {
-            'context_length': model.context_length,
-            'endpoints': model.endpoints
-        }
-    return models
+    """Retrieve the list of Cohere models, served from the cache and refreshed in the background."""
+    return get_model_catalogue().get()
+
+
+@st.cache_resource
+def get_reranker(model: str) -> "CohereReranker":
+    """Process wide reranker, so scores are cached across sessions."""
+    from docmind.llm.rerank import CohereReranker
+
+    return CohereReranker(model=model)
+
+
+CONFIG_FILE_PATH = Path(".") / "config.yaml"
+
+
+@st.cache_resource
+def get_project_config() -> ProjectConfiguration:
+    """Create the default config file if needed and load it once per process."""
+    from docmind.vectorstore.cache import configure_store_cache
+
+    ProjectConfiguration.create_default_config_file(CONFIG_FILE_PATH, Path(".").resolve())
+    config = ProjectConfiguration.load_config(CONFIG_FILE_PATH)
+    start_metrics_exporter(config.metrics_port, config.metrics_file, config.metrics_interval)
+    configure_scheduler(config.cohere_max_concurrency, config.cohere_tokens_per_minute)
+    configure_resilience(ResilienceSettings.from_config(config))
+    configure_store_cache(config.vectorstore_cache_mb)
+    return config
+
+
+def show_timing_breakdown(rows: List[Dict[str, Any]]):
+    """Display the per stage timings of the last answer in the sidebar."""
+    # these stages run inside the retrieval stage and are not added to the total
+    nested_stages = ("condense_question", "vector_search", "rerank", "queue_wait")
+    with st.sidebar.expander("Timing breakdown:", expanded=True):
+        st.table(rows)
+        total = sum(row["duration_ms"] for row in rows if row["stage"] not in nested_stages)
+        st.caption(f"Total: {total:.0f} ms, retrieval includes {', '.join(nested_stages)}.")
+
+
+# answers queued longer than this (seconds) tell the user
+QUEUE_WAIT_NOTICE = 0.5
+
+
+def thinking_message() -> str:
+    """Spinner text while an answer is generated, mentions the Cohere queue when calls are waiting."""
+    queued = get_scheduler().queued
+    return f"Waiting for Cohere, {queued} calls queued..." if queued else "Thinking..."
+
+
+def add_queue_wait(rows: List[Dict[str, Any]], waits: List[float], container) -> List[Dict[str, Any]]:
+    """Add the time the Cohere calls of an answer were queued to its timings, shown in `container` if noticeable."""
+    waited = sum(waits)
+    if waited >= QUEUE_WAIT_NOTICE:
+        container.caption(f"Waited {waited:.1f} s for Cohere, the service is busy.")
+    return rows + [{"stage": "queue_wait", "duration_ms": round(waited * 1000, 1), "calls": len(waits)}]
+
+
+def stop_on_llm_error(error: Exception, container) -> None:
+    """Tell the user their answer failed in `container` and end the page run, nothing is saved to the chat."""
+    container.error(f"The answer could not be completed, please try again in a moment. ({error})")
+    st.stop()
+
+
+@st.cache_resource
+def get_corpus_registry() -> "CorpusRegistry":
+    """Process wide registry of the shared corpora."""
+    from docmind.vectorstore.shared import DEFAULT_SHARED_DIR, CorpusRegistry
+
+    return CorpusRegistry(get_project_config().shared_corpora_dir or DEFAULT_SHARED_DIR)
+
+
+def get_project_usage_ledger() -> UsageLedger:
+    """Token usage ledger configured in the project configuration."""
+    return get_usage_ledger(get_project_config().usage_db_path or DEFAULT_USAGE_DB_PATH)
+
+
+def warm_up_user_store(username: str, user_data_dir: Path) -> None:
+    """Open the store of the user who logged in and load its index in the background, once per session."""
+    from docmind.vectorstore.cache import warm_up_user_vectorstore
+
+    config = get_project_config()
+    if not config.warm_up_on_login or st.session_state.get("store_warmed_up"):
+        return
+    st.session_state["store_warmed_up"] = True
+
+    def embeddings(model: str):
+        from docmind.llm.embeddings import DocMindCohereEmbeddings
+
+        return DocMindCohereEmbeddings(model=model, ledger=get_project_usage_ledger(), username=username)
+
+    model = st.session_state.get("embedding_model_name", config.api_embedding_model)
+    warm_up_user_vectorstore(config, username, user_data_dir, model, embeddings)
+
+
+def show_usage_summary(ledger: UsageLedger, username: str, conversation: str = None):
+    """Display the tokens used by the user, in total and in the current conversation, in the sidebar."""
+    with st.sidebar.expander("Usage:", expanded=False):
+        totals = ledger.totals(username=username)
+        st.caption(f"{totals['requests']} requests, {totals['input_tokens']} input, "
+                   f"{totals['output_tokens']} output and {totals['embedded_tokens']} embedded tokens.")
+        if conversation:
+            current = ledger.totals(username=username, conversation=conversation)
+            st.caption(f"This chat: {current['input_tokens']} input and {current['output_tokens']} output tokens.")
+        rows = ledger.by_stage(username=username)
+        if rows:
+            st.table([{key: round(value) if isinstance(value, float) else value for key, value in row.items()}
+                      for row in rows])
+
+
+def start_page_profiling(page_name: str, username: str) -> Optional[RerunProfiler]:
+    """
+    Profile the calling page run when profiling is enabled in the project configuration, or
+    when an admin turned it on for their session. Must be called from the page script itself.
+    """
+    config = get_project_config()
+    is_admin = username in config.admin_users
+    if is_admin:
+        st.sidebar.toggle("Profile page runs:", value=False, key="profile_page_runs",
+                          help=f"Write a sampling profile and the top allocation sites of every run of this page to "
+                               f"{Path(config.log_path or 'logs') / 'profiles'}.")
+    if not (config.profiling_enabled or (is_admin and st.session_state.get("profile_page_runs"))):
+        return None
+    profiler = RerunProfiler(Path(config.log_path or "logs") / "profiles", page_name,
+                             interval=config.profiling_interval, retention=config.profiling_retention)
+    return profiler.start(sys._getframe(1))
 
 
 def setup_user_directory():
@@ -78,9 +210,12 @@ def setup_page(page_title: str, page_icon: str):
 
 def setup_chat_history(chat_folder: Union[str, Path],
                        current_chat_history_file_key: str,
-                       chat_history_session_state: StreamlitChatMessageHistory = None,
+                       chat_history_session_state: "StreamlitChatMessageHistory" = None,
                        selected_file_to_load_history: str = None,
                        action: str = "setup"):
+    # imported here so the landing and login pages do not pay for langchain
+    from langchain_core.messages import AIMessage, HumanMessage
+
     if isinstance(chat_folder, str):
         chat_folder = Path(chat_folder)
     chat_folder.mkdir(exist_ok=True, parents=True)
@@ -109,18 +244,17 @@ def setup_chat_history(chat_folder: Union[str, Path],
             {"role": "assistant", "content": msg.content} for msg in chat_history_session_state.messages
         ]
         if chat_history_json:
-            with chat_history_file.open('w') as f:
-                json.dump(chat_history_json, f, indent=4)
-                f.write('\n')
+            # replaced whole, a tab or replica loading the chat reads the previous or the new version
+            with get_user_writer(chat_folder.parent).write("chat save"):
+                atomic_write(chat_history_file, json.dumps(chat_history_json, indent=4) + '\n')
         else:
             st.warning("No chat history to save.")
 
     if action == 'new_chat':
         chat_history_file = chat_folder / f'chat_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json'
         st.session_state[current_chat_history_file_key] = chat_history_file
-        with open(chat_history_file, 'w') as f:
-            json.dump([], f, indent=4)
-            f.write('\n')
+        with get_user_writer(chat_folder.parent).write("new chat"):
+            atomic_write(chat_history_file, '[]\n')
         chat_history_session_state.clear()
         st.rerun()
 
@@ -1,4 +1,5 @@
 from pathlib import Path
+from typing import Dict, List, Optional
 
 import yaml
 from pydantic import BaseModel, Field, validator
@@ -14,6 +15,55 @@ from pydantic import BaseModel, Field, validator
 class ProjectConfiguration(BaseModel):
     log_path: Path = None
     log_level: str = Field(default="INFO", env="LOG_LEVEL")
+    log_max_bytes: int = 10 * 1024 * 1024  # size at which the log file is rotated
+    log_backup_count: int = 5
+    log_json: bool = False  # write the log file as JSON lines for log shipping
+    metrics_port: Optional[int] = None  # serve Prometheus metrics on http://127.0.0.1:<port>/metrics
+    metrics_file: Optional[Path] = None  # write Prometheus metrics to this file every `metrics_interval` seconds
+    metrics_interval: float = 15.0
+    usage_db_path: Optional[Path] = None  # SQLite ledger of token usage, defaults to user_data/usage.db
+    vectorstore_backend: str = "chroma"  # "chroma" or "numpy" (memory-mapped matrix in user_data/<user>/vectors)
+    vectorstore_distance_metric: str = "l2"  # "l2", "ip" or "cosine", used when a user's store is created
+    vectorstore_index: str = "exact"  # numpy backend search: "exact", "ivf" or "hnsw"
+    vectorstore_quantization: Optional[str] = None  # numpy backend first pass on "int8" or "binary" codes
+    vectorstore_truncate_dim: Optional[int] = None  # dimensions kept in the quantized codes
+    vectorstore_rescore_factor: int = 4  # candidates rescored at full precision per requested chunk
+    vectorstore_sharding: Optional[str] = None  # split each user's store in shards by "document" or by "size"
+    vectorstore_shard_size: int = 20000  # chunks per shard with "size" sharding
+    vectorstore_search_threads: int = 4  # shards searched in parallel
+    vectorstore_cache_mb: Optional[int] = 1024  # index memory of the user stores kept open per process, None: no limit
+    warm_up_on_login: bool = True  # open the user's store and load its index in the background at login
+    document_routing_top_n: Optional[int] = 8  # documents picked by their centroid before the chunk search, None: off
+    hnsw_m: Optional[int] = None  # HNSW graph degree of new collections, Chroma's default (16) when unset
+    hnsw_construction_ef: Optional[int] = None  # HNSW build candidate list, Chroma's default (100) when unset
+    hnsw_search_ef: Optional[int] = None  # HNSW query candidate list, Chroma's default (10) when unset
+    # per user overrides, e.g. {"alice": {"M": 32, "search_ef": 64}}, see python -m docmind.vectorstore.tuning
+    hnsw_collections: Dict[str, Dict[str, int]] = {}
+    shared_corpora_dir: Optional[Path] = None  # shared read-only corpora, defaults to user_data/_shared_corpora
+    profiling_enabled: bool = False  # profile every page run, written to <log_path>/profiles
+    profiling_interval: float = 0.005  # seconds between stack samples
+    profiling_retention: int = 20  # number of profiles kept
+    admin_users: List[str] = []  # users allowed to profile their own page runs from the sidebar
+    api_port: int = 8600  # python -m docmind.api.server
+    api_ingest_workers: int = 2  # API ingest jobs run in parallel, one at a time per user
+    api_query_workers: int = 8  # API questions answered in parallel
+    api_max_upload_mb: int = 200  # largest API upload request
+    api_token_days: float = 1.0  # validity of the API tokens
+    api_chat_model: str = "command-r"  # model answering API questions that name none
+    api_embedding_model: str = "embed-english-v3.0"  # model embedding the API and drop folder uploads and questions
+    # drop folders synced by python -m docmind.ingest.watcher, {"alice": "/mnt/alice", "corpus:manuals": "/mnt/manuals"}
+    watch_folders: Dict[str, str] = {}
+    watch_debounce: float = 5.0  # seconds a file must stay unchanged before it is ingested
+    cohere_max_concurrency: Optional[int] = 8  # Cohere calls in flight per process, None: no limit
+    cohere_tokens_per_minute: Optional[int] = None  # tokens sent to Cohere per minute per process, None: no limit
+    llm_first_token_timeout: Optional[float] = 30.0  # seconds a streamed answer may take to start, None: no limit
+    llm_inter_token_timeout: Optional[float] = 15.0  # seconds a streamed answer may pause between tokens
+    llm_request_timeout: Optional[float] = 60.0  # seconds of a non-streamed Cohere call, per attempt
+    llm_retries: int = 2  # retries of a failed Cohere call, a stream is only retried before its first token
+    llm_retry_delay: float = 0.5  # seconds before the first retry, doubled on every retry and jittered
+    circuit_failure_threshold: int = 5  # consecutive failures of a Cohere endpoint that make its calls fail fast
+    circuit_reset_seconds: float = 30.0  # seconds calls fail fast before one is let through again
+    llm_hedge_after: Optional[float] = None  # seconds before the question condensing call is sent twice, None: never
 
     @validator("log_level", allow_reuse=True)
     def check_log_level(cls, value):
@@ -22,6 +72,12 @@ class ProjectConfiguration(BaseModel):
             raise ValueError(f"Invalid log level: {value}. Valid options are: {valid_levels}")
         return value.upper()
 
+    def hnsw_params(self, username: str) -> Dict[str, int]:
+        """HNSW parameters of the collection of `username`, the unset ones are left to the backend."""
+        params = {"M": self.hnsw_m, "construction_ef": self.hnsw_construction_ef, "search_ef": self.hnsw_search_ef}
+        params.update(self.hnsw_collections.get(username, {}))
+        return {name: value for name, value in params.items() if value is not None}
+
     # Load configuration from a YAML file or return default configuration
     @classmethod
     def load_config(cls, file_path: Path):
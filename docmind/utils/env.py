@@ -1,13 +1,21 @@
 import logging
 import os
 from pathlib import Path
-from typing import List, Union
+from typing import List, Optional, Union
 
 from dotenv import load_dotenv
 
 # Configure logger for the module
 logger = logging.getLogger(__name__)
 
+# the variable the Cohere SDK reads its endpoint from
+COHERE_URL_VAR = "CO_API_URL"
+
+
+def cohere_base_url() -> Optional[str]:
+    """The Cohere endpoint set in CO_API_URL (e.g. the fake server of the load test), None for the public API."""
+    return os.getenv(COHERE_URL_VAR) or None
+
 
 class EnvironmentLoader:
     """
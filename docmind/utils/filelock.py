@@ -0,0 +1,99 @@
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Union
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+# OS level locks are held per process, so threads of the same process have to be
+# serialized separately before they try to take the lock file.
+_thread_locks: Dict[str, threading.Lock] = {}
+_thread_locks_guard = threading.Lock()
+
+
+def _thread_lock_for(path: Path) -> threading.Lock:
+    with _thread_locks_guard:
+        return _thread_locks.setdefault(str(path), threading.Lock())
+
+
+class FileLockTimeout(TimeoutError):
+    """Raised when a file lock could not be acquired in time."""
+
+
+class FileLock:
+    """
+    Exclusive advisory lock backed by a lock file, safe across threads and processes.
+
+    Example:
+        with FileLock(path.with_suffix(".lock")):
+            ...
+    """
+
+    def __init__(self, lock_path: Union[str, Path], timeout: Optional[float] = None, poll_interval: float = 0.05):
+        self.lock_path = Path(lock_path).resolve()
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._thread_lock = _thread_lock_for(self.lock_path)
+        self._fd: Optional[int] = None
+
+    @property
+    def is_locked(self) -> bool:
+        return self._fd is not None
+
+    def acquire(self) -> None:
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        if not self._thread_lock.acquire(timeout=-1 if self.timeout is None else self.timeout):
+            raise FileLockTimeout(f"Timed out waiting for lock {self.lock_path}")
+
+        try:
+            self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+            fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+            while True:
+                try:
+                    self._lock_fd(fd)
+                    break
+                except OSError:
+                    if deadline is not None and time.monotonic() >= deadline:
+                        os.close(fd)
+                        raise FileLockTimeout(f"Timed out waiting for lock {self.lock_path}")
+                    time.sleep(self.poll_interval)
+            self._fd = fd
+        except BaseException:
+            self._thread_lock.release()
+            raise
+
+    def release(self) -> None:
+        if self._fd is None:
+            return
+        try:
+            self._unlock_fd(self._fd)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+            self._thread_lock.release()
+
+    @staticmethod
+    def _lock_fd(fd: int) -> None:
+        if os.name == "nt":
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        else:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    @staticmethod
+    def _unlock_fd(fd: int) -> None:
+        if os.name == "nt":
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.release()
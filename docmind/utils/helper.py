@@ -1,30 +1,9 @@
+import os
 import re
 import shutil
+import tempfile
 from pathlib import Path
-from typing import List
-
-from langchain_core.documents import Document
-
-
-def refine_docs(
-        docs: List[Document],
-        escape_parts: List[str] = None,
-) -> List[Document]:
-    """Remove any empty string from document or add escape parts
-    to remove them from the docs.
-    this function aim to not produce error when add empty string
-    to the embedding function.
-    """
-    if escape_parts:
-        new_docs = [
-            doc
-            for doc in docs
-            if not any(part in doc.page_content for part in escape_parts)
-        ]
-        new_docs = [doc for doc in new_docs if doc.page_content != ""]
-    else:
-        new_docs = [doc for doc in docs if doc.page_content != ""]
-    return new_docs
+from typing import Union
 
 
 def sanitize_file_name(path):
@@ -101,3 +80,23 @@ def str_to_path(path: str) -> Path:
     """
 
     return Path(path) if isinstance(path, str) else path
+
+
+def atomic_write(path: Path, data: Union[str, bytes]) -> None:
+    """
+    Writes data to a temporary file next to `path` and renames it into place,
+    so readers never observe a partially written file.
+    """
+
+    path = Path(path)
+    mode = "wb" if isinstance(data, bytes) else "w"
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode, **({} if mode == "wb" else {"encoding": "utf-8"})) as tmp_file:
+            tmp_file.write(data)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        os.replace(tmp_name, path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
@@ -1,7 +1,13 @@
+import atexit
 import io
+import json
 import logging
+import queue
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
-from typing import List, Union
+from typing import List, Optional, Tuple, Union
 
 from pydantic import BaseModel, validator
 from rich.console import Console
@@ -10,12 +16,53 @@ from rich.logging import RichHandler
 
 # Define a custom filter class for logging
 class CustomFilters(logging.Filter):
+    """
+    Drops records emitted by a logger whose name starts with one of the filters, or whose
+    unformatted message contains one. The message is never formatted to be matched.
+    """
+
     def __init__(self, filters: Union[str, List[str]]):
         super().__init__()
-        self.filters = [filters] if isinstance(filters, str) else filters
+        self.filters = tuple([filters] if isinstance(filters, str) else filters)
 
     def filter(self, record: logging.LogRecord) -> bool:
-        return not any(f in record.getMessage() for f in self.filters)
+        if record.name.startswith(self.filters):
+            return False
+        return not (isinstance(record.msg, str) and any(f in record.msg for f in self.filters))
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line, for log shipping."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _LoggingState:
+    """Logging setup of the process, shared by every LogConfig."""
+    lock = threading.Lock()
+    key: Optional[Tuple] = None
+    listener: Optional[QueueListener] = None
+    queue_handler: Optional[QueueHandler] = None
+
+
+@atexit.register
+def _stop_listener() -> None:
+    if _LoggingState.listener is not None:
+        _LoggingState.listener.stop()
+        _LoggingState.listener = None
 
 
 # Define a class for log configuration using Pydantic models
@@ -27,6 +74,9 @@ class LogConfig(BaseModel):
     format: str = "%(asctime)s - %(name)s - %(module)s - %(levelname)s - %(message)s"
     datefmt: str = "[%X]"
     clean_log_file: bool = False
+    max_bytes: int = 10 * 1024 * 1024  # rotate the log file at this size, 0 disables rotation
+    backup_count: int = 5
+    json_format: bool = False  # write the log file as JSON lines
 
     # Validators to ensure correct log level and file path
     @validator('level', allow_reuse=True)
@@ -49,25 +99,60 @@ class LogConfig(BaseModel):
     @property
     def handler(self) -> RichHandler:
         return RichHandler(console=self.console, enable_link_path=False, rich_tracebacks=True,
-                           tracebacks_show_locals=True)
+                           tracebacks_show_locals=False)
+
+    @property
+    def file_handler(self) -> RotatingFileHandler:
+        file_handler = RotatingFileHandler(filename=self.log_file_path, maxBytes=self.max_bytes,
+                                           backupCount=self.backup_count, encoding="utf-8")
+        file_handler.setFormatter(JsonFormatter() if self.json_format else logging.Formatter(self.format, self.datefmt))
+        return file_handler
+
+    def _setup_key(self) -> Tuple:
+        return (str(self.log_file_path), self.level, tuple(CustomFilters(self.filters).filters), self.format,
+                self.datefmt, self.clean_log_file, self.max_bytes, self.backup_count, self.json_format)
+
+    def _configure(self) -> None:
+        """
+        Routes the root logger through a QueueHandler, the console and file handlers run on a
+        QueueListener thread so logging callers never block on terminal or disk I/O.
+        """
+        _stop_listener()
+        root = logging.getLogger()
+        if _LoggingState.queue_handler is not None:
+            root.removeHandler(_LoggingState.queue_handler)
 
-    # Method to get a configured logger
-    def get_logger(self) -> logging.Logger:
         # Clean the log file if required
         if self.clean_log_file and self.log_file_path.is_file():
             self.log_file_path.unlink()
 
-        # Create a file handler with the specified format and date format
-        file_handler = logging.FileHandler(filename=self.log_file_path)
-        file_handler.setFormatter(logging.Formatter(self.format, self.datefmt))
+        log_queue = queue.SimpleQueue()
+        queue_handler = QueueHandler(log_queue)
+        # filter before enqueueing so dropped records cost nothing downstream
+        queue_handler.addFilter(CustomFilters(self.filters))
+        root.addHandler(queue_handler)
+        root.setLevel(self.level)
+
+        listener = QueueListener(log_queue, self.handler, self.file_handler)
+        listener.start()
+        _LoggingState.queue_handler = queue_handler
+        _LoggingState.listener = listener
 
-        # Configure the basic logging setup
-        logging.basicConfig(level=self.level, handlers=[self.handler, file_handler])
+    # Method to get a configured logger
+    def get_logger(self) -> logging.Logger:
+        """
+        Configures logging for the process and returns the logger. Calling it again with the
+        same configuration, e.g. on every Streamlit rerun, does not touch the handlers.
+        """
+        key = self._setup_key()
+        with _LoggingState.lock:
+            if _LoggingState.key != key:
+                self._configure()
+                _LoggingState.key = key
 
         # Get the logger with the specified name
         logger = logging.getLogger(self.logger_name)
         logger.setLevel(self.level)
-        logger.addFilter(CustomFilters(self.filters))
         return logger
 
     class Config:
@@ -0,0 +1,209 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+from docmind.utils.helper import atomic_write
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 65536, 131072)
+BYTE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864, 268435456)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """Cumulative Prometheus style histogram, one series per label set."""
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float]):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self._series: Dict[Labels, List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # bucket counts (last one is +Inf), sum, count
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self) -> Dict[Labels, Tuple[List[int], float, int]]:
+        with self._lock:
+            return {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+
+    def to_prometheus(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in sorted(self.snapshot().items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', le),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total:g}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+@dataclass
+class Span:
+    """Timing of one pipeline stage, `attributes` may hold tokens, documents and bytes."""
+    stage: str
+    duration: float = 0.0
+    attributes: Dict[str, Union[int, float]] = field(default_factory=dict)
+
+
+class MetricsRegistry:
+    """Process wide per-stage histograms of duration, tokens, documents and bytes."""
+
+    def __init__(self):
+        self.duration = Histogram("docmind_stage_duration_seconds", "Duration of a pipeline stage.",
+                                  DURATION_BUCKETS)
+        self.tokens = Histogram("docmind_stage_tokens", "Tokens processed by a pipeline stage.", TOKEN_BUCKETS)
+        self.documents = Histogram("docmind_stage_documents", "Documents processed by a pipeline stage.",
+                                   COUNT_BUCKETS)
+        self.bytes = Histogram("docmind_stage_bytes", "Bytes processed by a pipeline stage.", BYTE_BUCKETS)
+        self.first_token = Histogram("docmind_llm_first_token_seconds", "Time to the first streamed token.",
+                                     DURATION_BUCKETS)
+        self.queue_wait = Histogram("docmind_cohere_queue_wait_seconds",
+                                    "Time a Cohere call waited for the scheduler.", DURATION_BUCKETS)
+
+    def record(self, span: Span) -> None:
+        self.duration.observe(span.duration, stage=span.stage)
+        for kind in ("input_tokens", "output_tokens", "embedded_tokens"):
+            if span.attributes.get(kind):
+                self.tokens.observe(span.attributes[kind], stage=span.stage, kind=kind.rsplit("_", 1)[0])
+        if "documents" in span.attributes:
+            self.documents.observe(span.attributes["documents"], stage=span.stage)
+        if "bytes" in span.attributes:
+            self.bytes.observe(span.attributes["bytes"], stage=span.stage)
+        if "first_token" in span.attributes:
+            self.first_token.observe(span.attributes["first_token"], stage=span.stage)
+
+    def to_prometheus(self) -> str:
+        lines = []
+        for histogram in (self.duration, self.tokens, self.documents, self.bytes, self.first_token, self.queue_wait):
+            lines.extend(histogram.to_prometheus())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+@contextmanager
+def span(stage: str, registry: MetricsRegistry = REGISTRY, **attributes: Union[int, float]) -> Iterator[Span]:
+    """
+    Times the enclosed block as `stage` and records it in the registry.
+
+    Example:
+        with span("parse", documents=0) as parse_span:
+            docs = parse()
+            parse_span.attributes["documents"] = len(docs)
+    """
+    current = Span(stage=stage, attributes=dict(attributes))
+    start = time.perf_counter()
+    try:
+        yield current
+    finally:
+        current.duration = time.perf_counter() - start
+        registry.record(current)
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    registry: MetricsRegistry = REGISTRY
+
+    def do_GET(self):
+        if self.path.rstrip("/") not in ("", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.registry.to_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class MetricsExporter:
+    """Serves the registry on a local HTTP endpoint and/or writes it periodically to a file."""
+
+    def __init__(self, registry: MetricsRegistry = REGISTRY, port: Optional[int] = None, host: str = "127.0.0.1",
+                 file_path: Optional[Path] = None, interval: float = 15.0):
+        self.registry = registry
+        self.port = port
+        self.host = host
+        self.file_path = Path(file_path) if file_path else None
+        self.interval = interval
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._stop = threading.Event()
+
+    def start(self) -> "MetricsExporter":
+        if self.port is not None:
+            handler = type("MetricsRequestHandler", (_MetricsRequestHandler,), {"registry": self.registry})
+            self._server = ThreadingHTTPServer((self.host, self.port), handler)
+            threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+            logger.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+        if self.file_path is not None:
+            threading.Thread(target=self._write_periodically, name="metrics-file", daemon=True).start()
+        return self
+
+    def write_file(self) -> None:
+        self.file_path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write(self.file_path, self.registry.to_prometheus())
+
+    def _write_periodically(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.write_file()
+            except OSError as e:
+                logger.warning(f"Failed to write metrics to {self.file_path}: {e}")
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+_exporter: Optional[MetricsExporter] = None
+_exporter_lock = threading.Lock()
+
+
+def start_metrics_exporter(port: Optional[int] = None, file_path: Optional[Path] = None,
+                           interval: float = 15.0) -> Optional[MetricsExporter]:
+    """Starts the process wide exporter once, later calls return the running one."""
+    global _exporter
+    with _exporter_lock:
+        if _exporter is None and (port is not None or file_path is not None):
+            try:
+                _exporter = MetricsExporter(port=port, file_path=file_path, interval=interval).start()
+            except OSError as e:
+                logger.warning(f"Failed to start the metrics exporter: {e}")
+        return _exporter
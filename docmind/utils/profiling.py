@@ -0,0 +1,141 @@
+import logging
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from types import FrameType
+from typing import List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# concurrent sessions may profile at the same time, tracemalloc is stopped with the last one
+_tracing_lock = threading.Lock()
+_tracing_users = 0
+
+
+def _start_tracing() -> None:
+    global _tracing_users
+    with _tracing_lock:
+        if _tracing_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _tracing_users += 1
+
+
+def _stop_tracing() -> None:
+    global _tracing_users
+    with _tracing_lock:
+        _tracing_users -= 1
+        if _tracing_users == 0:
+            tracemalloc.stop()
+
+
+def _frame_label(frame: FrameType) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})"
+
+
+class RerunProfiler:
+    """
+    Sampling profiler for a single Streamlit script run.
+
+    `start` is called from the page script, a background thread then samples the stack of the
+    script thread every `interval` seconds until the script frame has left the stack, whether
+    the run finished, called st.stop or was interrupted by a rerun. The samples are written as
+    folded stacks (`<name>-<time>.folded`, readable by flamegraph.pl or speedscope) and the top
+    allocation sites traced by tracemalloc as `<name>-<time>.alloc.txt`. Only the newest
+    `retention` profiles are kept in `output_dir`.
+
+    Example:
+        RerunProfiler(Path("logs/profiles"), "docs_chat").start(sys._getframe())
+    """
+
+    def __init__(self, output_dir: Union[str, Path], name: str, interval: float = 0.005, retention: int = 20,
+                 top_allocations: int = 25):
+        self.output_dir = Path(output_dir)
+        self.name = name
+        self.interval = interval
+        self.retention = retention
+        self.top_allocations = top_allocations
+        self.counts: Counter = Counter()
+        self.folded_path: Optional[Path] = None
+        self.allocations_path: Optional[Path] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self, frame: Optional[FrameType] = None) -> "RerunProfiler":
+        """Profile the run of `frame`, by default the caller's frame."""
+        script_frame = frame or sys._getframe(1)
+        thread_id = threading.get_ident()
+        _start_tracing()
+        self._thread = threading.Thread(target=self._sample, args=(thread_id, script_frame, time.time()),
+                                        name=f"profiler-{self.name}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait until the profile is written, return False on timeout."""
+        if self._thread is not None:
+            self._thread.join(timeout)
+            return not self._thread.is_alive()
+        return True
+
+    def _sample(self, thread_id: int, script_frame: FrameType, started: float) -> None:
+        samples = 0
+        while not self._stop.is_set():
+            frame = sys._current_frames().get(thread_id)
+            stack: List[str] = []
+            found = False
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                if frame is script_frame:
+                    found = True
+                frame = frame.f_back
+            if not found:
+                break
+            self.counts[";".join(reversed(stack))] += 1
+            samples += 1
+            time.sleep(self.interval)
+
+        del script_frame
+        try:
+            self._write(started, time.time() - started, samples)
+        except OSError as e:
+            logger.warning(f"Failed to write the profile of {self.name}: {e}")
+        finally:
+            _stop_tracing()
+
+    def _write(self, started: float, duration: float, samples: int) -> None:
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        stem = f"{self.name}-{datetime.fromtimestamp(started).strftime('%Y%m%d_%H%M%S_%f')}"
+        self.folded_path = self.output_dir / f"{stem}.folded"
+        self.allocations_path = self.output_dir / f"{stem}.alloc.txt"
+
+        self.folded_path.write_text("".join(f"{stack} {count}\n" for stack, count in self.counts.most_common()),
+                                    encoding="utf-8")
+
+        lines = [f"{self.name}: {duration * 1000:.0f} ms, {samples} samples every {self.interval * 1000:g} ms"]
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            lines.append(f"traced memory: current {current / 1024:.0f} KiB, peak {peak / 1024:.0f} KiB")
+            lines.append(f"top {self.top_allocations} allocation sites:")
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            ])
+            lines.extend(str(stat) for stat in snapshot.statistics("lineno")[:self.top_allocations])
+        self.allocations_path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+        logger.info(f"Profile of {self.name} written to {self.folded_path}")
+        self._prune()
+
+    def _prune(self) -> None:
+        profiles = sorted(self.output_dir.glob("*.folded"), key=lambda path: path.stat().st_mtime, reverse=True)
+        for path in profiles[self.retention:]:
+            path.unlink(missing_ok=True)
+            path.with_name(path.name[:-len(".folded")] + ".alloc.txt").unlink(missing_ok=True)
@@ -0,0 +1,156 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_USAGE_DB_PATH = Path("user_data") / "usage.db"
+
+# stages recorded in the ledger
+REPHRASE_STAGE = "rephrase"
+GENERATE_STAGE = "generate"
+CHAT_STAGE = "chat"
+EMBED_STAGE = "embed"
+EMBED_QUERY_STAGE = "embed_query"
+
+_COLUMNS = ("requests", "input_tokens", "output_tokens", "embedded_tokens", "latency_ms")
+_AGGREGATES = """
+    COUNT(*) AS requests,
+    COALESCE(SUM(input_tokens), 0) AS input_tokens,
+    COALESCE(SUM(output_tokens), 0) AS output_tokens,
+    COALESCE(SUM(embedded_tokens), 0) AS embedded_tokens,
+    COALESCE(AVG(latency_ms), 0) AS latency_ms
+"""
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (4 characters per token) used when the API does not report usage."""
+    return (len(text) + 3) // 4 if text else 0
+
+
+class UsageLedger:
+    """
+    SQLite ledger of LLM and embedding token usage per user, conversation and pipeline stage.
+
+    Example:
+        ledger = UsageLedger(Path("usage.db"))
+        ledger.record("alice", "generate", conversation="chat_1.json", input_tokens=120, output_tokens=80)
+        ledger.by_stage(username="alice")
+    """
+
+    def __init__(self, db_path: Union[str, Path] = DEFAULT_USAGE_DB_PATH):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(self.db_path), timeout=30, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS usage (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    created_at REAL NOT NULL,
+                    username TEXT NOT NULL,
+                    conversation TEXT,
+                    stage TEXT NOT NULL,
+                    model TEXT,
+                    settings TEXT,
+                    input_tokens INTEGER NOT NULL DEFAULT 0,
+                    output_tokens INTEGER NOT NULL DEFAULT 0,
+                    embedded_tokens INTEGER NOT NULL DEFAULT 0,
+                    estimated INTEGER NOT NULL DEFAULT 0,
+                    latency_ms REAL
+                )
+            """)
+            self._connection.execute("CREATE INDEX IF NOT EXISTS usage_user ON usage (username, created_at)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS usage_conversation ON usage (conversation)")
+
+    def record(
+            self,
+            username: str,
+            stage: str,
+            *,
+            conversation: Optional[str] = None,
+            model: Optional[str] = None,
+            settings: Optional[Dict[str, Any]] = None,
+            input_tokens: int = 0,
+            output_tokens: int = 0,
+            embedded_tokens: int = 0,
+            estimated: bool = False,
+            latency: Optional[float] = None,
+    ) -> None:
+        """Add one entry, `latency` is in seconds."""
+        try:
+            with self._lock, self._connection:
+                self._connection.execute(
+                    "INSERT INTO usage (created_at, username, conversation, stage, model, settings, input_tokens, "
+                    "output_tokens, embedded_tokens, estimated, latency_ms) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (time.time(), username, conversation, stage, model,
+                     json.dumps(settings, sort_keys=True) if settings else None,
+                     int(input_tokens), int(output_tokens), int(embedded_tokens), int(estimated),
+                     None if latency is None else latency * 1000),
+                )
+        except sqlite3.Error as e:
+            # usage accounting must never break answering
+            logger.warning(f"Failed to record usage for {username}: {e}")
+
+    def _query(self, group_by: Optional[str], username: Optional[str] = None, conversation: Optional[str] = None,
+               since: Optional[float] = None) -> List[Dict[str, Any]]:
+        conditions, params = [], []
+        for column, value in (("username", username), ("conversation", conversation)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            conditions.append("created_at >= ?")
+            params.append(since)
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        select = f"{group_by}, " if group_by else ""
+        group = f"GROUP BY {group_by} ORDER BY input_tokens + output_tokens + embedded_tokens DESC" if group_by else ""
+        with self._lock:
+            rows = self._connection.execute(f"SELECT {select}{_AGGREGATES} FROM usage {where} {group}",
+                                            params).fetchall()
+        keys = ([group_by] if group_by else []) + list(_COLUMNS)
+        return [dict(zip(keys, row)) for row in rows]
+
+    def totals(self, username: Optional[str] = None, conversation: Optional[str] = None,
+               since: Optional[float] = None) -> Dict[str, Any]:
+        """Summed usage, optionally restricted to a user, a conversation and a start time."""
+        return self._query(None, username, conversation, since)[0]
+
+    def by_user(self, since: Optional[float] = None) -> List[Dict[str, Any]]:
+        return self._query("username", since=since)
+
+    def by_conversation(self, username: Optional[str] = None, since: Optional[float] = None) -> List[Dict[str, Any]]:
+        return self._query("conversation", username, since=since)
+
+    def by_stage(self, username: Optional[str] = None, conversation: Optional[str] = None,
+                 since: Optional[float] = None) -> List[Dict[str, Any]]:
+        return self._query("stage", username, conversation, since)
+
+    def by_model(self, username: Optional[str] = None, since: Optional[float] = None) -> List[Dict[str, Any]]:
+        return self._query("model", username, since=since)
+
+    def by_settings(self, username: Optional[str] = None, since: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Usage grouped by the model settings (temperature, max tokens, ...) it was produced with."""
+        return self._query("settings", username, since=since)
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+_ledgers: Dict[str, UsageLedger] = {}
+_ledgers_lock = threading.Lock()
+
+
+def get_usage_ledger(db_path: Union[str, Path] = DEFAULT_USAGE_DB_PATH) -> UsageLedger:
+    """Return the process wide ledger stored at `db_path`."""
+    key = str(Path(db_path).resolve())
+    with _ledgers_lock:
+        if key not in _ledgers:
+            _ledgers[key] = UsageLedger(db_path)
+        return _ledgers[key]
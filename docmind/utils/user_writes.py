@@ -0,0 +1,110 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+from docmind.utils.filelock import FileLock
+
+logger = logging.getLogger(__name__)
+
+WRITE_LOCK_FILE = ".write.lock"
+# writers of a process served in a row before the lock is given up so other processes get their turn
+DEFAULT_MAX_BURST = 16
+
+
+class UserWriter:
+    """
+    Single writer of a user's data directory: the vector store collection, the reference files and
+    the chat files. Writes of every session and API job of the process take turns in arrival order,
+    and writes of other processes sharing the directory (Streamlit replicas, the API, the indexer)
+    are excluded by a lock file. Readers take no lock, files are replaced atomically and the stores
+    serve searches during a write.
+
+    Writes arriving while another one runs are coalesced: the process keeps the lock file for the
+    whole burst (at most `max_burst` writes) and the stores given to `flush_later` are flushed once
+    at its end instead of after every write.
+    """
+
+    def __init__(self, user_data_dir: Union[str, Path], max_burst: int = DEFAULT_MAX_BURST,
+                 lock_timeout: Optional[float] = None):
+        self.user_data_dir = Path(user_data_dir).resolve()
+        self.max_burst = max_burst
+        self.file_lock = FileLock(self.user_data_dir / WRITE_LOCK_FILE, timeout=lock_timeout)
+        self._condition = threading.Condition()
+        self._waiting: List[int] = []
+        self._sequence = 0
+        self._writing = False
+        self._burst = 0
+        self._to_flush: Dict[int, Any] = {}
+
+    @property
+    def waiting(self) -> int:
+        with self._condition:
+            return len(self._waiting)
+
+    @contextmanager
+    def write(self, description: str = "write") -> Iterator["UserWriter"]:
+        """Hold the write turn of the user for the enclosed block."""
+        started = time.monotonic()
+        with self._condition:
+            self._sequence += 1
+            ticket = self._sequence
+            self._waiting.append(ticket)
+            try:
+                self._condition.wait_for(lambda: not self._writing and self._waiting[0] == ticket)
+            except BaseException:
+                self._waiting.remove(ticket)
+                self._condition.notify_all()
+                raise
+            self._waiting.pop(0)
+            self._writing = True
+        try:
+            if not self.file_lock.is_locked:
+                self.file_lock.acquire()
+                self._burst = 0
+            waited = time.monotonic() - started
+            if waited > 1.0:
+                logger.info(f"{description} of {self.user_data_dir.name} waited {waited:.1f}s for its turn")
+            self._burst += 1
+            yield self
+        finally:
+            self._end_turn()
+
+    def flush_later(self, store: Any) -> None:
+        """Flush `store` when the current burst of writes ends, before other processes get the lock."""
+        if hasattr(store, "flush"):
+            self._to_flush[id(store)] = store
+
+    def _end_turn(self) -> None:
+        with self._condition:
+            keep = bool(self._waiting) and self._burst < self.max_burst
+        try:
+            if not keep:
+                self._flush()
+        finally:
+            if not keep and self.file_lock.is_locked:
+                self.file_lock.release()
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+    def _flush(self) -> None:
+        stores, self._to_flush = list(self._to_flush.values()), {}
+        for store in stores:
+            store.flush()
+
+
+_writers: Dict[Path, UserWriter] = {}
+_writers_lock = threading.Lock()
+
+
+def get_user_writer(user_data_dir: Union[str, Path]) -> UserWriter:
+    """The writer of a user's data directory shared by every session and job of the process."""
+    path = Path(user_data_dir).resolve()
+    with _writers_lock:
+        writer = _writers.get(path)
+        if writer is None:
+            writer = _writers[path] = UserWriter(path)
+        return writer
@@ -0,0 +1,8 @@
+import platform
+import sys
+
+# chromadb needs a newer sqlite3 than most Linux distributions ship, swap in pysqlite3
+# before anything below this package imports chromadb.
+if platform.system() == "Linux":
+    __import__("pysqlite3")
+    sys.modules["sqlite3"] = sys.modules.pop("pysqlite3")
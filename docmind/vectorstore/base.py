@@ -0,0 +1,237 @@
+import uuid
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+
+SEARCH_TYPES = ("similarity", "mmr")
+
+_COMPARISONS = {
+    "$eq": lambda value, operand: value == operand,
+    "$ne": lambda value, operand: value != operand,
+    "$gt": lambda value, operand: value is not None and value > operand,
+    "$gte": lambda value, operand: value is not None and value >= operand,
+    "$lt": lambda value, operand: value is not None and value < operand,
+    "$lte": lambda value, operand: value is not None and value <= operand,
+    "$in": lambda value, operand: value in operand,
+    "$nin": lambda value, operand: value not in operand,
+}
+
+
+def match_filter(metadata: Dict[str, Any], where: Optional[Dict[str, Any]]) -> bool:
+    """
+    Evaluate a Chroma style `where` filter against the metadata of a chunk.
+
+    Example:
+        match_filter({"source": "A.pdf"}, {"source": {"$in": ["A.pdf", "B.pdf"]}})  # True
+    """
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(match_filter(metadata, sub) for sub in condition):
+                return False
+        elif key == "$or":
+            if not any(match_filter(metadata, sub) for sub in condition):
+                return False
+        elif isinstance(condition, dict):
+            for operator, operand in condition.items():
+                if operator not in _COMPARISONS:
+                    raise ValueError(f"Unsupported filter operator: {operator}")
+                if not _COMPARISONS[operator](metadata.get(key), operand):
+                    return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+
+def filter_sources(where: Optional[Dict[str, Any]], key: str = "source") -> Optional[Set[str]]:
+    """
+    The values of `key` a filter restricts the chunks to, None when it does not restrict them.
+
+    Example:
+        filter_sources({"$and": [{"source": {"$in": ["A.pdf", "B.pdf"]}}, {"page": 3}]})  # {"A.pdf", "B.pdf"}
+    """
+    if not where:
+        return None
+    allowed: Optional[Set[str]] = None
+    for name, condition in where.items():
+        if name == "$and":
+            restricted = [sources for sources in (filter_sources(sub, key) for sub in condition) if sources is not None]
+            sources = set.intersection(*restricted) if restricted else None
+        elif name == "$or":
+            branches = [filter_sources(sub, key) for sub in condition]
+            sources = set().union(*branches) if branches and all(branch is not None for branch in branches) else None
+        elif name != key:
+            continue
+        elif isinstance(condition, dict):
+            if "$eq" in condition:
+                sources = {condition["$eq"]}
+            elif "$in" in condition:
+                sources = set(condition["$in"])
+            else:
+                sources = None
+        else:
+            sources = {condition}
+        if sources is not None:
+            allowed = sources if allowed is None else allowed & sources
+    return allowed
+
+
+def merge_by_score(results: Sequence[Sequence[Tuple[Document, float]]],
+                   k: int) -> List[Tuple[Document, float, int]]:
+    """
+    Merge the results of several stores into the `k` best, with the position of the store each
+    came from. A chunk found in several stores (same source and text) is kept once.
+    """
+    ranked = sorted(((doc, score, origin) for origin, found in enumerate(results) for doc, score in found),
+                    key=lambda result: result[1], reverse=True)
+    merged, seen = [], set()
+    for doc, score, origin in ranked:
+        key = (doc.metadata.get("source"), doc.page_content)
+        if key not in seen:
+            seen.add(key)
+            merged.append((doc, score, origin))
+    return merged[:k]
+
+
+def proportional_quotas(k: int, shares: Dict[Any, int]) -> Dict[Any, int]:
+    """
+    Split `k` in proportion to `shares` (largest remainder), e.g. the chunks every store
+    contributes to a merged MMR search by its share of the merged candidates.
+    """
+    total = sum(shares.values())
+    if not total:
+        return {}
+    k = min(k, total)
+    quotas = {name: k * share // total for name, share in shares.items()}
+    for name in sorted(shares, key=lambda name: k * shares[name] % total, reverse=True)[:k - sum(quotas.values())]:
+        quotas[name] += 1
+    return quotas
+
+
+class VectorStore(ABC):
+    """
+    Per user store of embedded chunks.
+
+    Scores returned by the search methods are similarities: higher is closer. Their scale
+    depends on the backend and the distance metric, they are only comparable between stores
+    sharing both.
+    """
+
+    def __init__(self, embedding: Embeddings):
+        self.embedding = embedding
+
+    def add_documents(self, documents: Sequence[Document], ids: Optional[List[str]] = None) -> List[str]:
+        """Embed and insert documents, an existing id is overwritten."""
+        if not documents:
+            return []
+        texts = [doc.page_content for doc in documents]
+        return self.add_embeddings(texts, self.embedding.embed_documents(texts), [doc.metadata for doc in documents],
+                                   ids)
+
+    @abstractmethod
+    def add_embeddings(self, texts: Sequence[str], embeddings: Sequence[Sequence[float]],
+                       metadatas: Optional[Sequence[Dict[str, Any]]] = None,
+                       ids: Optional[Sequence[str]] = None) -> List[str]:
+        """Insert already embedded chunks, an existing id is overwritten."""
+
+    @abstractmethod
+    def delete(self, ids: Iterable[str]) -> None:
+        """Delete chunks by id, unknown ids are ignored."""
+
+    @abstractmethod
+    def ids_where(self, filter: Dict[str, Any]) -> List[str]:
+        """The ids of the chunks matching a `where` filter, e.g. to delete a document."""
+
+    @abstractmethod
+    def get_chunks(self, ids: Sequence[str]) -> Tuple[List[str], List[Document], np.ndarray]:
+        """The stored chunks of `ids` with their ids and vectors, unknown ids are skipped."""
+
+    def search(self, query: str, k: int = 4, filter: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float]]:
+        """The `k` chunks closest to the query and their score."""
+        return self.search_by_vector(self.embedding.embed_query(query), k, filter)
+
+    @abstractmethod
+    def search_by_vector(self, vector: Sequence[float], k: int = 4,
+                         filter: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float]]:
+        """The `k` chunks closest to the vector and their score."""
+
+    def max_marginal_relevance_search(self, query: str, k: int = 4, fetch_k: int = 20, lambda_mult: float = 0.5,
+                                      filter: Optional[Dict[str, Any]] = None) -> List[Document]:
+        """Pick `k` of the `fetch_k` closest chunks, trading relevance for diversity by `lambda_mult`."""
+        return self.max_marginal_relevance_search_by_vector(self.embedding.embed_query(query), k, fetch_k,
+                                                            lambda_mult, filter)
+
+    @abstractmethod
+    def max_marginal_relevance_search_by_vector(self, vector: Sequence[float], k: int = 4, fetch_k: int = 20,
+                                                lambda_mult: float = 0.5,
+                                                filter: Optional[Dict[str, Any]] = None) -> List[Document]:
+        """Maximal marginal relevance search around an already embedded query."""
+
+    @abstractmethod
+    def count(self) -> int:
+        """Number of stored chunks."""
+
+    @abstractmethod
+    def iter_embeddings(self, batch_size: int = 1000) -> Iterator[Tuple[List[str], np.ndarray]]:
+        """The ids and vectors of the stored chunks, `batch_size` at a time."""
+
+    @abstractmethod
+    def snapshot(self, path: Union[str, Path]) -> Path:
+        """Write a consistent copy of the store to the directory `path`."""
+
+    @abstractmethod
+    def drop(self) -> None:
+        """Delete every chunk and the collection itself."""
+
+    def close(self) -> None:
+        """Release files and connections."""
+
+    @property
+    def distance_metric(self) -> Optional[str]:
+        """The distance metric the scores are derived from, None when the store cannot tell."""
+        return None
+
+    def as_retriever(self, search_type: str = "similarity",
+                     search_kwargs: Optional[Dict[str, Any]] = None) -> "VectorStoreBackendRetriever":
+        return VectorStoreBackendRetriever(store=self, search_type=search_type, search_kwargs=search_kwargs or {})
+
+    @staticmethod
+    def new_ids(count: int) -> List[str]:
+        return [str(uuid.uuid4()) for _ in range(count)]
+
+
+class VectorStoreBackendRetriever(BaseRetriever):
+    """Retriever over any VectorStore, `search_kwargs` takes k, filter and for mmr fetch_k and lambda_mult."""
+
+    store: VectorStore
+    search_type: str = "similarity"
+    search_kwargs: Dict[str, Any] = {}
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        if self.search_type == "similarity":
+            kwargs = {key: value for key, value in self.search_kwargs.items() if key in ("k", "filter")}
+            return [doc for doc, _ in self.store.search(query, **kwargs)]
+        if self.search_type == "mmr":
+            return self.store.max_marginal_relevance_search(query, **self.search_kwargs)
+        raise ValueError(f"search_type should be one of {SEARCH_TYPES}, got {self.search_type}")
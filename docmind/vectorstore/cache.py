@@ -0,0 +1,267 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+
+if TYPE_CHECKING:
+    from langchain_core.embeddings import Embeddings
+
+    from docmind.utils.config import ProjectConfiguration
+    from docmind.vectorstore.base import VectorStore
+    from docmind.vectorstore.shared import CorpusRegistry
+
+logger = logging.getLogger(__name__)
+
+# directories of a user's store whose files are loaded into memory to search, the SQLite files are not.
+# chroma keeps the collections it loaded in its process wide client, closing a store does not unload
+# them, so they are not counted against the budget
+_INDEX_DIRECTORIES = ("vectors", "shards")
+_NOT_LOADED = (".sqlite3", ".db", ".db-wal", ".db-shm", ".lock")
+# seconds a store stays open after its last use even over the budget, a session may still be searching it
+DEFAULT_MIN_IDLE = 30.0
+# seconds after which the size of a cached store is measured again, uploads make it grow
+_RESIZE_INTERVAL = 60.0
+
+Key = Tuple[str, str]
+
+
+def index_bytes(user_data_dir: Union[str, Path]) -> int:
+    """Estimated memory of the search index of a user's store: the size of the files loaded to search it."""
+    total = 0
+    for name in _INDEX_DIRECTORIES:
+        directory = Path(user_data_dir) / name
+        if directory.is_dir():
+            total += sum(path.stat().st_size for path in directory.rglob("*")
+                         if path.is_file() and not path.name.endswith(_NOT_LOADED))
+    return total
+
+
+def touch_index(store: "VectorStore") -> None:
+    """Load the search index into memory with a search for one of the stored vectors, nothing is embedded."""
+    for _, vectors in store.iter_embeddings(batch_size=1):
+        if len(vectors):
+            store.search_by_vector(vectors[0], k=1)
+        break
+
+
+@dataclass
+class _Entry:
+    store: "VectorStore"
+    directory: Path
+    size: int
+    last_used: float = field(default_factory=time.monotonic)
+    sized_at: float = field(default_factory=time.monotonic)
+    # blocks of code using the store right now, see StoreCache.pin
+    pins: int = 0
+
+
+class StoreCache:
+    """
+    Process wide cache of the opened user stores, so the first question of a session does not pay for
+    opening the store and loading its index. Stores are kept by user directory and embedding model;
+    when their indexes take more than `memory_budget` bytes, the least recently used ones idle for
+    `min_idle` seconds are closed, which unloads their indexes. None keeps every store open.
+
+    A store is idle from its last `get`, callers using it longer than `min_idle` seconds, e.g. an
+    upload, hold it open with `pin` meanwhile.
+    """
+
+    def __init__(self, memory_budget: Optional[int] = None, min_idle: float = DEFAULT_MIN_IDLE,
+                 warm_up_workers: int = 2):
+        self.memory_budget = memory_budget
+        self.min_idle = min_idle
+        self._entries: "OrderedDict[Key, _Entry]" = OrderedDict()
+        self._opening: Dict[Key, Future] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=warm_up_workers, thread_name_prefix="docmind-warm-up")
+
+    def configure(self, memory_budget: Optional[int] = None) -> None:
+        self.memory_budget = memory_budget
+        self._enforce_budget()
+
+    @property
+    def resident_bytes(self) -> int:
+        with self._lock:
+            return sum(entry.size for entry in self._entries.values())
+
+    def __contains__(self, key: Key) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key: Key, directory: Union[str, Path], open_store: Callable[[], "VectorStore"]) -> "VectorStore":
+        """The cached store of `key`, opened by `open_store` on first use; concurrent callers wait for one open."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                entry.last_used = time.monotonic()
+            else:
+                opening = self._opening.get(key)
+                owner = opening is None
+                if owner:
+                    opening = self._opening[key] = Future()
+        if entry is not None:
+            if time.monotonic() - entry.sized_at > _RESIZE_INTERVAL:
+                entry.size, entry.sized_at = index_bytes(entry.directory), time.monotonic()
+                self._enforce_budget(keep=key)
+            return entry.store
+        if not owner:
+            return opening.result()
+
+        try:
+            started = time.perf_counter()
+            store = open_store()
+            entry = _Entry(store, Path(directory), index_bytes(directory))
+            logger.info(f"Opened the store of {directory} ({entry.size / 2 ** 20:.1f} MB) in "
+                        f"{time.perf_counter() - started:.2f}s")
+        except BaseException as error:
+            with self._lock:
+                self._opening.pop(key, None)
+            opening.set_exception(error)
+            raise
+        with self._lock:
+            self._entries[key] = entry
+            self._opening.pop(key, None)
+        opening.set_result(store)
+        self._enforce_budget(keep=key)
+        return store
+
+    @contextmanager
+    def pin(self, *stores: "VectorStore") -> Iterator[None]:
+        """Keep cached `stores` open during the block, their idle time starts when it ends."""
+        with self._lock:
+            entries = [entry for entry in self._entries.values() if any(entry.store is store for store in stores)]
+            for entry in entries:
+                entry.pins += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                for entry in entries:
+                    entry.pins -= 1
+                    entry.last_used = time.monotonic()
+            # the budget may have been exceeded while the stores could not be closed
+            self._enforce_budget()
+
+    def warm_up(self, key: Key, directory: Union[str, Path], open_store: Callable[[], "VectorStore"]) -> Future:
+        """Open the store of `key` and load its index in the background, e.g. when its user logs in."""
+
+        def warm() -> "VectorStore":
+            started = time.perf_counter()
+            store = self.get(key, directory, open_store)
+            with self.pin(store):
+                touch_index(store)
+            logger.info(f"Warmed up the store of {directory} in {time.perf_counter() - started:.2f}s")
+            return store
+
+        def report(done: Future) -> None:
+            if done.exception() is not None:
+                logger.warning(f"Warming up the store of {directory} failed: {done.exception()!r}")
+
+        future = self._executor.submit(warm)
+        future.add_done_callback(report)
+        return future
+
+    def discard(self, directory: Union[str, Path]) -> None:
+        """Close the cached stores of a directory, e.g. after its collection was dropped."""
+        directory = Path(directory)
+        with self._lock:
+            keys = [key for key, entry in self._entries.items() if entry.directory == directory]
+            entries = [self._entries.pop(key) for key in keys]
+        for entry in entries:
+            entry.store.close()
+
+    def _enforce_budget(self, keep: Optional[Key] = None) -> None:
+        if self.memory_budget is None:
+            return
+        now = time.monotonic()
+        evicted: List[_Entry] = []
+        with self._lock:
+            resident = sum(entry.size for entry in self._entries.values())
+            for directory in [entry.directory for entry in self._entries.values()]:
+                if resident <= self.memory_budget:
+                    break
+                # the stores of a directory share their client, they are closed together or not at all
+                keys = [key for key, entry in self._entries.items() if entry.directory == directory]
+                if not keys or any(key == keep or self._entries[key].pins
+                                   or now - self._entries[key].last_used < self.min_idle for key in keys):
+                    continue
+                for key in keys:
+                    entry = self._entries.pop(key)
+                    resident -= entry.size
+                    evicted.append(entry)
+        for entry in evicted:
+            logger.info(f"Closing the store of {entry.directory} unused for {now - entry.last_used:.0f}s, "
+                        f"{resident / 2 ** 20:.1f} MB of indexes stay loaded")
+            entry.store.close()
+
+
+_cache = StoreCache()
+
+
+def get_store_cache() -> StoreCache:
+    """The cache every session of the process takes its stores from."""
+    return _cache
+
+
+def configure_store_cache(memory_budget_mb: Optional[float] = None) -> StoreCache:
+    """Apply the memory budget of the project configuration to the process wide cache."""
+    _cache.configure(None if memory_budget_mb is None else int(memory_budget_mb * 2 ** 20))
+    return _cache
+
+
+def cache_key(user_data_dir: Union[str, Path], embedding_func: "Embeddings") -> Key:
+    return str(Path(user_data_dir).resolve()), getattr(embedding_func, "model", None) or type(embedding_func).__name__
+
+
+def get_user_vectorstore(config: "ProjectConfiguration", username: str, user_data_dir: Union[str, Path],
+                         embedding_func: "Embeddings") -> "VectorStore":
+    """The store of a user with the settings of the project configuration, kept open across reruns and sessions."""
+    from docmind.vectorstore.factory import open_user_vectorstore
+
+    return _cache.get(cache_key(user_data_dir, embedding_func), Path(user_data_dir).resolve(),
+                      lambda: open_user_vectorstore(config, username, user_data_dir, embedding_func))
+
+
+def get_corpus_vectorstore(registry: "CorpusRegistry", name: str, embedding_func: "Embeddings", username: str,
+                           **options: Any) -> "VectorStore":
+    """A shared corpus mounted read-only for `username`, opened once per process and embedding model."""
+    if not registry.can_read(name, username):
+        raise PermissionError(f"{username} may not read the corpus {name}")
+    directory = (registry.directory / name).resolve()
+    return _cache.get(cache_key(directory, embedding_func), directory,
+                      lambda: registry.open(name, embedding_func, **options))
+
+
+def warm_up_user_vectorstore(config: "ProjectConfiguration", username: str, user_data_dir: Union[str, Path],
+                             model: str, embeddings: Callable[[str], "Embeddings"]) -> Optional[Future]:
+    """
+    Open the store of a user for the embedding `model` and load its index in the background, None when it
+    is open already. `embeddings(model)` creates the embedding function in the background too.
+    """
+    key = (str(Path(user_data_dir).resolve()), model)
+    if key in _cache:
+        return None
+
+    def open_store() -> "VectorStore":
+        # imported by the warm-up thread, the login page does not wait for the vector store modules
+        from docmind.vectorstore.factory import open_user_vectorstore
+
+        return open_user_vectorstore(config, username, user_data_dir, embeddings(model))
+
+    return _cache.warm_up(key, Path(user_data_dir).resolve(), open_store)
@@ -1,26 +1,163 @@
 import logging
 import os
+import threading
 from pathlib import Path
-from typing import Union
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
 
+import chromadb
+import numpy as np
 from chromadb.config import Settings
 from langchain_community.vectorstores.chroma import Chroma
+from langchain_core.documents import Document
 from langchain_core.embeddings import Embeddings
 
+from docmind.vectorstore.base import VectorStore
+
 logger = logging.getLogger(__name__)
 
 # https://docs.trychroma.com/guides#creating,-inspecting,-and-deleting-collections:~:text=Valid%20options%20for%20hnsw%3Aspace%20are%20%22l2%22%2C%20%22ip%2C%20%22or%20%22cosine%22.%20The%20default%20is%20%22l2%22%20which%20is%20the%20squared%20L2%20norm.
 DISTANCE_METRIC = ["l2", "ip", "cosine"]
 PERSIST = True
 
+# HNSW parameters of a collection and Chroma's defaults, stored as "hnsw:<name>" in the collection metadata.
+# M and construction_ef shape the graph when it is built, search_ef is the candidate list of every query.
+HNSW_DEFAULTS = {"M": 16, "construction_ef": 100, "search_ef": 10}
+
+# number of chunks read and written at a time when copying a collection
+_COPY_BATCH_SIZE = 1000
+
+
+def _hnsw_params(metadata: Optional[Dict[str, Any]]) -> Dict[str, int]:
+    metadata = metadata or {}
+    return {name: int(metadata.get(f"hnsw:{name}", default)) for name, default in HNSW_DEFAULTS.items()}
+
+
+# noinspection PyProtectedMember
+class ChromaStore(VectorStore):
+    """
+    VectorStore backed by a LangChain `Chroma` collection. The Chroma client and collection
+    internals are only touched inside this class.
+    """
+
+    def __init__(self, chroma: Chroma, embedding: Embeddings):
+        super().__init__(embedding)
+        self.chroma = chroma
+        self._lock = threading.RLock()
+
+    @property
+    def collection_name(self) -> str:
+        return self.chroma._collection.name
+
+    @property
+    def hnsw_params(self) -> Dict[str, int]:
+        """The HNSW parameters the collection was created with."""
+        return _hnsw_params(self.chroma._collection.metadata)
+
+    @property
+    def distance_metric(self) -> str:
+        return (self.chroma._collection.metadata or {}).get("hnsw:space", "l2")
+
+    def _upsert(self, ids: List[str], embeddings: List[Sequence[float]], texts: List[str],
+                metadatas: List[Dict[str, Any]]) -> None:
+        batch_size = getattr(self.chroma._client, "max_batch_size", 5000) or 5000
+        # chroma rejects empty metadata, chunks without metadata are written separately
+        for with_metadata in (True, False):
+            rows = [i for i, metadata in enumerate(metadatas) if bool(metadata) == with_metadata]
+            for start in range(0, len(rows), batch_size):
+                batch = rows[start:start + batch_size]
+                self.chroma._collection.upsert(
+                    ids=[ids[i] for i in batch],
+                    embeddings=[list(map(float, embeddings[i])) for i in batch],
+                    documents=[texts[i] for i in batch],
+                    metadatas=[metadatas[i] for i in batch] if with_metadata else None,
+                )
+
+    def add_embeddings(self, texts: Sequence[str], embeddings: Sequence[Sequence[float]],
+                       metadatas: Optional[Sequence[Dict[str, Any]]] = None,
+                       ids: Optional[Sequence[str]] = None) -> List[str]:
+        ids = list(ids) if ids is not None else self.new_ids(len(texts))
+        metadatas = list(metadatas) if metadatas is not None else [{}] * len(texts)
+        with self._lock:
+            self._upsert(ids, list(embeddings), list(texts), metadatas)
+        return ids
+
+    def delete(self, ids: Iterable[str]) -> None:
+        ids = list(ids)
+        if ids:
+            with self._lock:
+                self.chroma.delete(ids=ids)
+
+    def ids_where(self, filter: Dict[str, Any]) -> List[str]:
+        with self._lock:
+            return self.chroma._collection.get(where=filter, include=[])["ids"]
+
+    def get_chunks(self, ids: Sequence[str]) -> Tuple[List[str], List[Document], np.ndarray]:
+        if not ids:
+            return [], [], np.zeros((0, 0), dtype=np.float32)
+        with self._lock:
+            found = self.chroma._collection.get(ids=list(ids), include=["embeddings", "documents", "metadatas"])
+        docs = [Document(page_content=text, metadata=metadata or {})
+                for text, metadata in zip(found["documents"], found["metadatas"])]
+        return found["ids"], docs, np.asarray(found["embeddings"], dtype=np.float32)
+
+    def search_by_vector(self, vector: Sequence[float], k: int = 4,
+                         filter: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float]]:
+        # chroma returns distances, negated so that higher is closer
+        results = self.chroma.similarity_search_by_vector_with_relevance_scores(list(map(float, vector)), k=k,
+                                                                                filter=filter)
+        return [(doc, -distance) for doc, distance in results]
+
+    def max_marginal_relevance_search_by_vector(self, vector: Sequence[float], k: int = 4, fetch_k: int = 20,
+                                                lambda_mult: float = 0.5,
+                                                filter: Optional[Dict[str, Any]] = None) -> List[Document]:
+        return self.chroma.max_marginal_relevance_search_by_vector(list(map(float, vector)), k=k, fetch_k=fetch_k,
+                                                                   lambda_mult=lambda_mult, filter=filter)
+
+    def count(self) -> int:
+        return self.chroma._collection.count()
+
+    def iter_embeddings(self, batch_size: int = _COPY_BATCH_SIZE) -> Iterator[Tuple[List[str], np.ndarray]]:
+        for offset in range(0, self.count(), batch_size):
+            with self._lock:
+                batch = self.chroma._collection.get(include=["embeddings"], limit=batch_size, offset=offset)
+            yield batch["ids"], np.asarray(batch["embeddings"], dtype=np.float32)
+
+    def snapshot(self, path: Union[str, Path]) -> Path:
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        client = chromadb.PersistentClient(path=str(path), settings=Settings(allow_reset=True))
+        target = client.get_or_create_collection(self.collection_name, metadata=self.chroma._collection.metadata)
+        with self._lock:
+            for offset in range(0, self.count(), _COPY_BATCH_SIZE):
+                batch = self.chroma._collection.get(include=["embeddings", "documents", "metadatas"],
+                                                    limit=_COPY_BATCH_SIZE, offset=offset)
+                target.upsert(ids=batch["ids"], embeddings=batch["embeddings"], documents=batch["documents"],
+                              metadatas=[metadata or None for metadata in batch["metadatas"]])
+        return path
+
+    def drop(self) -> None:
+        logger.info(f"Deleting collection {self.collection_name}...")
+        with self._lock:
+            self.chroma.delete_collection()
+
 
 def create_userdb(username: str, user_data_dir: Union[Path, str], embedding_func: Embeddings,
-                  distance_metric='l2') -> Chroma:
+                  distance_metric='l2', hnsw_params: Optional[Dict[str, int]] = None) -> ChromaStore:
+    """
+    Open the collection of a user. `hnsw_params` (M, construction_ef, search_ef) are recorded in the
+    collection metadata when the collection is created; an existing collection keeps the ones it was built with.
+    """
     logger.info("Initializing ChromaDB...")
     if distance_metric not in DISTANCE_METRIC:
         raise ValueError(
             f"distance_metric should be one of {DISTANCE_METRIC}"
         )
+    hnsw_params = {name: value for name, value in (hnsw_params or {}).items() if value is not None}
+    unknown = set(hnsw_params) - set(HNSW_DEFAULTS)
+    if unknown:
+        raise ValueError(
+            f"Unknown HNSW parameters {sorted(unknown)}, expected some of {list(HNSW_DEFAULTS)}"
+        )
 
     if isinstance(user_data_dir, Path):
         user_data_dir = str(user_data_dir)
@@ -36,23 +173,28 @@ def create_userdb(username: str, user_data_dir: Union[Path, str], embedding_func
         persist_directory=os.path.join(user_data_dir, 'chroma'),
     )
 
-    return Chroma(
-        collection_name=f'{username}_collection',
+    # chroma replaces the metadata of an existing collection with the one it is opened with,
+    # the parameters the HNSW graph was built with are kept instead
+    client = chromadb.Client(settings)
+    collection_name = f'{username}_collection'
+    collection_metadata = {"hnsw:space": distance_metric,
+                           **{f"hnsw:{name}": int(value) for name, value in hnsw_params.items()}}
+    try:
+        existing = client.get_collection(collection_name).metadata
+    except ValueError:
+        existing = None
+    if existing is not None:
+        built = _hnsw_params(existing)
+        changed = {name: value for name, value in hnsw_params.items() if built[name] != value}
+        if changed:
+            logger.warning(f"{collection_name} was built with HNSW parameters {built}, {changed} only apply "
+                           f"to a new collection, re-index the documents to use them")
+        collection_metadata = existing
+
+    chroma = Chroma(
+        client=client,
+        collection_name=collection_name,
         embedding_function=embedding_func,
-        persist_directory=os.path.join(user_data_dir, 'chroma'),
-        collection_metadata={"hnsw:space": distance_metric},
-        client_settings=settings,
+        collection_metadata=collection_metadata,
     )
-
-
-# noinspection PyProtectedMember
-def collection_count(chroma_instance: Chroma):
-    """Return the number collection."""
-    return chroma_instance._client.count_collections()
-
-
-# noinspection PyProtectedMember
-def delete_user_collection(chroma_instance: Chroma, username: str):
-    """Delete a collection with the given username."""
-    logger.info(f"Deleting collection {username}_collection...")
-    chroma_instance._client.delete_collection(name=f'{username}_collection')
+    return ChromaStore(chroma, embedding_func)
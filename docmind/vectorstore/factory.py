@@ -0,0 +1,86 @@
+import logging
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Optional, Union
+
+from langchain_core.embeddings import Embeddings
+
+from docmind.vectorstore.base import VectorStore
+
+if TYPE_CHECKING:
+    from docmind.utils.config import ProjectConfiguration
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ["chroma", "numpy"]
+
+# Chroma's names of the HNSW parameters and the matching NumpyStore options
+_NUMPY_HNSW_OPTIONS = {"M": "hnsw_m", "construction_ef": "hnsw_ef_construction", "search_ef": "hnsw_ef_search"}
+
+
+def create_vectorstore(username: str, user_data_dir: Union[Path, str], embedding_func: Embeddings,
+                       backend: str = "chroma", distance_metric: str = "l2", index: str = "exact",
+                       quantization: Optional[str] = None, truncate_dim: Optional[int] = None,
+                       rescore_factor: int = 4, hnsw_params: Optional[Dict[str, int]] = None,
+                       sharding: Optional[str] = None, shard_size: int = 20000,
+                       search_threads: int = 4, document_routing: Optional[int] = None) -> VectorStore:
+    """
+    Open the vector store of a user with the configured backend. `index` and the quantization
+    settings only apply to the numpy backend. `hnsw_params` (M, construction_ef, search_ef) apply to
+    Chroma collections and to the numpy "hnsw" index.
+
+    With `sharding` ("document" or "size") the store is a ShardedStore in `user_data_dir/shards`,
+    every shard a store of `backend`.
+
+    With `document_routing` the store is wrapped in a RoutedStore searching the chunks of the
+    `document_routing` documents closest to the query, indexed in `user_data_dir/documents.db`.
+    """
+    if document_routing is not None:
+        from docmind.vectorstore.routing import (
+            DOCUMENT_INDEX_FILE,
+            DocumentIndex,
+            RoutedStore,
+        )
+
+        store = create_vectorstore(username, user_data_dir, embedding_func, backend, distance_metric, index,
+                                   quantization, truncate_dim, rescore_factor, hnsw_params, sharding, shard_size,
+                                   search_threads)
+        return RoutedStore(store, DocumentIndex(Path(user_data_dir) / DOCUMENT_INDEX_FILE), top_n=document_routing)
+    hnsw_params = {name: value for name, value in (hnsw_params or {}).items() if value is not None}
+    if sharding is not None:
+        from docmind.vectorstore.sharded import ShardedStore
+
+        def open_shard(name: str, directory: Path) -> VectorStore:
+            return create_vectorstore(name, directory, embedding_func, backend, distance_metric, index, quantization,
+                                      truncate_dim, rescore_factor, hnsw_params)
+
+        if any((Path(user_data_dir) / name).is_dir() for name in ("chroma", "vectors")):
+            logger.warning(f"{user_data_dir} has an unsharded store, its documents are not searched with "
+                           f"sharding enabled, upload them again to move them into shards")
+        return ShardedStore(Path(user_data_dir) / "shards", embedding_func, open_shard, strategy=sharding,
+                            shard_size=shard_size, max_workers=search_threads, distance_metric=distance_metric)
+    if backend == "chroma":
+        from docmind.vectorstore.chromadb import create_userdb
+
+        return create_userdb(username, user_data_dir, embedding_func, distance_metric=distance_metric,
+                             hnsw_params=hnsw_params)
+    if backend == "numpy":
+        from docmind.vectorstore.numpy_store import create_userdb
+
+        return create_userdb(username, user_data_dir, embedding_func, distance_metric=distance_metric, index=index,
+                             quantization=quantization, truncate_dim=truncate_dim, rescore_factor=rescore_factor,
+                             **{_NUMPY_HNSW_OPTIONS[name]: value for name, value in hnsw_params.items()})
+    raise ValueError(f"backend should be one of {BACKENDS}")
+
+
+def open_user_vectorstore(config: "ProjectConfiguration", username: str, user_data_dir: Union[Path, str],
+                          embedding_func: Embeddings) -> VectorStore:
+    """The store of a user with the settings of the project configuration."""
+    return create_vectorstore(username, user_data_dir, embedding_func, backend=config.vectorstore_backend,
+                              distance_metric=config.vectorstore_distance_metric, index=config.vectorstore_index,
+                              quantization=config.vectorstore_quantization,
+                              truncate_dim=config.vectorstore_truncate_dim,
+                              rescore_factor=config.vectorstore_rescore_factor,
+                              hnsw_params=config.hnsw_params(username), sharding=config.vectorstore_sharding,
+                              shard_size=config.vectorstore_shard_size,
+                              search_threads=config.vectorstore_search_threads,
+                              document_routing=config.document_routing_top_n)
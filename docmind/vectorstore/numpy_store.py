@@ -0,0 +1,544 @@
+import json
+import logging
+import shutil
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from docmind.vectorstore.base import VectorStore, match_filter
+from docmind.vectorstore.quantization import QUANTIZATION_TYPES, QuantizedCodes
+
+logger = logging.getLogger(__name__)
+
+DISTANCE_METRIC = ["l2", "ip", "cosine"]
+INDEX_TYPES = ["exact", "ivf", "hnsw"]
+
+VECTORS_FILE = "vectors.f32"
+DB_FILE = "store.db"
+IVF_FILE = "ivf.npz"
+HNSW_FILE = "hnsw.bin"
+HNSW_DEFAULTS = {"M": 16, "construction_ef": 100, "search_ef": 64}
+
+_INITIAL_CAPACITY = 1024
+# rows encoded at a time when the quantized codes are rebuilt
+_ENCODE_BATCH_SIZE = 4096
+
+
+def _kmeans(data: np.ndarray, clusters: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """Plain Lloyd's k-means on the rows of `data`, returns the centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = _nearest_centroid(data, centroids)
+        for cluster in range(clusters):
+            members = data[assignment == cluster]
+            if len(members):
+                centroids[cluster] = members.mean(axis=0)
+    return centroids
+
+
+def _nearest_centroid(data: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    distances = (centroids ** 2).sum(axis=1)[None, :] - 2 * data @ centroids.T
+    return distances.argmin(axis=1).astype(np.int32)
+
+
+class NumpyStore(VectorStore):
+    """
+    VectorStore keeping the vectors in a memory-mapped float32 matrix and the texts and
+    metadata in SQLite, both under `directory`.
+
+    `index` selects the search:
+        - "exact": vectorized brute force over the matrix, best below ~50k chunks.
+        - "ivf": k-means inverted lists, `nprobe` lists are searched exactly. Trained once the
+          store holds `ivf_min_size` chunks, exact search is used until then.
+        - "hnsw": hnswlib graph (installed with chromadb as chroma-hnswlib). Its parameters are
+          recorded in the store, the graph is rebuilt when it is opened with others.
+
+    Scores match Chroma's distances negated: -squared L2 for "l2", the dot product for "ip"
+    and the cosine similarity for "cosine".
+
+    With `quantization` ("int8" or "binary", optionally on the first `truncate_dim` dimensions)
+    the exact and IVF searches first rank the candidates on compact codes, then rescore the
+    best `k * rescore_factor` against the full precision vectors. Only those rows of the
+    float32 matrix are read, the codes are what stays hot in the page cache.
+
+    Example:
+        store = NumpyStore(Path("user_data/alice/vectors"), embeddings, index="exact")
+        store.add_documents(docs)
+        store.search("What is DocMind?", k=4, filter={"source": "A.pdf"})
+    """
+
+    def __init__(self, directory: Union[str, Path], embedding: Embeddings, metric: str = "l2",
+                 index: str = "exact", ivf_min_size: int = 20000, nprobe: int = 8,
+                 hnsw_m: Optional[int] = None, hnsw_ef_construction: Optional[int] = None,
+                 hnsw_ef_search: Optional[int] = None, quantization: Optional[str] = None,
+                 truncate_dim: Optional[int] = None, rescore_factor: int = 4):
+        super().__init__(embedding)
+        if metric not in DISTANCE_METRIC:
+            raise ValueError(f"metric should be one of {DISTANCE_METRIC}")
+        if index not in INDEX_TYPES:
+            raise ValueError(f"index should be one of {INDEX_TYPES}")
+        if quantization is not None and quantization not in QUANTIZATION_TYPES:
+            raise ValueError(f"quantization should be one of {QUANTIZATION_TYPES}")
+        if quantization is not None and index == "hnsw":
+            raise ValueError("quantization is only used by the exact and ivf indexes, not by hnsw")
+        self.quantization = quantization
+        self.truncate_dim = truncate_dim
+        self.rescore_factor = rescore_factor
+        self.directory = Path(directory)
+        self.index = index
+        self.ivf_min_size = ivf_min_size
+        self.nprobe = nprobe
+        self.hnsw_m = hnsw_m
+        self.hnsw_ef_construction = hnsw_ef_construction
+        self.hnsw_ef_search = hnsw_ef_search
+        self._lock = threading.RLock()
+        self._open(metric)
+
+    # --- storage -----------------------------------------------------------------------
+
+    def _open(self, metric: str) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.directory / DB_FILE), check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS chunks (row INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, "
+                               "text TEXT NOT NULL, metadata TEXT NOT NULL)")
+        meta = dict(self._conn.execute("SELECT key, value FROM meta").fetchall())
+        stored_metric = meta.get("metric")
+        if stored_metric is not None and stored_metric != metric:
+            logger.warning(f"{self.directory} was created with metric {stored_metric}, ignoring {metric}")
+        self.metric = stored_metric or metric
+        # the HNSW parameters are kept in the store, unless others are given
+        self.hnsw_m = self.hnsw_m or int(meta.get("hnsw_m", HNSW_DEFAULTS["M"]))
+        self.hnsw_ef_construction = self.hnsw_ef_construction or int(meta.get("hnsw_ef_construction",
+                                                                               HNSW_DEFAULTS["construction_ef"]))
+        self.hnsw_ef_search = self.hnsw_ef_search or int(meta.get("hnsw_ef_search", HNSW_DEFAULTS["search_ef"]))
+        with self._conn:
+            self._set_meta(hnsw_m=self.hnsw_m, hnsw_ef_construction=self.hnsw_ef_construction,
+                           hnsw_ef_search=self.hnsw_ef_search)
+        self.dim: Optional[int] = int(meta["dim"]) if "dim" in meta else None
+        self.capacity = int(meta.get("capacity", 0))
+        self._generation = int(meta.get("generation", 0))
+
+        self._ids: List[Optional[str]] = []
+        self._metadata: List[Optional[Dict[str, Any]]] = []
+        self._row_of: Dict[str, int] = {}
+        for row, chunk_id, metadata in self._conn.execute("SELECT row, id, metadata FROM chunks ORDER BY row"):
+            while len(self._ids) < row:
+                self._ids.append(None)
+                self._metadata.append(None)
+            self._ids.append(chunk_id)
+            self._metadata.append(json.loads(metadata))
+            self._row_of[chunk_id] = row
+
+        self._vectors: Optional[np.memmap] = None
+        self._norms: Optional[np.ndarray] = None
+        self._live: Optional[np.ndarray] = None
+        # masks of the filters used since the last change
+        self._filter_masks: Dict[str, np.ndarray] = {}
+        if self.dim is not None and (self.directory / VECTORS_FILE).is_file():
+            self._vectors = np.memmap(self.directory / VECTORS_FILE, dtype=np.float32, mode="r+",
+                                      shape=(self.capacity, self.dim))
+        self._codes: Optional[QuantizedCodes] = None
+        if self._vectors is not None:
+            self._open_codes(meta.get("codes"))
+        self._ivf_centroids: Optional[np.ndarray] = None
+        self._ivf_assignment: Optional[np.ndarray] = None
+        self._ivf_trained_size = 0
+        self._hnsw = None
+        self._load_index()
+
+    @property
+    def distance_metric(self) -> str:
+        return self.metric
+
+    @property
+    def hnsw_params(self) -> Dict[str, int]:
+        """The HNSW parameters, named as in the Chroma collection metadata."""
+        return {"M": self.hnsw_m, "construction_ef": self.hnsw_ef_construction, "search_ef": self.hnsw_ef_search}
+
+    @property
+    def rows(self) -> int:
+        """Number of rows in use, deleted rows included."""
+        return len(self._ids)
+
+    def _live_mask(self) -> np.ndarray:
+        if self._live is None or len(self._live) != self.rows:
+            self._live = np.fromiter((chunk_id is not None for chunk_id in self._ids), dtype=bool, count=self.rows)
+        return self._live
+
+    def _open_codes(self, stored_key: Optional[str] = None) -> None:
+        """Open the quantized codes, rebuilding them from the full vectors when their layout changed."""
+        if self.quantization is None:
+            return
+        self._codes = QuantizedCodes(self.directory, self.quantization, self.dim, self.truncate_dim, self.capacity)
+        if stored_key == self._codes.key or self.rows == 0:
+            return
+        logger.info(f"Encoding {self.rows} vectors of {self.directory} as {self._codes.key}")
+        for start in range(0, self.rows, _ENCODE_BATCH_SIZE):
+            stop = min(start + _ENCODE_BATCH_SIZE, self.rows)
+            self._codes.write(slice(start, stop), self._vectors[start:stop])
+        self._codes.flush()
+        with self._conn:
+            self._set_meta(codes=self._codes.key)
+
+    def _set_meta(self, **values: Any) -> None:
+        self._conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                               [(key, str(value)) for key, value in values.items()])
+
+    def _ensure_capacity(self, rows: int, dim: int) -> None:
+        if self.dim is None:
+            self.dim = dim
+        elif dim != self.dim:
+            raise ValueError(f"Expected vectors of dimension {self.dim}, got {dim}")
+        if rows <= self.capacity and self._vectors is not None:
+            return
+        capacity = max(_INITIAL_CAPACITY, self.capacity)
+        while capacity < rows:
+            capacity *= 2
+        if self._vectors is not None:
+            self._vectors.flush()
+            del self._vectors
+        with open(self.directory / VECTORS_FILE, "ab") as file:
+            file.truncate(capacity * self.dim * 4)
+        self.capacity = capacity
+        self._vectors = np.memmap(self.directory / VECTORS_FILE, dtype=np.float32, mode="r+",
+                                  shape=(self.capacity, self.dim))
+        if self._hnsw is not None:
+            self._hnsw.resize_index(self.capacity)
+        if self._codes is not None:
+            self._codes.resize(self.capacity)
+        elif self.quantization is not None:
+            self._open_codes()
+
+    def _prepare(self, vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.metric == "cosine":
+            norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+            vectors = vectors / np.where(norms == 0, 1, norms)
+        return vectors
+
+    def add_embeddings(self, texts: Sequence[str], embeddings: Sequence[Sequence[float]],
+                       metadatas: Optional[Sequence[Dict[str, Any]]] = None,
+                       ids: Optional[Sequence[str]] = None) -> List[str]:
+        if not texts:
+            return []
+        ids = list(ids) if ids is not None else self.new_ids(len(texts))
+        metadatas = [dict(metadata or {}) for metadata in metadatas] if metadatas is not None else [{}] * len(texts)
+        vectors = self._prepare(np.asarray(embeddings))
+        with self._lock:
+            rows = []
+            next_row = self.rows
+            for chunk_id in ids:
+                if chunk_id in self._row_of:
+                    rows.append(self._row_of[chunk_id])
+                else:
+                    rows.append(next_row)
+                    next_row += 1
+            self._ensure_capacity(next_row, vectors.shape[1])
+            self._vectors[rows] = vectors
+            self._vectors.flush()
+            if self._codes is not None:
+                self._codes.write(rows, vectors)
+                self._codes.flush()
+            self._norms = None
+            self._live = None
+            self._filter_masks.clear()
+
+            while len(self._ids) < next_row:
+                self._ids.append(None)
+                self._metadata.append(None)
+            for row, chunk_id, metadata in zip(rows, ids, metadatas):
+                self._ids[row] = chunk_id
+                self._metadata[row] = metadata
+                self._row_of[chunk_id] = row
+
+            self._generation += 1
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO chunks (row, id, text, metadata) VALUES (?, ?, ?, ?)",
+                    [(row, chunk_id, text, json.dumps(metadata))
+                     for row, chunk_id, text, metadata in zip(rows, ids, texts, metadatas)])
+                self._set_meta(dim=self.dim, metric=self.metric, capacity=self.capacity, generation=self._generation)
+                if self._codes is not None:
+                    self._set_meta(codes=self._codes.key)
+            self._index_rows(np.asarray(rows), vectors)
+        return ids
+
+    def delete(self, ids: Iterable[str]) -> None:
+        with self._lock:
+            rows = [self._row_of.pop(chunk_id) for chunk_id in ids if chunk_id in self._row_of]
+            if not rows:
+                return
+            for row in rows:
+                self._ids[row] = None
+                self._metadata[row] = None
+            self._live = None
+            self._filter_masks.clear()
+            self._generation += 1
+            with self._conn:
+                self._conn.executemany("DELETE FROM chunks WHERE row = ?", [(row,) for row in rows])
+                self._set_meta(generation=self._generation)
+            if self._hnsw is not None:
+                for row in rows:
+                    self._hnsw.mark_deleted(row)
+
+    def ids_where(self, filter: Dict[str, Any]) -> List[str]:
+        with self._lock:
+            if not self._row_of:
+                return []
+            return [self._ids[row] for row in np.flatnonzero(self._candidates(filter))]
+
+    def get_chunks(self, ids: Sequence[str]) -> Tuple[List[str], List[Document], np.ndarray]:
+        with self._lock:
+            rows = [self._row_of[chunk_id] for chunk_id in ids if chunk_id in self._row_of]
+            if not rows:
+                return [], [], np.zeros((0, self.dim or 0), dtype=np.float32)
+            return [self._ids[row] for row in rows], self._documents(rows), np.asarray(self._vectors[rows])
+
+    def count(self) -> int:
+        return len(self._row_of)
+
+    def memory_usage(self) -> Dict[str, int]:
+        """Bytes of the full precision vectors and of the codes a quantized search scans."""
+        vectors = self.rows * (self.dim or 0) * 4
+        return {"vectors": vectors, "search": self._codes.nbytes(self.rows) if self._codes is not None else vectors}
+
+    # --- index -------------------------------------------------------------------------
+
+    def _load_index(self) -> None:
+        """Load the persisted index if it matches the stored rows, rebuild it otherwise."""
+        if self.index == "ivf" and (self.directory / IVF_FILE).is_file():
+            data = np.load(self.directory / IVF_FILE)
+            if int(data["generation"]) == self._generation:
+                self._ivf_centroids = data["centroids"]
+                self._ivf_assignment = data["assignment"]
+                self._ivf_trained_size = int(data["trained_size"])
+        elif self.index == "hnsw" and self._vectors is not None:
+            import hnswlib
+
+            self._hnsw = hnswlib.Index(space=self.metric, dim=self.dim)
+            generation_file = self.directory / f"{HNSW_FILE}.generation"
+            if (self.directory / HNSW_FILE).is_file() and generation_file.is_file() \
+                    and int(generation_file.read_text()) == self._generation:
+                self._hnsw.load_index(str(self.directory / HNSW_FILE), max_elements=self.capacity)
+            if (self._hnsw.M, self._hnsw.ef_construction) != (self.hnsw_m, self.hnsw_ef_construction):
+                # missing, stale or built with other parameters
+                self._build_hnsw()
+        self._maybe_train_ivf()
+
+    def _build_hnsw(self) -> None:
+        import hnswlib
+
+        self._hnsw = hnswlib.Index(space=self.metric, dim=self.dim)
+        self._hnsw.init_index(max_elements=max(self.capacity, 1), ef_construction=self.hnsw_ef_construction,
+                              M=self.hnsw_m)
+        live = np.flatnonzero(self._live_mask())
+        if len(live):
+            self._hnsw.add_items(np.asarray(self._vectors[live]), live)
+
+    def _maybe_train_ivf(self) -> None:
+        if self.index != "ivf" or self._vectors is None:
+            return
+        live = np.flatnonzero(self._live_mask())
+        grown = self._ivf_centroids is None or len(live) >= 2 * self._ivf_trained_size
+        if len(live) < self.ivf_min_size or not grown:
+            return
+        clusters = max(1, int(np.sqrt(len(live))))
+        rng = np.random.default_rng(0)
+        sample = rng.choice(live, min(len(live), clusters * 64), replace=False)
+        logger.info(f"Training IVF index of {self.directory} with {clusters} lists on {len(sample)} vectors")
+        self._ivf_centroids = _kmeans(np.asarray(self._vectors[np.sort(sample)]), clusters)
+        self._ivf_assignment = np.full(self.rows, -1, dtype=np.int32)
+        self._ivf_assignment[live] = _nearest_centroid(np.asarray(self._vectors[live]), self._ivf_centroids)
+        self._ivf_trained_size = len(live)
+
+    def _index_rows(self, rows: np.ndarray, vectors: np.ndarray) -> None:
+        if self.index == "hnsw":
+            if self._hnsw is None:
+                self._build_hnsw()
+            else:
+                self._hnsw.add_items(vectors, rows)
+        elif self.index == "ivf":
+            if self._ivf_centroids is not None:
+                assignment = np.full(self.rows, -1, dtype=np.int32)
+                assignment[:len(self._ivf_assignment)] = self._ivf_assignment
+                assignment[rows] = _nearest_centroid(vectors, self._ivf_centroids)
+                self._ivf_assignment = assignment
+            self._maybe_train_ivf()
+
+    def flush(self) -> None:
+        """Persist the search index, the vectors and metadata are written on every change."""
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors.flush()
+            self._save_index(self.directory)
+
+    def _save_index(self, directory: Path) -> None:
+        if self._ivf_centroids is not None:
+            np.savez(directory / IVF_FILE, centroids=self._ivf_centroids, assignment=self._ivf_assignment,
+                     trained_size=self._ivf_trained_size, generation=self._generation)
+        if self._hnsw is not None:
+            self._hnsw.save_index(str(directory / HNSW_FILE))
+            (directory / f"{HNSW_FILE}.generation").write_text(str(self._generation))
+
+    # --- search ------------------------------------------------------------------------
+
+    def _scores(self, rows: Union[np.ndarray, slice], query: np.ndarray) -> np.ndarray:
+        if isinstance(rows, np.ndarray):
+            # a subset of the rows is copied anyway, distances are computed on the copy
+            vectors = self._vectors[rows]
+            if self.metric != "l2":
+                return vectors @ query
+            difference = vectors - query
+            return -np.einsum("ij,ij->i", difference, difference)
+        # a slice keeps the memory map contiguous, the squared norms are computed once
+        dots = self._vectors[rows] @ query
+        if self.metric != "l2":
+            return dots
+        if self._norms is None or len(self._norms) < self.rows:
+            self._norms = np.einsum("ij,ij->i", self._vectors[:self.rows], self._vectors[:self.rows])
+        return -np.maximum(self._norms[rows] - 2 * dots + query @ query, 0)
+
+    def _candidates(self, filter: Optional[Dict[str, Any]]) -> np.ndarray:
+        if not filter:
+            return self._live_mask()
+        key = json.dumps(filter, sort_keys=True)
+        if key not in self._filter_masks:
+            self._filter_masks[key] = np.fromiter(
+                (metadata is not None and match_filter(metadata, filter) for metadata in self._metadata),
+                dtype=bool, count=self.rows)
+        return self._filter_masks[key]
+
+    def _search_rows(self, query: np.ndarray, k: int,
+                     filter: Optional[Dict[str, Any]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        if self._vectors is None or not self._row_of or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        mask = self._candidates(filter)
+
+        rows = None
+        if self.index == "hnsw" and self._hnsw is not None:
+            self._hnsw.set_ef(max(self.hnsw_ef_search, k))
+            allowed = int(mask.sum())
+            if allowed == 0:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+            try:
+                labels, _ = self._hnsw.knn_query(query, k=min(k, allowed),
+                                                 filter=(lambda label: bool(mask[label])) if filter else None)
+                rows = labels[0].astype(np.int64)
+            except RuntimeError:
+                # the graph could not return k neighbours for a selective filter, search exactly
+                rows = None
+        if rows is None:
+            if self.index == "ivf" and self._ivf_centroids is not None:
+                probes = np.argsort(((self._ivf_centroids - query) ** 2).sum(axis=1))[:self.nprobe]
+                mask = mask & np.isin(self._ivf_assignment[:self.rows], probes)
+            rows = np.flatnonzero(mask)
+
+        if len(rows) == 0:
+            return rows, np.empty(0, dtype=np.float32)
+        shortlist = k * self.rescore_factor
+        if self._codes is not None and len(rows) > shortlist:
+            approximate = self._codes.scores(slice(0, self.rows) if len(rows) == self.rows else rows, query,
+                                             self.metric)
+            rows = np.sort(rows[np.argpartition(-approximate, shortlist - 1)[:shortlist]])
+        scores = self._scores(slice(0, self.rows) if len(rows) == self.rows else rows, query)
+        if len(rows) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            rows, scores = rows[top], scores[top]
+        order = np.argsort(-scores, kind="stable")
+        return rows[order], scores[order]
+
+    def _documents(self, rows: Sequence[int]) -> List[Document]:
+        rows = [int(row) for row in rows]
+        if not rows:
+            return []
+        placeholders = ",".join("?" * len(rows))
+        texts = dict(self._conn.execute(f"SELECT row, text FROM chunks WHERE row IN ({placeholders})", rows))
+        return [Document(page_content=texts[row], metadata=dict(self._metadata[row])) for row in rows]
+
+    def search_by_vector(self, vector: Sequence[float], k: int = 4,
+                         filter: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float]]:
+        with self._lock:
+            rows, scores = self._search_rows(self._prepare(np.asarray(vector)), k, filter)
+            return list(zip(self._documents(rows), scores.tolist()))
+
+    def max_marginal_relevance_search_by_vector(self, vector: Sequence[float], k: int = 4, fetch_k: int = 20,
+                                                lambda_mult: float = 0.5,
+                                                filter: Optional[Dict[str, Any]] = None) -> List[Document]:
+        from langchain_community.vectorstores.utils import maximal_marginal_relevance
+
+        vector = self._prepare(np.asarray(vector))
+        with self._lock:
+            rows, _ = self._search_rows(vector, fetch_k, filter)
+            if len(rows) == 0:
+                return []
+            selected = maximal_marginal_relevance(vector, np.asarray(self._vectors[rows]), lambda_mult=lambda_mult, k=k)
+            return self._documents(rows[selected])
+
+    def iter_embeddings(self, batch_size: int = 1000) -> Iterator[Tuple[List[str], np.ndarray]]:
+        with self._lock:
+            live = np.flatnonzero(self._live_mask())
+        for start in range(0, len(live), batch_size):
+            with self._lock:
+                # rows deleted since the listing are skipped
+                rows = [row for row in live[start:start + batch_size] if self._ids[row] is not None]
+                ids, vectors = [self._ids[row] for row in rows], np.asarray(self._vectors[rows])
+            yield ids, vectors
+
+    # --- lifecycle ---------------------------------------------------------------------
+
+    def snapshot(self, path: Union[str, Path]) -> Path:
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors.flush()
+                shutil.copyfile(self.directory / VECTORS_FILE, path / VECTORS_FILE)
+            if self._codes is not None:
+                self._codes.flush()
+                for codes_path in (self._codes.codes_path, self._codes.stats_path):
+                    if codes_path.is_file():
+                        shutil.copyfile(codes_path, path / codes_path.name)
+            target = sqlite3.connect(str(path / DB_FILE))
+            try:
+                self._conn.backup(target)
+            finally:
+                target.close()
+            self._save_index(path)
+        return path
+
+    def drop(self) -> None:
+        logger.info(f"Deleting vector store {self.directory}...")
+        with self._lock:
+            self.close()
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self._open(self.metric)
+
+    def close(self) -> None:
+        with self._lock:
+            self._save_index(self.directory)
+            if self._vectors is not None:
+                self._vectors.flush()
+                self._vectors = None
+            if self._codes is not None:
+                self._codes.close()
+                self._codes = None
+            self._hnsw = None
+            self._conn.close()
+
+
+def create_userdb(username: str, user_data_dir: Union[Path, str], embedding_func: Embeddings,
+                  distance_metric: str = "l2", index: str = "exact", **options: Any) -> NumpyStore:
+    """Open the store of a user, `options` are passed to NumpyStore (quantization, truncate_dim, ...)."""
+    if not Path(user_data_dir).is_dir():
+        raise ValueError(f"{user_data_dir} is not a valid directory")
+    return NumpyStore(Path(user_data_dir) / "vectors" / f"{username}_collection", embedding_func,
+                      metric=distance_metric, index=index, **options)
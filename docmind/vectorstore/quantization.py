@@ -0,0 +1,110 @@
+import logging
+from pathlib import Path
+from typing import Optional, Tuple, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+QUANTIZATION_TYPES = ["int8", "binary"]
+
+# number of set bits of every byte value, numpy < 2 has no bitwise_count
+_POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+Rows = Union[np.ndarray, slice]
+
+
+class QuantizedCodes:
+    """
+    Compact codes of the vectors of a NumpyStore, kept in memory maps next to the full vectors.
+
+    - "int8": every (truncated) vector scaled by its largest absolute value to [-127, 127],
+      4x smaller than float32. Scores approximate the dot product and the squared L2 distance.
+    - "binary": the sign bit of every (truncated) dimension, 32x smaller than float32.
+      Scores are the negated Hamming distance.
+
+    `truncate_dim` keeps only the leading dimensions, which preserves most of the ranking for
+    embeddings trained with Matryoshka representation learning (Cohere embed v3 included).
+    The codes are only used to shortlist candidates, NumpyStore rescores them exactly.
+    """
+
+    def __init__(self, directory: Path, kind: str, dim: int, truncate_dim: Optional[int] = None, capacity: int = 0):
+        if kind not in QUANTIZATION_TYPES:
+            raise ValueError(f"quantization should be one of {QUANTIZATION_TYPES}")
+        self.directory = Path(directory)
+        self.kind = kind
+        self.dim = min(truncate_dim or dim, dim)
+        self.width = self.dim if kind == "int8" else (self.dim + 7) // 8
+        self.capacity = 0
+        self._codes: Optional[np.memmap] = None
+        # per row scale and squared norm of the truncated vector, int8 only
+        self._stats: Optional[np.memmap] = None
+        self.resize(capacity)
+
+    @property
+    def key(self) -> str:
+        """Identifies the code layout, codes are rebuilt when it changes."""
+        return f"{self.kind}:{self.dim}"
+
+    @property
+    def codes_path(self) -> Path:
+        return self.directory / f"codes.{self.kind}{self.dim}"
+
+    @property
+    def stats_path(self) -> Path:
+        return self.directory / f"codes.{self.kind}{self.dim}.stats"
+
+    def _map(self, path: Path, dtype, columns: int, capacity: int) -> np.memmap:
+        with open(path, "ab") as file:
+            file.truncate(capacity * columns * np.dtype(dtype).itemsize)
+        return np.memmap(path, dtype=dtype, mode="r+", shape=(capacity, columns))
+
+    def resize(self, capacity: int) -> None:
+        if capacity <= self.capacity:
+            return
+        self.flush()
+        self._codes = self._map(self.codes_path, np.int8 if self.kind == "int8" else np.uint8, self.width, capacity)
+        if self.kind == "int8":
+            self._stats = self._map(self.stats_path, np.float32, 2, capacity)
+        self.capacity = capacity
+
+    def encode(self, vectors: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))[:, :self.dim]
+        if self.kind == "binary":
+            return np.packbits(vectors > 0, axis=1), None
+        scale = np.abs(vectors).max(axis=1) / 127
+        scale = np.where(scale == 0, 1, scale).astype(np.float32)
+        codes = np.clip(np.rint(vectors / scale[:, None]), -127, 127).astype(np.int8)
+        return codes, np.stack([scale, (vectors * vectors).sum(axis=1)], axis=1).astype(np.float32)
+
+    def write(self, rows: Rows, vectors: np.ndarray) -> None:
+        codes, stats = self.encode(vectors)
+        self._codes[rows] = codes
+        if stats is not None:
+            self._stats[rows] = stats
+
+    def scores(self, rows: Rows, query: np.ndarray, metric: str) -> np.ndarray:
+        """Approximate similarity of the query to `rows`, higher is closer."""
+        query_codes, query_stats = self.encode(query)
+        if self.kind == "binary":
+            return -_POPCOUNT[np.bitwise_xor(self._codes[rows], query_codes[0])].sum(axis=1, dtype=np.int32)
+        stats = self._stats[rows]
+        # einsum converts the int8 codes on the fly, without a float copy of the whole matrix
+        dots = np.einsum("ij,j->i", self._codes[rows], query_codes[0].astype(np.float32)) * stats[:, 0] \
+            * query_stats[0, 0]
+        if metric != "l2":
+            return dots
+        return 2 * dots - stats[:, 1]
+
+    def nbytes(self, rows: int) -> int:
+        """Bytes of the codes of `rows` vectors, what a first pass search reads."""
+        return rows * (self.width + (8 if self.kind == "int8" else 0))
+
+    def flush(self) -> None:
+        for mapped in (self._codes, self._stats):
+            if mapped is not None:
+                mapped.flush()
+
+    def close(self) -> None:
+        self.flush()
+        self._codes = self._stats = None
@@ -0,0 +1,238 @@
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from langchain_core.documents import Document
+
+from docmind.vectorstore.base import VectorStore, filter_sources
+
+logger = logging.getLogger(__name__)
+
+DOCUMENT_INDEX_FILE = "documents.db"
+DEFAULT_TOP_DOCUMENTS = 8
+DEFAULT_SUMMARY_LENGTH = 500
+
+
+class DocumentIndex:
+    """
+    One row per document (`metadata["source"]`) of a collection: a short summary and the centroid
+    of its chunk embeddings, kept in SQLite next to the collection.
+
+    The summary is the lead of the document, its first chunks up to `summary_length` characters.
+    The centroid is kept as the running sum of the normalized chunk embeddings, so batches of a
+    document update it as they are inserted. Deleting chunks removes their document once none is
+    left, the centroid of a partly deleted document is not recomputed.
+
+    Routing compares the query with every centroid: the cost grows with the number of documents,
+    not with the number of chunks.
+    """
+
+    def __init__(self, db_path: Union[str, Path], summary_length: int = DEFAULT_SUMMARY_LENGTH):
+        self.db_path = Path(db_path)
+        self.summary_length = summary_length
+        self._lock = threading.Lock()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS documents (source TEXT PRIMARY KEY, summary TEXT NOT NULL, "
+                               "centroid BLOB NOT NULL, chunks INTEGER NOT NULL)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS chunks (id TEXT PRIMARY KEY, source TEXT NOT NULL)")
+        # normalized centroids, loaded on the first route after a write
+        self._sources: List[str] = []
+        self._centroids: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def chunk_count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def _summarize(self, summary: str, text: str) -> str:
+        if len(summary) >= self.summary_length:
+            return summary
+        summary = f"{summary}\n{text}".strip()
+        if len(summary) > self.summary_length:
+            cut = summary.rfind(" ", 0, self.summary_length)
+            summary = summary[:cut if cut > 0 else self.summary_length]
+        return summary
+
+    def add(self, ids: Sequence[str], texts: Sequence[str], embeddings: Sequence[Sequence[float]],
+            metadatas: Sequence[Dict[str, Any]]) -> None:
+        """Fold inserted chunks into the rows of their documents."""
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if not len(vectors):
+            return
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        rows: Dict[str, List[int]] = {}
+        for i, metadata in enumerate(metadatas):
+            rows.setdefault(str((metadata or {}).get("source", "")), []).append(i)
+        with self._lock, self._conn:
+            # an overwritten chunk is already part of its document
+            known = {chunk_id for chunk_id, in self._conn.execute(
+                f"SELECT id FROM chunks WHERE id IN ({', '.join('?' * len(ids))})", list(ids))}
+            for source, positions in rows.items():
+                positions = [i for i in positions if ids[i] not in known]
+                if not positions:
+                    continue
+                row = self._conn.execute("SELECT summary, centroid, chunks FROM documents WHERE source = ?",
+                                         (source,)).fetchone()
+                summary, centroid, chunks = ("", np.zeros(vectors.shape[1], dtype=np.float32), 0) if row is None \
+                    else (row[0], np.frombuffer(row[1], dtype=np.float32), row[2])
+                for i in positions:
+                    summary = self._summarize(summary, texts[i])
+                self._conn.execute("INSERT OR REPLACE INTO documents (source, summary, centroid, chunks) "
+                                   "VALUES (?, ?, ?, ?)",
+                                   (source, summary, (centroid + vectors[positions].sum(axis=0)).tobytes(),
+                                    chunks + len(positions)))
+                self._conn.executemany("INSERT OR REPLACE INTO chunks (id, source) VALUES (?, ?)",
+                                       [(ids[i], source) for i in positions])
+            self._centroids = None
+
+    def remove(self, ids: Iterable[str]) -> None:
+        ids = list(ids)
+        with self._lock, self._conn:
+            for chunk_id in ids:
+                row = self._conn.execute("SELECT source FROM chunks WHERE id = ?", (chunk_id,)).fetchone()
+                if row is None:
+                    continue
+                self._conn.execute("DELETE FROM chunks WHERE id = ?", (chunk_id,))
+                self._conn.execute("UPDATE documents SET chunks = chunks - 1 WHERE source = ?", row)
+            self._conn.execute("DELETE FROM documents WHERE chunks <= 0")
+            self._centroids = None
+
+    def summaries(self) -> Dict[str, str]:
+        return dict(self._conn.execute("SELECT source, summary FROM documents ORDER BY source"))
+
+    def _load(self) -> None:
+        rows = self._conn.execute("SELECT source, centroid FROM documents ORDER BY source").fetchall()
+        self._sources = [source for source, _ in rows]
+        centroids = np.stack([np.frombuffer(centroid, dtype=np.float32) for _, centroid in rows]) if rows \
+            else np.zeros((0, 0), dtype=np.float32)
+        self._centroids = centroids / np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+
+    def route(self, vector: Sequence[float], top_n: int = DEFAULT_TOP_DOCUMENTS) -> List[Tuple[str, float]]:
+        """The `top_n` documents whose centroid is closest to the query (cosine), best first."""
+        with self._lock:
+            if self._centroids is None:
+                self._load()
+            sources, centroids = self._sources, self._centroids
+        if not sources:
+            return []
+        query = np.asarray(vector, dtype=np.float32)
+        scores = centroids @ (query / max(float(np.linalg.norm(query)), 1e-12))
+        top = np.argsort(-scores)[:top_n]
+        return [(sources[i], float(scores[i])) for i in top]
+
+    def backup(self, path: Union[str, Path]) -> None:
+        target = sqlite3.connect(str(path))
+        try:
+            with self._lock:
+                self._conn.backup(target)
+        finally:
+            target.close()
+
+    def clear(self) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM documents")
+            self._conn.execute("DELETE FROM chunks")
+            self._centroids = None
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class RoutedStore(VectorStore):
+    """
+    Two-level search: the `top_n` documents closest to the query in the DocumentIndex are picked
+    first, then chunks are only searched within them, an automatic "Select documents" filter.
+
+    Inserts through the store keep the index up to date. Searches whose filter already names the
+    documents, collections of at most `top_n` documents and collections with chunks the index does
+    not know (inserted before routing was enabled) are searched as before.
+
+    Example:
+        store = RoutedStore(userdb, DocumentIndex(Path("user_data/alice/documents.db")), top_n=8)
+    """
+
+    def __init__(self, store: VectorStore, index: DocumentIndex, top_n: Optional[int] = DEFAULT_TOP_DOCUMENTS):
+        super().__init__(store.embedding)
+        self.store = store
+        self.index = index
+        self.top_n = top_n
+        self._complete: Optional[bool] = None
+
+    def _routed_filter(self, vector: Sequence[float],
+                       filter: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        if not self.top_n or filter_sources(filter) is not None or len(self.index) <= self.top_n:
+            return filter
+        if self._complete is None:
+            self._complete = self.index.chunk_count() >= self.store.count()
+            if not self._complete:
+                logger.warning(f"The document index {self.index.db_path} misses chunks of the collection, "
+                               f"searching every document, upload them again to route the searches")
+        if not self._complete:
+            return filter
+        routed = {"source": {"$in": [source for source, _ in self.index.route(vector, self.top_n)]}}
+        logger.debug(f"Routed the search to {routed['source']['$in']}")
+        return routed if not filter else {"$and": [filter, routed]}
+
+    def add_embeddings(self, texts: Sequence[str], embeddings: Sequence[Sequence[float]],
+                       metadatas: Optional[Sequence[Dict[str, Any]]] = None,
+                       ids: Optional[Sequence[str]] = None) -> List[str]:
+        metadatas = list(metadatas) if metadatas is not None else [{}] * len(texts)
+        ids = self.store.add_embeddings(texts, embeddings, metadatas, ids)
+        self.index.add(ids, texts, embeddings, metadatas)
+        return ids
+
+    def delete(self, ids: Iterable[str]) -> None:
+        ids = list(ids)
+        self.store.delete(ids)
+        self.index.remove(ids)
+
+    def ids_where(self, filter: Dict[str, Any]) -> List[str]:
+        return self.store.ids_where(filter)
+
+    def get_chunks(self, ids: Sequence[str]) -> Tuple[List[str], List[Document], np.ndarray]:
+        return self.store.get_chunks(ids)
+
+    def search_by_vector(self, vector: Sequence[float], k: int = 4,
+                         filter: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float]]:
+        return self.store.search_by_vector(vector, k, self._routed_filter(vector, filter))
+
+    def max_marginal_relevance_search_by_vector(self, vector: Sequence[float], k: int = 4, fetch_k: int = 20,
+                                                lambda_mult: float = 0.5,
+                                                filter: Optional[Dict[str, Any]] = None) -> List[Document]:
+        return self.store.max_marginal_relevance_search_by_vector(vector, k, fetch_k, lambda_mult,
+                                                                  self._routed_filter(vector, filter))
+
+    def iter_embeddings(self, batch_size: int = 1000) -> Iterator[Tuple[List[str], np.ndarray]]:
+        return self.store.iter_embeddings(batch_size)
+
+    @property
+    def distance_metric(self) -> Optional[str]:
+        return self.store.distance_metric
+
+    def count(self) -> int:
+        return self.store.count()
+
+    def snapshot(self, path: Union[str, Path]) -> Path:
+        path = self.store.snapshot(path)
+        self.index.backup(Path(path) / DOCUMENT_INDEX_FILE)
+        return path
+
+    def flush(self) -> None:
+        if hasattr(self.store, "flush"):
+            self.store.flush()
+
+    def drop(self) -> None:
+        self.store.drop()
+        self.index.clear()
+        self._complete = True
+
+    def close(self) -> None:
+        self.store.close()
+        self.index.close()
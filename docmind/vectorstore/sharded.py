@@ -0,0 +1,247 @@
+import logging
+import shutil
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from docmind.vectorstore.base import (
+    VectorStore,
+    filter_sources,
+    merge_by_score,
+    proportional_quotas,
+)
+
+logger = logging.getLogger(__name__)
+
+SHARDING_STRATEGIES = ["document", "size"]
+MANIFEST_FILE = "shards.db"
+# chunks without a source are kept together
+_NO_SOURCE = ""
+
+ShardFactory = Callable[[str, Path], VectorStore]
+
+
+class ShardedStore(VectorStore):
+    """
+    A user's knowledge base split over several stores (shards), each holding whole documents.
+
+    - "document": every document (`metadata["source"]`) gets its own shard.
+    - "size": documents fill a shard until it holds `shard_size` chunks, then a new one is opened.
+      A document is never split, a large one may overfill its shard.
+
+    The manifest (SQLite, next to the shards) maps every source to its shard. Searches only visit
+    the shards of the sources a `{"source": ...}` filter allows, fan out to them on a thread pool
+    and merge the top `k` by score, so a filtered search costs the size of the selected documents,
+    not of the whole collection.
+
+    Example:
+        store = ShardedStore(Path("user_data/alice/shards"), embeddings,
+                             lambda name, directory: NumpyStore(directory, embeddings), strategy="size")
+    """
+
+    def __init__(self, directory: Union[str, Path], embedding: Embeddings, shard_factory: ShardFactory,
+                 strategy: str = "size", shard_size: int = 20000, max_workers: int = 4,
+                 distance_metric: Optional[str] = None):
+        super().__init__(embedding)
+        if strategy not in SHARDING_STRATEGIES:
+            raise ValueError(f"strategy should be one of {SHARDING_STRATEGIES}")
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.shard_factory = shard_factory
+        self.strategy = strategy
+        self.shard_size = shard_size
+        self._distance_metric = distance_metric
+        self._lock = threading.RLock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="docmind-shard")
+        self._conn = sqlite3.connect(str(self.directory / MANIFEST_FILE), check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS shards (name TEXT PRIMARY KEY)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS sources (source TEXT PRIMARY KEY, shard TEXT NOT NULL)")
+        self._shard_of: Dict[str, str] = dict(self._conn.execute("SELECT source, shard FROM sources"))
+        self._names: List[str] = [name for name, in self._conn.execute("SELECT name FROM shards ORDER BY name")]
+        self._shards: Dict[str, VectorStore] = {}
+
+    # --- shards ------------------------------------------------------------------------
+
+    def _shard(self, name: str) -> VectorStore:
+        with self._lock:
+            if name not in self._shards:
+                directory = self.directory / name
+                directory.mkdir(exist_ok=True)
+                self._shards[name] = self.shard_factory(name, directory)
+            return self._shards[name]
+
+    def _new_shard(self) -> str:
+        name = f"shard{len(self._names):05d}"
+        with self._conn:
+            self._conn.execute("INSERT INTO shards (name) VALUES (?)", (name,))
+        self._names.append(name)
+        return name
+
+    def _assign(self, source: str, chunks: int) -> str:
+        """The shard of `source`, placing a new source by the strategy."""
+        if source in self._shard_of:
+            return self._shard_of[source]
+        if self.strategy == "size" and self._names:
+            current = self._names[-1]
+            size = self._shard(current).count()
+            name = current if size == 0 or size + chunks <= self.shard_size else self._new_shard()
+        else:
+            name = self._new_shard()
+        with self._conn:
+            self._conn.execute("INSERT INTO sources (source, shard) VALUES (?, ?)", (source, name))
+        self._shard_of[source] = name
+        return name
+
+    def shards_for(self, filter: Optional[Dict[str, Any]] = None) -> List[str]:
+        """The shards holding chunks a search with `filter` may return."""
+        with self._lock:
+            sources = filter_sources(filter)
+            if sources is None:
+                return list(self._names)
+            return sorted({self._shard_of[source] for source in sources if source in self._shard_of})
+
+    def _fan_out(self, names: Sequence[str], call: Callable[[str, VectorStore], Any]) -> List[Any]:
+        """`call(name, shard)` on every shard of `names`, in parallel, results in the order of `names`."""
+        shards = [self._shard(name) for name in names]
+        if len(shards) == 1:
+            return [call(names[0], shards[0])]
+        return list(self._executor.map(call, names, shards))
+
+    # --- writes ------------------------------------------------------------------------
+
+    def add_embeddings(self, texts: Sequence[str], embeddings: Sequence[Sequence[float]],
+                       metadatas: Optional[Sequence[Dict[str, Any]]] = None,
+                       ids: Optional[Sequence[str]] = None) -> List[str]:
+        ids = list(ids) if ids is not None else self.new_ids(len(texts))
+        metadatas = list(metadatas) if metadatas is not None else [{}] * len(texts)
+        groups: Dict[str, List[int]] = {}
+        for i, metadata in enumerate(metadatas):
+            groups.setdefault(str((metadata or {}).get("source", _NO_SOURCE)), []).append(i)
+        with self._lock:
+            for source, rows in groups.items():
+                shard = self._shard(self._assign(source, len(rows)))
+                shard.add_embeddings([texts[i] for i in rows], [embeddings[i] for i in rows],
+                                     [metadatas[i] for i in rows], [ids[i] for i in rows])
+        return ids
+
+    def delete(self, ids: Iterable[str]) -> None:
+        ids = list(ids)
+        if ids:
+            # the manifest maps sources, not chunks, every shard ignores the ids it does not hold
+            self._fan_out(self.shards_for(), lambda _, shard: shard.delete(ids))
+
+    def ids_where(self, filter: Dict[str, Any]) -> List[str]:
+        names = self.shards_for(filter)
+        return [chunk_id for ids in self._fan_out(names, lambda _, shard: shard.ids_where(filter))
+                for chunk_id in ids] if names else []
+
+    def get_chunks(self, ids: Sequence[str]) -> Tuple[List[str], List[Document], np.ndarray]:
+        names = self.shards_for()
+        found = [] if not names or not ids else \
+            [chunks for chunks in self._fan_out(names, lambda _, shard: shard.get_chunks(ids)) if chunks[0]]
+        if not found:
+            return [], [], np.zeros((0, 0), dtype=np.float32)
+        return ([chunk_id for chunk_ids, _, _ in found for chunk_id in chunk_ids],
+                [doc for _, docs, _ in found for doc in docs], np.concatenate([vectors for _, _, vectors in found]))
+
+    # --- search ------------------------------------------------------------------------
+
+    def search_by_vector(self, vector: Sequence[float], k: int = 4,
+                         filter: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float]]:
+        names = self.shards_for(filter)
+        if not names:
+            return []
+        results = self._fan_out(names, lambda _, shard: shard.search_by_vector(vector, k, filter))
+        return [(doc, score) for doc, score, _ in merge_by_score(results, k)]
+
+    def max_marginal_relevance_search_by_vector(self, vector: Sequence[float], k: int = 4, fetch_k: int = 20,
+                                                lambda_mult: float = 0.5,
+                                                filter: Optional[Dict[str, Any]] = None) -> List[Document]:
+        """MMR per shard over its share of the merged `fetch_k` candidates, see MergedStore."""
+        names = self.shards_for(filter)
+        if not names:
+            return []
+        candidates = merge_by_score(
+            self._fan_out(names, lambda _, shard: shard.search_by_vector(vector, fetch_k, filter)), fetch_k)
+        shares: Dict[str, int] = {}
+        for _, _, origin in candidates:
+            shares[names[origin]] = shares.get(names[origin], 0) + 1
+        quotas = proportional_quotas(k, shares)
+        selected = [name for name in names if quotas.get(name)]
+        if not selected:
+            return []
+        results = self._fan_out(selected, lambda name, shard: shard.max_marginal_relevance_search_by_vector(
+            vector, quotas[name], shares[name], lambda_mult, filter))
+        return [doc for docs in results for doc in docs]
+
+    # --- lifecycle ---------------------------------------------------------------------
+
+    def iter_embeddings(self, batch_size: int = 1000) -> Iterator[Tuple[List[str], np.ndarray]]:
+        for name in self.shards_for():
+            yield from self._shard(name).iter_embeddings(batch_size)
+
+    @property
+    def distance_metric(self) -> Optional[str]:
+        """The metric the shards are created with."""
+        return self._distance_metric
+
+    def count(self) -> int:
+        names = self.shards_for()
+        return sum(self._fan_out(names, lambda _, shard: shard.count())) if names else 0
+
+    def snapshot(self, path: Union[str, Path]) -> Path:
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            for name in self._names:
+                self._shard(name).snapshot(path / name)
+            target = sqlite3.connect(str(path / MANIFEST_FILE))
+            try:
+                self._conn.backup(target)
+            finally:
+                target.close()
+        return path
+
+    def drop(self) -> None:
+        logger.info(f"Deleting the {len(self._names)} shards of {self.directory}...")
+        with self._lock:
+            for name in self._names:
+                self._shard(name).drop()
+            with self._conn:
+                self._conn.execute("DELETE FROM sources")
+                self._conn.execute("DELETE FROM shards")
+            self._shard_of.clear()
+            self._names.clear()
+            for shard in self._shards.values():
+                shard.close()
+            self._shards.clear()
+            for directory in self.directory.iterdir():
+                if directory.is_dir():
+                    shutil.rmtree(directory, ignore_errors=True)
+
+    def close(self) -> None:
+        with self._lock:
+            for shard in self._shards.values():
+                shard.close()
+            self._shards.clear()
+            self._executor.shutdown(wait=True)
+            self._conn.close()
@@ -0,0 +1,379 @@
+"""
+Shared, read-only corpora mounted into the retrieval of the users allowed to read them.
+
+A corpus (e.g. the product manuals) is ingested once into `user_data/_shared_corpora/<name>` and every
+user granted access searches it next to their private collection, so storage and embedding
+cost grow with the unique documents, not with the users.
+
+Usage: python -m docmind.vectorstore.shared create manuals --embedding-model embed-english-v3.0
+       python -m docmind.vectorstore.shared grant manuals alice bob      ("*" grants everyone)
+       python -m docmind.vectorstore.shared revoke manuals bob
+       python -m docmind.vectorstore.shared ingest manuals docs/*.pdf
+       python -m docmind.vectorstore.shared list
+"""
+import argparse
+import re
+import sqlite3
+import sys
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from docmind.vectorstore.base import VectorStore, merge_by_score, proportional_quotas
+from docmind.vectorstore.routing import DEFAULT_TOP_DOCUMENTS
+
+# not a possible user directory name, usernames starting with an underscore cannot be registered
+DEFAULT_SHARED_DIR = Path("user_data") / "_shared_corpora"
+REGISTRY_FILE = "corpora.db"
+EVERYONE = "*"
+
+_CORPUS_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_-]{2,50}$")
+
+
+@dataclass
+class Corpus:
+    name: str
+    embedding_model: str
+    backend: str = "chroma"
+    distance_metric: str = "l2"
+    description: str = ""
+
+
+class ReadOnlyStore(VectorStore):
+    """A store that can be searched but not changed, how shared corpora are mounted for users."""
+
+    def __init__(self, store: VectorStore, name: str):
+        super().__init__(store.embedding)
+        self.store = store
+        self.name = name
+
+    def _refuse(self, *args, **kwargs):
+        raise PermissionError(f"The shared corpus {self.name} is read-only")
+
+    add_embeddings = delete = snapshot = drop = _refuse
+
+    def ids_where(self, filter: Dict[str, Any]) -> List[str]:
+        return self.store.ids_where(filter)
+
+    def get_chunks(self, ids: Sequence[str]) -> Tuple[List[str], List[Document], np.ndarray]:
+        return self.store.get_chunks(ids)
+
+    def search_by_vector(self, vector: Sequence[float], k: int = 4,
+                         filter: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float]]:
+        return self.store.search_by_vector(vector, k, filter)
+
+    def max_marginal_relevance_search_by_vector(self, vector: Sequence[float], k: int = 4, fetch_k: int = 20,
+                                                lambda_mult: float = 0.5,
+                                                filter: Optional[Dict[str, Any]] = None) -> List[Document]:
+        return self.store.max_marginal_relevance_search_by_vector(vector, k, fetch_k, lambda_mult, filter)
+
+    def iter_embeddings(self, batch_size: int = 1000) -> Iterator[Tuple[List[str], np.ndarray]]:
+        return self.store.iter_embeddings(batch_size)
+
+    def count(self) -> int:
+        return self.store.count()
+
+    @property
+    def distance_metric(self) -> Optional[str]:
+        return self.store.distance_metric
+
+    def close(self) -> None:
+        self.store.close()
+
+
+class MergedStore(VectorStore):
+    """
+    The private store of a user with shared corpora mounted next to it.
+
+    Writes, `count` and `drop` only concern the private store. Searches embed the query once,
+    search every store and merge the results by score, so the stores must use the same
+    embedding model and distance metric, corpora with another metric are refused. A chunk found
+    in several stores is returned once. Results of a shared corpus carry its name in
+    `metadata["corpus"]`.
+    """
+
+    def __init__(self, private: VectorStore, shared: Sequence[ReadOnlyStore] = ()):
+        super().__init__(private.embedding)
+        for store in shared:
+            if None not in (private.distance_metric, store.distance_metric) \
+                    and store.distance_metric != private.distance_metric:
+                raise ValueError(f"The shared corpus {store.name} uses the {store.distance_metric} distance, "
+                                 f"its scores cannot be merged with the {private.distance_metric} ones of the "
+                                 f"private store")
+        self.private = private
+        self.shared = list(shared)
+
+    @property
+    def distance_metric(self) -> Optional[str]:
+        return self.private.distance_metric
+
+    @property
+    def stores(self) -> List[Tuple[Optional[str], VectorStore]]:
+        return [(None, self.private)] + [(store.name, store) for store in self.shared]
+
+    def add_embeddings(self, texts: Sequence[str], embeddings: Sequence[Sequence[float]],
+                       metadatas: Optional[Sequence[Dict[str, Any]]] = None,
+                       ids: Optional[Sequence[str]] = None) -> List[str]:
+        return self.private.add_embeddings(texts, embeddings, metadatas, ids)
+
+    def delete(self, ids: Iterable[str]) -> None:
+        self.private.delete(ids)
+
+    def ids_where(self, filter: Dict[str, Any]) -> List[str]:
+        return self.private.ids_where(filter)
+
+    def get_chunks(self, ids: Sequence[str]) -> Tuple[List[str], List[Document], np.ndarray]:
+        return self.private.get_chunks(ids)
+
+    def _merged(self, vector: Sequence[float], k: int,
+                filter: Optional[Dict[str, Any]]) -> List[Tuple[Document, float, Optional[str]]]:
+        stores = self.stores
+        merged = merge_by_score([store.search_by_vector(vector, k, filter) for _, store in stores], k)
+        return [(self._label(doc, stores[origin][0]), score, stores[origin][0]) for doc, score, origin in merged]
+
+    @staticmethod
+    def _label(doc: Document, corpus: Optional[str]) -> Document:
+        if corpus is not None:
+            doc.metadata["corpus"] = corpus
+        return doc
+
+    def search_by_vector(self, vector: Sequence[float], k: int = 4,
+                         filter: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float]]:
+        return [(doc, score) for doc, score, _ in self._merged(vector, k, filter)]
+
+    def max_marginal_relevance_search_by_vector(self, vector: Sequence[float], k: int = 4, fetch_k: int = 20,
+                                                lambda_mult: float = 0.5,
+                                                filter: Optional[Dict[str, Any]] = None) -> List[Document]:
+        """
+        The `fetch_k` candidates are the merged top of all stores; each store then runs MMR over its
+        share of them and contributes a proportional share of the `k` chunks.
+        """
+        shares: Dict[Optional[str], int] = {}
+        for _, _, corpus in self._merged(vector, fetch_k, filter):
+            shares[corpus] = shares.get(corpus, 0) + 1
+        quotas = proportional_quotas(k, shares)
+        docs, seen = [], set()
+        for corpus, store in self.stores:
+            if not quotas.get(corpus):
+                continue
+            for doc in store.max_marginal_relevance_search_by_vector(vector, quotas[corpus], shares[corpus],
+                                                                     lambda_mult, filter):
+                key = (doc.metadata.get("source"), doc.page_content)
+                if key not in seen:
+                    seen.add(key)
+                    docs.append(self._label(doc, corpus))
+        return docs
+
+    def iter_embeddings(self, batch_size: int = 1000) -> Iterator[Tuple[List[str], np.ndarray]]:
+        return self.private.iter_embeddings(batch_size)
+
+    def count(self) -> int:
+        return self.private.count()
+
+    def snapshot(self, path: Union[str, Path]) -> Path:
+        return self.private.snapshot(path)
+
+    def drop(self) -> None:
+        self.private.drop()
+
+    def close(self) -> None:
+        for _, store in self.stores:
+            store.close()
+
+
+class CorpusRegistry:
+    """
+    SQLite registry of the shared corpora, who may read them and which documents they hold.
+
+    Example:
+        registry = CorpusRegistry(Path("user_data/_shared_corpora"))
+        registry.create("manuals", embedding_model="embed-english-v3.0")
+        registry.grant("manuals", ["alice", "bob"])
+        registry.ingest("manuals", Path("docs").glob("*.pdf"), embeddings)
+        shared = [registry.open(corpus.name, embeddings) for corpus in registry.corpora_for("alice")]
+    """
+
+    def __init__(self, directory: Union[str, Path] = DEFAULT_SHARED_DIR):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.directory / REGISTRY_FILE), timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS corpora (name TEXT PRIMARY KEY, embedding_model TEXT "
+                               "NOT NULL, backend TEXT NOT NULL, distance_metric TEXT NOT NULL, description TEXT "
+                               "NOT NULL)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS access (corpus TEXT NOT NULL, username TEXT NOT NULL, "
+                               "PRIMARY KEY (corpus, username))")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS documents (corpus TEXT NOT NULL, source TEXT NOT NULL, "
+                               "PRIMARY KEY (corpus, source))")
+
+    def _query(self, sql: str, parameters: Sequence[Any] = ()) -> List[tuple]:
+        with self._lock:
+            return self._conn.execute(sql, parameters).fetchall()
+
+    def create(self, name: str, embedding_model: str, backend: str = "chroma", distance_metric: str = "l2",
+               description: str = "") -> Corpus:
+        if not _CORPUS_NAME.match(name):
+            raise ValueError(f"Invalid corpus name {name!r}, use 3 to 51 letters, digits, '_' or '-'")
+        corpus = Corpus(name, embedding_model, backend, distance_metric, description)
+        with self._lock, self._conn:
+            if self._conn.execute("SELECT 1 FROM corpora WHERE name = ?", (name,)).fetchone():
+                raise ValueError(f"The corpus {name} already exists")
+            self._conn.execute("INSERT INTO corpora VALUES (?, ?, ?, ?, ?)",
+                               (name, embedding_model, backend, distance_metric, description))
+        return corpus
+
+    def get(self, name: str) -> Corpus:
+        rows = self._query("SELECT name, embedding_model, backend, distance_metric, description FROM corpora "
+                           "WHERE name = ?", (name,))
+        if not rows:
+            raise ValueError(f"Unknown corpus {name}")
+        return Corpus(*rows[0])
+
+    def list(self) -> List[Corpus]:
+        return [Corpus(*row) for row in self._query(
+            "SELECT name, embedding_model, backend, distance_metric, description FROM corpora ORDER BY name")]
+
+    def grant(self, name: str, usernames: Iterable[str]) -> None:
+        """Allow `usernames` to read the corpus, "*" allows every user."""
+        self.get(name)
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR IGNORE INTO access (corpus, username) VALUES (?, ?)",
+                                   [(name, username) for username in usernames])
+
+    def revoke(self, name: str, usernames: Iterable[str]) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM access WHERE corpus = ? AND username = ?",
+                                   [(name, username) for username in usernames])
+
+    def readers(self, name: str) -> List[str]:
+        return [username for username, in self._query(
+            "SELECT username FROM access WHERE corpus = ? ORDER BY username", (name,))]
+
+    def can_read(self, name: str, username: str) -> bool:
+        return bool(self._query("SELECT 1 FROM access WHERE corpus = ? AND username IN (?, ?)",
+                                (name, username, EVERYONE)))
+
+    def corpora_for(self, username: str) -> List[Corpus]:
+        """The corpora `username` may read."""
+        return [Corpus(*row) for row in self._query(
+            "SELECT DISTINCT c.name, c.embedding_model, c.backend, c.distance_metric, c.description FROM corpora c "
+            "JOIN access a ON a.corpus = c.name WHERE a.username IN (?, ?) ORDER BY c.name", (username, EVERYONE))]
+
+    def documents(self, name: str) -> List[str]:
+        return [source for source, in self._query(
+            "SELECT source FROM documents WHERE corpus = ? ORDER BY source", (name,))]
+
+    def _open(self, corpus: Corpus, embedding_func: Embeddings, **options: Any) -> VectorStore:
+        from docmind.vectorstore.factory import create_vectorstore
+
+        directory = self.directory / corpus.name
+        directory.mkdir(exist_ok=True)
+        return create_vectorstore(corpus.name, directory, embedding_func, backend=corpus.backend,
+                                  distance_metric=corpus.distance_metric, **options)
+
+    def open(self, name: str, embedding_func: Embeddings, username: Optional[str] = None,
+             **options: Any) -> ReadOnlyStore:
+        """Mount the corpus read-only, for `username` when given, who must have been granted access."""
+        if username is not None and not self.can_read(name, username):
+            raise PermissionError(f"{username} may not read the corpus {name}")
+        return ReadOnlyStore(self._open(self.get(name), embedding_func, **options), name)
+
+    def open_for_ingest(self, name: str, embedding_func: Embeddings) -> VectorStore:
+        """The writable store of the corpus, for the ingest tools of its administrators."""
+        # the document index is kept up to date for the readers routing their searches
+        return self._open(self.get(name), embedding_func, document_routing=DEFAULT_TOP_DOCUMENTS)
+
+    def ingest(self, name: str, paths: Iterable[Path], embedding_func: Embeddings, **pipeline_options: Any):
+        """
+        Parse, embed and insert files into the corpus. Chunks already in the corpus are skipped, so
+        ingesting a new revision of a manual only embeds what changed.
+        """
+        from docmind.ingest.cleaning import (
+            DEDUP_DB_FILE,
+            BoilerplateStripper,
+            ChunkDeduplicator,
+        )
+        from docmind.ingest.pipeline import IngestPipeline
+
+        store = self.open_for_ingest(name, embedding_func)
+        deduplicator = ChunkDeduplicator(self.directory / name / DEDUP_DB_FILE)
+        try:
+            stats = IngestPipeline(store, boilerplate=BoilerplateStripper(), deduplicator=deduplicator,
+                                   **pipeline_options).run(paths)
+        finally:
+            deduplicator.close()
+            if hasattr(store, "flush"):
+                store.flush()
+            store.close()
+        self.add_documents(name, [path.name for path in stats.processed_files])
+        return stats
+
+    def add_documents(self, name: str, sources: Iterable[str]) -> None:
+        """Record documents ingested into the corpus by other means, e.g. a drop folder."""
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR IGNORE INTO documents (corpus, source) VALUES (?, ?)",
+                                   [(name, source) for source in sources])
+
+    def remove_documents(self, name: str, sources: Iterable[str]) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM documents WHERE corpus = ? AND source = ?",
+                                   [(name, source) for source in sources])
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shared-dir", type=Path, default=DEFAULT_SHARED_DIR)
+    commands = parser.add_subparsers(dest="command", required=True)
+    create = commands.add_parser("create", help="register a new corpus")
+    create.add_argument("name")
+    create.add_argument("--embedding-model", default="embed-english-v3.0")
+    create.add_argument("--backend", default="chroma", choices=["chroma", "numpy"])
+    create.add_argument("--distance-metric", default="l2", choices=["l2", "ip", "cosine"])
+    create.add_argument("--description", default="")
+    for command in ("grant", "revoke"):
+        access = commands.add_parser(command, help=f"{command} read access")
+        access.add_argument("name")
+        access.add_argument("usernames", nargs="+")
+    ingest = commands.add_parser("ingest", help="add PDF files to a corpus")
+    ingest.add_argument("name")
+    ingest.add_argument("files", nargs="+", type=Path)
+    commands.add_parser("list", help="list the corpora and their readers")
+    args = parser.parse_args(argv)
+
+    registry = CorpusRegistry(args.shared_dir)
+    if args.command == "create":
+        registry.create(args.name, args.embedding_model, args.backend, args.distance_metric, args.description)
+    elif args.command == "grant":
+        registry.grant(args.name, args.usernames)
+    elif args.command == "revoke":
+        registry.revoke(args.name, args.usernames)
+    elif args.command == "ingest":
+        from docmind.llm.embeddings import DocMindCohereEmbeddings
+        from docmind.utils.usage import get_usage_ledger
+
+        # the embedding cost is booked once, on the corpus
+        embeddings = DocMindCohereEmbeddings(model=registry.get(args.name).embedding_model, ledger=get_usage_ledger(),
+                                             username=f"corpus:{args.name}")
+        stats = registry.ingest(args.name, args.files, embeddings)
+        print(f"{stats.chunks} chunks from {stats.files} files, {stats.duplicates} duplicates skipped")  # noqa: T201
+    else:
+        for corpus in registry.list():
+            documents = len(registry.documents(corpus.name))
+            print(f"{corpus.name}: {corpus.embedding_model}, {documents} documents, "  # noqa: T201
+                  f"readers {', '.join(registry.readers(corpus.name)) or '-'}")
+    registry.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+"""
+Tune the HNSW parameters of a collection against exact search.
+
+For every combination of the grid an hnswlib graph (the library Chroma and the numpy backend use)
+is built on the vectors of the collection, then every sample query is searched with each
+search_ef. Recall@k is measured against exact search on the same vectors, so the numbers
+describe the collection itself, not a synthetic workload.
+
+Usage: python -m docmind.vectorstore.tuning --user-data-dir user_data/alice --username alice
+                                            [--config config.yaml] [--backend chroma] [--queries queries.txt]
+                                            [--sample 200] [--k 6] [--target-recall 0.95] [--m 8 16 32]
+                                            [--construction-ef 64 100 200] [--search-ef 10 32 64 128]
+
+The store is opened with the backend, distance metric and sharding of `--config`, `--backend`
+overrides the backend. `--queries` is a file with one question per line, embedded in batches with
+the Cohere model in `--embedding-model`. Without it `--sample` stored chunks, slightly perturbed,
+stand in for the queries.
+"""
+import argparse
+import itertools
+import logging
+import statistics
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from docmind.vectorstore.base import VectorStore
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_M = (8, 16, 32)
+DEFAULT_CONSTRUCTION_EF = (64, 100, 200)
+DEFAULT_SEARCH_EF = (10, 32, 64, 128)
+
+
+@dataclass
+class TuningResult:
+    m: int
+    construction_ef: int
+    search_ef: int
+    recall: float
+    p50_ms: float
+    p95_ms: float
+    build_s: float
+
+    @property
+    def params(self) -> dict:
+        """The settings in the form of `create_userdb(hnsw_params=...)`."""
+        return {"M": self.m, "construction_ef": self.construction_ef, "search_ef": self.search_ef}
+
+
+def load_vectors(store: VectorStore, batch_size: int = 1000) -> np.ndarray:
+    batches = [vectors for _, vectors in store.iter_embeddings(batch_size) if len(vectors)]
+    if not batches:
+        raise ValueError("The collection is empty, there is nothing to tune")
+    return np.concatenate(batches).astype(np.float32)
+
+
+def sample_queries(vectors: np.ndarray, count: int, noise: float = 0.05, seed: int = 0) -> np.ndarray:
+    """Stored vectors moved by `noise` times their norm, a stand-in when no real queries are given."""
+    rng = np.random.default_rng(seed)
+    picked = vectors[rng.choice(len(vectors), min(count, len(vectors)), replace=False)]
+    norms = np.linalg.norm(picked, axis=1, keepdims=True)
+    jitter = rng.normal(size=picked.shape) / np.sqrt(vectors.shape[1])
+    return (picked + noise * norms * jitter).astype(np.float32)
+
+
+def exact_neighbours(vectors: np.ndarray, queries: np.ndarray, k: int, space: str = "l2") -> np.ndarray:
+    """Rows of the `k` nearest vectors of every query, with Chroma's distance for `space`."""
+    if space == "cosine":
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+    scores = queries @ vectors.T
+    if space == "l2":
+        scores = 2 * scores - (vectors * vectors).sum(axis=1)
+    k = min(k, len(vectors))
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+
+def tune_hnsw(vectors: np.ndarray, queries: np.ndarray, k: int = 6, space: str = "l2",
+              m_values: Sequence[int] = DEFAULT_M, construction_ef_values: Sequence[int] = DEFAULT_CONSTRUCTION_EF,
+              search_ef_values: Sequence[int] = DEFAULT_SEARCH_EF) -> List[TuningResult]:
+    """Recall@k and per query latency of every combination of the grid."""
+    import hnswlib
+
+    k = min(k, len(vectors))
+    expected = exact_neighbours(vectors, queries, k, space)
+    labels = np.arange(len(vectors))
+    results = []
+    for m, construction_ef in itertools.product(m_values, construction_ef_values):
+        index = hnswlib.Index(space=space, dim=vectors.shape[1])
+        start = time.perf_counter()
+        index.init_index(max_elements=len(vectors), ef_construction=construction_ef, M=m)
+        index.add_items(vectors, labels)
+        build_seconds = time.perf_counter() - start
+        for search_ef in search_ef_values:
+            index.set_ef(max(search_ef, k))
+            latencies, recalls = [], []
+            for query, neighbours in zip(queries, expected):
+                start = time.perf_counter()
+                found, _ = index.knn_query(query, k=k)
+                latencies.append((time.perf_counter() - start) * 1000)
+                recalls.append(len(set(found[0].tolist()) & set(neighbours.tolist())) / k)
+            latencies.sort()
+            results.append(TuningResult(m, construction_ef, search_ef, statistics.mean(recalls),
+                                        statistics.median(latencies), latencies[int(0.95 * (len(latencies) - 1))],
+                                        build_seconds))
+            logger.debug(f"Tuned {results[-1]}")
+    return results
+
+
+def recommend(results: Sequence[TuningResult], target_recall: float = 0.95) -> Tuple[TuningResult, bool]:
+    """
+    The fastest setting (p95, then the smaller graph) reaching `target_recall`, or the one with the
+    best recall when none does. The flag tells whether the target was reached.
+    """
+    if not results:
+        raise ValueError("No tuning results to recommend from")
+    reaching = [result for result in results if result.recall >= target_recall]
+    if reaching:
+        return min(reaching, key=lambda r: (r.p95_ms, r.m, r.construction_ef, r.search_ef)), True
+    return max(results, key=lambda r: (r.recall, -r.p95_ms)), False
+
+
+def format_results(results: Sequence[TuningResult]) -> str:
+    lines = [f"{'M':>4}{'construction_ef':>17}{'search_ef':>11}{'recall':>9}{'p50 ms':>9}{'p95 ms':>9}{'build s':>9}"]
+    for r in results:
+        lines.append(f"{r.m:>4}{r.construction_ef:>17}{r.search_ef:>11}{r.recall:>9.3f}{r.p50_ms:>9.3f}"
+                     f"{r.p95_ms:>9.3f}{r.build_s:>9.2f}")
+    return "\n".join(lines)
+
+
+def _embed_queries(path: Path, model: str, batch_size: int = 96) -> np.ndarray:
+    from langchain_cohere import CohereEmbeddings
+
+    questions = [line.strip() for line in path.read_text(encoding="utf-8").splitlines() if line.strip()]
+    if not questions:
+        raise ValueError(f"{path} contains no queries")
+    client = CohereEmbeddings(model=model)
+    vectors = []
+    for start in range(0, len(questions), batch_size):
+        vectors.extend(client.embed(questions[start:start + batch_size], input_type="search_query"))
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--user-data-dir", type=Path, required=True, help="directory of the user, e.g. user_data/alice")
+    parser.add_argument("--username", required=True)
+    parser.add_argument("--config", type=Path, default=Path("config.yaml"))
+    parser.add_argument("--backend", default=None, choices=["chroma", "numpy"], help="defaults to the config's")
+    parser.add_argument("--queries", type=Path, default=None, help="file with one sample query per line")
+    parser.add_argument("--embedding-model", default="embed-english-v3.0", help="model that embeds --queries")
+    parser.add_argument("--sample", type=int, default=200, help="stored chunks used as queries without --queries")
+    parser.add_argument("--k", type=int, default=6, help="chunks retrieved per query")
+    parser.add_argument("--target-recall", type=float, default=0.95)
+    parser.add_argument("--m", type=int, nargs="+", default=list(DEFAULT_M))
+    parser.add_argument("--construction-ef", type=int, nargs="+", default=list(DEFAULT_CONSTRUCTION_EF))
+    parser.add_argument("--search-ef", type=int, nargs="+", default=list(DEFAULT_SEARCH_EF))
+    args = parser.parse_args(argv)
+
+    from docmind.utils.config import ProjectConfiguration
+    from docmind.vectorstore.factory import open_user_vectorstore
+
+    config = ProjectConfiguration.load_config(args.config)
+    if args.backend:
+        config.vectorstore_backend = args.backend
+    store = open_user_vectorstore(config, args.username, args.user_data_dir, embedding_func=None)
+    try:
+        space = store.distance_metric
+        vectors = load_vectors(store)
+        current = getattr(store, "hnsw_params", None)
+    finally:
+        store.close()
+    queries = _embed_queries(args.queries, args.embedding_model) if args.queries else \
+        sample_queries(vectors, args.sample)
+
+    print(f"{len(vectors)} chunks of dimension {vectors.shape[1]}, {len(queries)} queries, "  # noqa: T201
+          f"k={args.k}, space={space}")
+    results = tune_hnsw(vectors, queries, args.k, space, args.m, args.construction_ef, args.search_ef)
+    print(format_results(results))  # noqa: T201
+    best, reached = recommend(results, args.target_recall)
+    if current:
+        print(f"current: {current}")  # noqa: T201
+    if not reached:
+        print(f"no setting reaches recall {args.target_recall}, widen the grid")  # noqa: T201
+    print(f"recommended: {best.params} (recall {best.recall:.3f}, p95 {best.p95_ms:.3f} ms)")  # noqa: T201
+    print("config.yaml:\n"  # noqa: T201
+          f"  hnsw_collections:\n    {args.username}: {{M: {best.m}, construction_ef: {best.construction_ef}, "
+          f"search_ef: {best.search_ef}}}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
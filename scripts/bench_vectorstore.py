@@ -0,0 +1,147 @@
+"""
+Benchmark the vector store backends on the same synthetic workload.
+
+Vectors are drawn from a Gaussian mixture, so nearest neighbours are meaningful. Every
+backend receives the same chunks and queries; recall@k is measured against exact search.
+"search MB" is what a query scans: the float32 matrix, or the codes of the quantized backends
+(numpy-int8, numpy-binary) that are then rescored with `--rescore-factor` * k full vectors.
+
+Usage: python scripts/bench_vectorstore.py [--n 20000] [--dim 384] [--queries 200] [--k 10]
+                                           [--backends chroma numpy-exact numpy-ivf numpy-hnsw]
+                                           [--truncate-dim 256] [--rescore-factor 4] [--filter]
+"""
+import argparse
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from docmind.vectorstore.base import VectorStore  # noqa: E402
+
+SOURCES = 10
+BACKENDS = ["chroma", "numpy-exact", "numpy-ivf", "numpy-hnsw", "numpy-int8", "numpy-binary"]
+
+
+class NoEmbeddings:
+    """The benchmark only inserts and searches vectors, nothing is embedded."""
+
+    def embed_documents(self, texts):
+        raise NotImplementedError
+
+    def embed_query(self, text):
+        raise NotImplementedError
+
+
+def make_workload(n: int, dim: int, queries: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(1, n // 200), dim)).astype(np.float32)
+    vectors = centers[rng.integers(len(centers), size=n)] + 0.3 * rng.normal(size=(n, dim)).astype(np.float32)
+    query_vectors = vectors[rng.choice(n, queries, replace=False)] + 0.1 * rng.normal(size=(queries, dim))
+    return vectors.astype(np.float32), query_vectors.astype(np.float32)
+
+
+def exact_neighbours(vectors: np.ndarray, query: np.ndarray, k: int,
+                     allowed: Optional[np.ndarray] = None) -> List[int]:
+    distances = ((vectors - query) ** 2).sum(axis=1)
+    if allowed is not None:
+        distances = np.where(allowed, distances, np.inf)
+    return np.argsort(distances)[:k].tolist()
+
+
+def open_store(backend: str, directory: Path, truncate_dim: Optional[int] = None,
+               rescore_factor: int = 4) -> VectorStore:
+    if backend == "chroma":
+        from docmind.vectorstore.chromadb import create_userdb
+
+        return create_userdb("bench", directory, NoEmbeddings())
+    from docmind.vectorstore.numpy_store import NumpyStore
+
+    variant = backend.split("-", 1)[1]
+    if variant in ("int8", "binary"):
+        return NumpyStore(directory / "numpy", NoEmbeddings(), quantization=variant, truncate_dim=truncate_dim,
+                          rescore_factor=rescore_factor)
+    return NumpyStore(directory / "numpy", NoEmbeddings(), index=variant, ivf_min_size=1000)
+
+
+def directory_size(directory: Path) -> int:
+    return sum(path.stat().st_size for path in directory.rglob("*") if path.is_file())
+
+
+def run(backend: str, vectors: np.ndarray, queries: np.ndarray, k: int, use_filter: bool,
+        store_factory: Callable[..., VectorStore] = open_store, batch_size: int = 1000,
+        **store_options) -> Dict[str, float]:
+    sources = [f"{i % SOURCES}.pdf" for i in range(len(vectors))]
+    with tempfile.TemporaryDirectory() as tmp:
+        store = store_factory(backend, Path(tmp), **store_options)
+        start = time.perf_counter()
+        for offset in range(0, len(vectors), batch_size):
+            rows = range(offset, min(offset + batch_size, len(vectors)))
+            store.add_embeddings([f"chunk {i}" for i in rows], vectors[offset:offset + len(rows)],
+                                 [{"source": sources[i], "row": i} for i in rows], [str(i) for i in rows])
+        insert_seconds = time.perf_counter() - start
+
+        latencies, recalls = [], []
+        where = {"source": {"$in": ["0.pdf", "1.pdf"]}} if use_filter else None
+        allowed = np.isin(np.array(sources), ["0.pdf", "1.pdf"]) if use_filter else None
+        for query in queries:
+            start = time.perf_counter()
+            results = store.search_by_vector(query, k=k, filter=where)
+            latencies.append((time.perf_counter() - start) * 1000)
+            expected = set(exact_neighbours(vectors, query, k, allowed))
+            found = {int(doc.metadata["row"]) for doc, _ in results}
+            recalls.append(len(found & expected) / len(expected))
+
+        if hasattr(store, "flush"):
+            store.flush()
+        size = directory_size(Path(tmp))
+        # chroma keeps its HNSW graph, about the size of the vectors, in memory
+        search_bytes = store.memory_usage()["search"] if hasattr(store, "memory_usage") else vectors.nbytes
+        store.close()
+
+    latencies.sort()
+    return {
+        "insert_s": insert_seconds,
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": latencies[int(0.95 * (len(latencies) - 1))],
+        "recall": statistics.mean(recalls),
+        "disk_mb": size / 2 ** 20,
+        "search_mb": search_bytes / 2 ** 20,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=20000, help="number of chunks")
+    parser.add_argument("--dim", type=int, default=384, help="vector dimension")
+    parser.add_argument("--queries", type=int, default=200, help="number of queries")
+    parser.add_argument("--k", type=int, default=10, help="neighbours per query")
+    parser.add_argument("--backends", nargs="+", default=BACKENDS, choices=BACKENDS)
+    parser.add_argument("--truncate-dim", type=int, default=None, help="dimensions kept by the quantized codes")
+    parser.add_argument("--rescore-factor", type=int, default=4, help="candidates rescored per neighbour")
+    parser.add_argument("--filter", action="store_true", help="restrict every query to 2 of the 10 sources")
+    args = parser.parse_args()
+
+    vectors, queries = make_workload(args.n, args.dim, args.queries)
+    print(f"{args.n} chunks of dimension {args.dim}, {args.queries} queries, k={args.k}, "  # noqa: T201
+          f"filter={args.filter}")
+    print(f"{'backend':<14}{'insert s':>10}{'p50 ms':>10}{'p95 ms':>10}{'recall':>10}{'disk MB':>10}"  # noqa: T201
+          f"{'search MB':>11}")
+    for backend in args.backends:
+        options = {}
+        if backend in ("numpy-int8", "numpy-binary"):
+            options = {"truncate_dim": args.truncate_dim, "rescore_factor": args.rescore_factor}
+        result = run(backend, vectors, queries, args.k, args.filter, **options)
+        print(f"{backend:<14}{result['insert_s']:>10.2f}{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}"  # noqa: T201
+              f"{result['recall']:>10.3f}{result['disk_mb']:>10.1f}{result['search_mb']:>11.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
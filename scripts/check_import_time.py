@@ -0,0 +1,79 @@
+"""
+Measure the cold import time of the modules imported by a Streamlit entry point and fail
+when it exceeds a budget.
+
+Every run starts a fresh interpreter with `python -X importtime` that executes only the
+top level import statements of the script, so Streamlit commands are not run.
+
+Usage: python scripts/check_import_time.py [app.py] [--budget-ms 1000] [--runs 3] [--top 15]
+"""
+import argparse
+import ast
+import re
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+from typing import List, Set, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def top_level_imports(script: Path) -> str:
+    """Returns the import statements found at the top level of `script` as source code."""
+    tree = ast.parse(script.read_text(encoding="utf-8"))
+    nodes = [node for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))]
+    return "\n".join(ast.unparse(node) for node in nodes)
+
+
+def measure(code: str, exclude: Set[str] = frozenset()) -> Tuple[float, List[Tuple[float, str]]]:
+    """
+    Runs `code` in a fresh interpreter, returns the total import time and per package times in ms.
+    Packages listed in `exclude` are left out.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing failed:\n{result.stderr}")
+
+    packages = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        # only count packages imported directly, nested ones are included in their cumulative time
+        if match and len(match.group(3)) == 1 and match.group(4) not in exclude:
+            packages.append((int(match.group(2)) / 1000, match.group(4)))
+    return sum(cumulative for cumulative, _ in packages), packages
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("script", nargs="?", default=str(ROOT / "app.py"))
+    parser.add_argument("--budget-ms", type=float, default=1000.0, help="maximum median import time")
+    parser.add_argument("--runs", type=int, default=3, help="number of cold interpreter runs")
+    parser.add_argument("--top", type=int, default=15, help="number of slowest packages to report")
+    args = parser.parse_args()
+
+    code = top_level_imports(Path(args.script))
+    # packages imported by the interpreter startup itself are not part of the budget
+    startup = {package for _, package in measure("pass")[1]}
+    runs = [measure(code, startup) for _ in range(args.runs)]
+    totals = [total for total, _ in runs]
+    median = statistics.median(totals)
+
+    _, packages = runs[totals.index(median)] if median in totals else runs[0]
+    print(f"Slowest imports of {args.script}:")  # noqa: T201
+    for cumulative, package in sorted(packages, reverse=True)[:args.top]:
+        print(f"  {cumulative:10.1f} ms  {package}")  # noqa: T201
+
+    print(f"Import time: median {median:.1f} ms over {args.runs} runs, budget {args.budget_ms:.1f} ms")  # noqa: T201
+    if median > args.budget_ms:
+        print("ERROR: import time is over budget.")  # noqa: T201
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,210 @@
+"""
+A local stand-in for the Cohere API, for load tests and offline development.
+
+Serves the endpoints DocMind calls: models.list, embed, chat (streamed or not) and rerank, with
+configurable latencies so the load on a DocMind process is shaped like the real one without
+paying for tokens. Embeddings are derived from a hash of the text, answers are a canned sentence
+streamed token by token.
+
+Usage: python scripts/fake_cohere.py [--port 8700] [--embed-latency 0.05] [--first-token 0.3]
+                                     [--token-interval 0.02] [--dim 1024]
+
+Point DocMind at it through the variable the Cohere SDK reads its endpoint from:
+
+    CO_API_URL=http://localhost:8700 COHERE_API_KEY=fake streamlit run app.py
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import tornado.httpserver
+import tornado.ioloop
+import tornado.netutil
+import tornado.web
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from docmind.llm.catalogue import FALLBACK_MODELS  # noqa: E402
+
+ANSWER = ("According to the uploaded documents the warranty covers parts and labour for two years [1], "
+          "returns are accepted within thirty days of delivery [2].")
+# questions tagged with [lt:<tag>] have the time of their first streamed token recorded
+TAG = re.compile(r"\[lt:([\w-]+)\]")
+
+
+def fake_embedding(text: str, dim: int) -> List[float]:
+    """A unit vector derived from the text, equal texts get equal vectors."""
+    seed = int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), "little")
+    vector = np.random.default_rng(seed).normal(size=dim)
+    return (vector / np.linalg.norm(vector)).round(6).tolist()
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+class FakeCohere:
+    """
+    The fake API and the timings it observed. `first_tokens[tag]` lists the wall clock times
+    (time.time()) the first token of every streamed answer to a question tagged `tag` was sent.
+    """
+
+    def __init__(self, embed_latency: float = 0.05, first_token: float = 0.3, token_interval: float = 0.02,
+                 dim: int = 1024):
+        self.embed_latency = embed_latency
+        self.first_token = first_token
+        self.token_interval = token_interval
+        self.dim = dim
+        self.first_tokens: Dict[str, List[float]] = defaultdict(list)
+        self.requests: Dict[str, int] = defaultdict(int)
+        self._server: Optional[tornado.httpserver.HTTPServer] = None
+        self._loop: Optional[tornado.ioloop.IOLoop] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def make_app(self) -> tornado.web.Application:
+        return tornado.web.Application([
+            (r"/v1/models", ModelsHandler, {"fake": self}),
+            (r"/v1/embed", EmbedHandler, {"fake": self}),
+            (r"/v1/chat", ChatHandler, {"fake": self}),
+            (r"/v1/rerank", RerankHandler, {"fake": self}),
+        ])
+
+    def start_in_thread(self, port: int = 0, address: str = "127.0.0.1") -> str:
+        """Serve from a daemon thread, returns the base URL. Port 0 picks a free port."""
+        sockets = tornado.netutil.bind_sockets(port, address)
+        url = f"http://{address}:{sockets[0].getsockname()[1]}"
+        started = threading.Event()
+
+        def serve():
+            asyncio.set_event_loop(asyncio.new_event_loop())
+            self._loop = tornado.ioloop.IOLoop.current()
+            self._server = tornado.httpserver.HTTPServer(self.make_app())
+            self._server.add_sockets(sockets)
+            started.set()
+            self._loop.start()
+
+        self._thread = threading.Thread(target=serve, name="fake-cohere", daemon=True)
+        self._thread.start()
+        started.wait()
+        return url
+
+    def cpu_time(self) -> float:
+        """CPU seconds spent by the serving thread, so a load test can leave them out of its numbers."""
+        if self._thread is None:
+            return 0.0
+        return time.clock_gettime(time.pthread_getcpuclockid(self._thread.ident))
+
+    def stop(self) -> None:
+        if self._loop is not None:
+            self._loop.add_callback(self._server.stop)
+            self._loop.add_callback(self._loop.stop)
+
+
+class FakeHandler(tornado.web.RequestHandler):
+    def initialize(self, fake: FakeCohere):
+        self.fake = fake
+
+    def prepare(self):
+        self.fake.requests[self.request.path] += 1
+        self.body = json.loads(self.request.body or b"{}")
+
+    def meta(self, input_tokens: int = 0, output_tokens: int = 0) -> Dict:
+        return {"api_version": {"version": "1"},
+                "billed_units": {"input_tokens": input_tokens, "output_tokens": output_tokens},
+                "tokens": {"input_tokens": input_tokens, "output_tokens": output_tokens}}
+
+
+class ModelsHandler(FakeHandler):
+    def get(self):
+        self.write({"models": [{"name": name, "endpoints": model["endpoints"], "finetuned": False,
+                                "context_length": model["context_length"], "default_endpoints": []}
+                               for name, model in FALLBACK_MODELS.items()]})
+
+
+class EmbedHandler(FakeHandler):
+    async def post(self):
+        texts = self.body.get("texts") or []
+        await asyncio.sleep(self.fake.embed_latency)
+        embeddings = [fake_embedding(text, self.fake.dim) for text in texts]
+        response = {"id": uuid.uuid4().hex, "texts": texts,
+                    "meta": self.meta(input_tokens=sum(estimate_tokens(text) for text in texts))}
+        if self.body.get("embedding_types"):
+            response.update(response_type="embeddings_by_type", embeddings={"float": embeddings})
+        else:
+            response.update(response_type="embeddings_floats", embeddings=embeddings)
+        self.write(response)
+
+
+class ChatHandler(FakeHandler):
+    async def post(self):
+        generation_id = uuid.uuid4().hex
+        input_tokens = estimate_tokens(self.request.body.decode())
+        response = {"text": ANSWER, "generation_id": generation_id, "finish_reason": "COMPLETE",
+                    "chat_history": [], "meta": self.meta(input_tokens, estimate_tokens(ANSWER))}
+        await asyncio.sleep(self.fake.first_token)
+        if not self.body.get("stream"):
+            self.write(response)
+            return
+
+        self.set_header("Content-Type", "application/stream+json")
+        tags = TAG.findall(self.body.get("message") or "")
+        self.write_event({"event_type": "stream-start", "generation_id": generation_id, "is_finished": False})
+        for index, token in enumerate(re.findall(r"\S+\s*", ANSWER)):
+            if index:
+                await asyncio.sleep(self.fake.token_interval)
+            self.write_event({"event_type": "text-generation", "text": token, "is_finished": False})
+            await self.flush()
+            if not index:
+                for tag in tags:
+                    self.fake.first_tokens[tag].append(time.time())
+        self.write_event({"event_type": "stream-end", "finish_reason": "COMPLETE", "response": response,
+                          "is_finished": True})
+
+    def write_event(self, event: Dict) -> None:
+        self.write(json.dumps(event) + "\n")
+
+
+class RerankHandler(FakeHandler):
+    async def post(self):
+        query, documents = self.body.get("query", ""), self.body.get("documents") or []
+        await asyncio.sleep(self.fake.embed_latency)
+        terms = set(query.lower().split())
+        scores = [len(terms & set(str(document).lower().split())) / (len(terms) or 1) for document in documents]
+        ranked = sorted(range(len(documents)), key=lambda index: -scores[index])[:self.body.get("top_n")]
+        self.write({"id": uuid.uuid4().hex, "meta": self.meta(),
+                    "results": [{"index": index, "relevance_score": scores[index]} for index in ranked]})
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8700)
+    parser.add_argument("--address", default="127.0.0.1")
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="seconds per embed and rerank call")
+    parser.add_argument("--first-token", type=float, default=0.3, help="seconds before the first chat token")
+    parser.add_argument("--token-interval", type=float, default=0.02, help="seconds between chat tokens")
+    parser.add_argument("--dim", type=int, default=1024, help="embedding dimension")
+    args = parser.parse_args()
+
+    fake = FakeCohere(args.embed_latency, args.first_token, args.token_interval, args.dim)
+    fake.make_app().listen(args.port, args.address)
+    print(f"Fake Cohere API on http://{args.address}:{args.port}")  # noqa: T201
+    try:
+        tornado.ioloop.IOLoop.current().start()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,309 @@
+"""
+Load test the documents chat page: simulated users log in, upload PDFs, ask questions and switch
+chats against a local fake Cohere server (scripts/fake_cohere.py), all in one process like the
+sessions of one Streamlit server.
+
+Every user is a Streamlit AppTest session running the real page script in a thread of its own,
+the sessions share the process wide caches (catalogue, credentials, stores) exactly as browser
+sessions do. Every level of `--users` is run with fresh users after an unreported warm-up user,
+and reports:
+
+    rerun p50/p95/p99   wall time of the reruns (login, upload, process, questions, chat switches)
+    ttft p50/p95        time from sending a question to the first answer token leaving the fake API
+    CPU s/user          process CPU time of the level, without the fake API, per user
+    MB/user             peak resident memory above the level's baseline, per user
+
+A level whose latencies grow much faster than its user count is past what one process handles.
+
+Usage: python scripts/loadtest.py [--users 1 5 10 20] [--questions 3] [--pdfs 2] [--pages 5]
+                                  [--first-token 0.3] [--token-interval 0.02] [--embed-latency 0.05]
+                                  [--backend numpy] [--think 0] [--workdir DIR]
+"""
+import argparse
+import io
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib import parse
+
+import yaml
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "scripts"))
+
+from fake_cohere import FakeCohere  # noqa: E402
+
+DOCS_CHAT_PAGE = ROOT / "docmind" / "pages" / "docs_chat.py"
+PASSWORD = "load-test"
+QUESTIONS = ["How long is the warranty?", "What does the warranty cover?", "When are returns accepted?",
+             "Who pays for the shipping of a repair?", "Which parts wear out first?"]
+WORDS = ("pump valve seal motor gear belt filter hose clamp bearing shaft rotor sensor relay fuse panel "
+         "switch cable boiler burner nozzle tank gauge spring lever bracket gasket flange piston").split()
+
+
+def percentile(values: List[float], share: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(share * len(values)))]
+
+
+def rss_bytes() -> int:
+    """Resident memory of this process, the peak so far where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class MemorySampler:
+    """Samples the resident memory in the background and keeps the peak."""
+
+    def __init__(self, interval: float = 0.1):
+        self.interval = interval
+        self.peak = rss_bytes()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name="rss-sampler", daemon=True)
+
+    def _sample(self):
+        while not self._stopped.wait(self.interval):
+            self.peak = max(self.peak, rss_bytes())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stopped.set()
+        self._thread.join()
+        self.peak = max(self.peak, rss_bytes())
+
+
+class UploadedPdf(io.BytesIO):
+    """Stands in for the UploadedFile the file uploader hands the page."""
+
+    def __init__(self, name: str, content: bytes):
+        super().__init__(content)
+        self.name = name
+        self.size = len(content)
+
+
+def make_pdf(seed: str, pages: int) -> bytes:
+    import fitz
+
+    rng = random.Random(seed)
+    document = fitz.open()
+    for _ in range(pages):
+        page = document.new_page()
+        for line in range(20):
+            page.insert_text((72, 72 + 30 * line), " ".join(rng.choice(WORDS) for _ in range(12)))
+    return document.tobytes()
+
+
+def session_test_class():
+    """
+    AppTest installs a mock runtime for the duration of every run and removes it afterwards, which
+    breaks the runs of the other sessions. This variant leaves the runtime to `install_runtime`,
+    so sessions run in parallel like on a server.
+    """
+    from streamlit.testing.v1 import AppTest
+    from streamlit.testing.v1.local_script_runner import LocalScriptRunner
+
+    class SessionTest(AppTest):
+        def _run(self, widget_state=None, timeout: Optional[float] = None):
+            runner = LocalScriptRunner(self._script_path, self.session_state, args=self.args, kwargs=self.kwargs)
+            self._tree = runner.run(widget_state, self.query_params, timeout or self.default_timeout,
+                                    self._page_hash)
+            self._tree._runner = self
+            self.query_params = parse.parse_qs(runner.event_data[-1]["client_state"].query_string)
+            return self
+
+    return SessionTest
+
+
+def install_runtime() -> None:
+    from unittest.mock import MagicMock
+
+    from streamlit import config
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import (
+        MemoryCacheStorageManager,
+    )
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime._instance = runtime
+    config.set_option("global.appTest", True)
+
+
+class SimulatedUser:
+    def __init__(self, session_class, username: str, fake: FakeCohere, args: argparse.Namespace):
+        self.username = username
+        self.fake = fake
+        self.args = args
+        self.app = session_class(str(DOCS_CHAT_PAGE), default_timeout=args.timeout)
+        self.reruns: List[float] = []
+        self.ttft: List[float] = []
+        self.errors: List[str] = []
+        self._questions = 0
+
+    def rerun(self, action) -> float:
+        start = time.perf_counter()
+        action()
+        elapsed = time.perf_counter() - start
+        self.reruns.append(elapsed)
+        if self.app.exception:
+            raise RuntimeError(self.app.exception[0].message)
+        if self.args.think:
+            time.sleep(self.args.think)
+        return elapsed
+
+    def widget(self, elements, label: str):
+        for element in elements:
+            if element.label == label:
+                return element
+        raise RuntimeError(f"No widget {label!r} on the page of {self.username}")
+
+    def login(self):
+        self.rerun(self.app.run)
+        self.widget(self.app.text_input, "Username").input(self.username)
+        self.widget(self.app.text_input, "Password").input(PASSWORD)
+        self.rerun(self.widget(self.app.button, "Login").click().run)
+        if not self.app.session_state["authentication_status"]:
+            raise RuntimeError(f"{self.username} could not log in")
+
+    def upload(self):
+        self.app.session_state["uploaded_docs"] = [
+            UploadedPdf(f"{self.username}-{number}.pdf", make_pdf(f"{self.username}-{number}", self.args.pages))
+            for number in range(self.args.pdfs)]
+        self.app.session_state["activate_uploader"] = False
+        self.rerun(self.app.run)
+        self.rerun(self.widget(self.app.button, "Process docs").click().run)
+
+    def ask(self):
+        tag = f"{self.username}-{self._questions}"
+        question = f"{QUESTIONS[self._questions % len(QUESTIONS)]} [lt:{tag}]"
+        self._questions += 1
+        sent = time.time()
+        self.rerun(self.app.chat_input[0].set_value(question).run)
+        # the last stream of the question is the answer, the earlier ones condensed the question
+        first_tokens = self.fake.first_tokens.get(tag)
+        if first_tokens:
+            self.ttft.append(max(first_tokens) - sent)
+
+    def switch_chats(self):
+        previous = self.app.session_state["selected_chat"]
+        self.rerun(self.widget(self.app.button, "New Chat").click().run)
+        self.ask()
+        self.rerun(self.widget(self.app.selectbox, "Load previous chat:").select(previous).run)
+
+    def run(self):
+        try:
+            self.login()
+            self.upload()
+            for _ in range(self.args.questions):
+                self.ask()
+            self.switch_chats()
+        except Exception as error:
+            self.errors.append(f"{type(error).__name__}: {str(error).splitlines()[0]}")
+
+
+def run_level(session_class, fake: FakeCohere, users: int, level: str, args: argparse.Namespace) -> Dict:
+    simulated = [SimulatedUser(session_class, f"{level}-{number}", fake, args) for number in range(users)]
+    threads = [threading.Thread(target=user.run, name=user.username) for user in simulated]
+    baseline, cpu, fake_cpu = rss_bytes(), time.process_time(), fake.cpu_time()
+    with MemorySampler() as memory:
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu - (fake.cpu_time() - fake_cpu)
+    reruns = [value for user in simulated for value in user.reruns]
+    ttft = [value for user in simulated for value in user.ttft]
+    errors = [f"{user.username}: {error}" for user in simulated for error in user.errors]
+    return {
+        "users": users, "reruns": len(reruns), "seconds": elapsed,
+        "p50": percentile(reruns, 0.5), "p95": percentile(reruns, 0.95), "p99": percentile(reruns, 0.99),
+        "ttft_p50": percentile(ttft, 0.5), "ttft_p95": percentile(ttft, 0.95),
+        "cpu_per_user": cpu / users, "mb_per_user": max(0, memory.peak - baseline) / users / 2 ** 20,
+        "errors": errors,
+    }
+
+
+def prepare_workdir(workdir: Path, usernames: List[str], backend: str) -> None:
+    """The credentials of the simulated users and the project configuration, DocMind runs from `workdir`."""
+    (workdir / "logs").mkdir(parents=True, exist_ok=True)
+    (workdir / "authenticator_config.yaml").write_text(yaml.dump({
+        "cookie": {"expiry_days": 30, "key": "load-test", "name": "docmind-load-test"},
+        "credentials": {"usernames": {name: {"email": f"{name}@example.com", "name": name, "password": PASSWORD}
+                                      for name in usernames}},
+        "pre-authorized": {"emails": []},
+    }))
+    (workdir / "config.yaml").write_text(yaml.dump({"vectorstore_backend": backend,
+                                                    "log_path": str(workdir / "logs")}))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 5, 10, 20], help="concurrent users per level")
+    parser.add_argument("--questions", type=int, default=3, help="questions every user asks in its first chat")
+    parser.add_argument("--pdfs", type=int, default=2, help="PDFs every user uploads")
+    parser.add_argument("--pages", type=int, default=5, help="pages per PDF")
+    parser.add_argument("--first-token", type=float, default=0.3, help="seconds the fake API takes to answer")
+    parser.add_argument("--token-interval", type=float, default=0.02, help="seconds between answer tokens")
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="seconds per embed and rerank call")
+    parser.add_argument("--dim", type=int, default=1024, help="embedding dimension of the fake API")
+    parser.add_argument("--backend", default="numpy", choices=["chroma", "numpy"])
+    parser.add_argument("--think", type=float, default=0.0, help="seconds a user waits between interactions")
+    parser.add_argument("--timeout", type=float, default=300.0, help="seconds a single rerun may take")
+    parser.add_argument("--workdir", type=Path, default=None, help="where user data is written, a temporary "
+                                                                   "directory by default")
+    args = parser.parse_args()
+
+    workdir = (args.workdir or Path(tempfile.mkdtemp(prefix="docmind-loadtest-"))).resolve()
+    levels = [("warmup", 1)] + [(f"u{users}", users) for users in args.users]
+    prepare_workdir(workdir, [f"{level}-{number}" for level, users in levels for number in range(users)],
+                    args.backend)
+
+    fake = FakeCohere(args.embed_latency, args.first_token, args.token_interval, args.dim)
+    # the Cohere SDK, the credentials store and the relative user_data paths are set up before DocMind loads
+    os.environ.update(CO_API_URL=fake.start_in_thread(), COHERE_API_KEY="fake",
+                      DOCMIND_AUTH_STORE=str(workdir / "authenticator_config.yaml"))
+    os.chdir(workdir)
+    install_runtime()
+    session_class = session_test_class()
+
+    print(f"Working in {workdir}, backend {args.backend}, {args.pdfs} PDFs of {args.pages} pages and "  # noqa: T201
+          f"{args.questions + 1} questions per user")
+    print(f"{'users':>6}{'reruns':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'ttft p50':>10}{'ttft p95':>10}"  # noqa: T201
+          f"{'CPU s/user':>12}{'MB/user':>9}{'errors':>8}")
+    failed = False
+    for level, users in levels:
+        result = run_level(session_class, fake, users, level, args)
+        for error in result["errors"][:3]:
+            print(f"  {error}")  # noqa: T201
+        failed = failed or bool(result["errors"])
+        if level == "warmup":
+            continue
+        print(f"{users:>6}{result['reruns']:>8}{result['p50'] * 1000:>9.0f}{result['p95'] * 1000:>9.0f}"  # noqa: T201
+              f"{result['p99'] * 1000:>9.0f}{result['ttft_p50'] * 1000:>10.0f}{result['ttft_p95'] * 1000:>10.0f}"
+              f"{result['cpu_per_user']:>12.2f}{result['mb_per_user']:>9.1f}{len(result['errors']):>8}")
+    fake.stop()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+import json
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import fitz
+import yaml
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models import FakeListChatModel
+from tornado.testing import AsyncHTTPTestCase
+
+from docmind.api.jobs import DONE, QUEUED, RUNNING, JobManager
+from docmind.api.server import API_PREFIX, DocMindService, make_app
+from docmind.auth.store import YamlCredentialsStore
+from docmind.utils.config import ProjectConfiguration
+from docmind.utils.usage import UsageLedger
+
+
+def pdf_bytes(*pages: str) -> bytes:
+    document = fitz.open()
+    for text in pages:
+        document.new_page().insert_text((72, 72), text)
+    return document.tobytes()
+
+
+def multipart(files):
+    boundary = uuid.uuid4().hex
+    body = b""
+    for name, content in files:
+        body += (f"--{boundary}\r\nContent-Disposition: form-data; name=\"files\"; filename=\"{name}\"\r\n"
+                 f"Content-Type: application/pdf\r\n\r\n").encode() + content + b"\r\n"
+    return body + f"--{boundary}--\r\n".encode(), f"multipart/form-data; boundary={boundary}"
+
+
+class ApiTest(AsyncHTTPTestCase):
+    def get_app(self):
+        self.directory = Path(tempfile.mkdtemp())
+        credentials_path = self.directory / "authenticator_config.yaml"
+        credentials_path.write_text(yaml.dump({
+            "cookie": {"expiry_days": 30, "key": "test-key", "name": "docmind"},
+            "credentials": {"usernames": {name: {"email": f"{name}@example.com", "name": name, "password": "secret"}
+                                          for name in ("alice", "bob")}},
+            "pre-authorized": {"emails": []},
+        }))
+        config = ProjectConfiguration(vectorstore_backend="numpy", api_ingest_workers=1, api_query_workers=2)
+        self.service = DocMindService(
+            config, YamlCredentialsStore(credentials_path), user_data_root=self.directory / "user_data",
+            ledger=UsageLedger(self.directory / "usage.db"),
+            embedding_factory=lambda model, username: DeterministicFakeEmbedding(size=16),
+            llm_factory=lambda model, username, temperature, max_tokens: FakeListChatModel(
+                responses=["The warranty lasts two years [1]."]))
+        return make_app(self.service)
+
+    def tearDown(self):
+        self.service.close()
+        super().tearDown()
+
+    def token(self, username="alice", password="secret") -> str:
+        response = self.fetch(f"{API_PREFIX}/token", method="POST",
+                              body=json.dumps({"username": username, "password": password}), raise_error=False)
+        return json.loads(response.body).get("token")
+
+    def call(self, path, token, **kwargs):
+        kwargs.setdefault("headers", {})["Authorization"] = f"Bearer {token}"
+        response = self.fetch(f"{API_PREFIX}{path}", raise_error=False, **kwargs)
+        return response.code, response.body
+
+    def wait_for(self, job_id, token):
+        for _ in range(200):
+            job = json.loads(self.call(f"/jobs/{job_id}", token)[1])["job"]
+            if job["status"] in ("done", "failed"):
+                return job
+            time.sleep(0.05)
+        raise AssertionError(f"job {job_id} did not finish")
+
+    def test_requests_need_a_valid_token(self):
+        assert self.token(password="wrong") is None
+        assert self.fetch(f"{API_PREFIX}/documents", raise_error=False).code == 401
+        assert self.call("/documents", "forged")[0] == 401
+
+    def test_ingest_list_ask_and_delete(self):
+        alice, bob = self.token(), self.token("bob")
+        body, content_type = multipart([("manual.pdf", pdf_bytes("The warranty lasts two years.",
+                                                                 "Returns are accepted for 30 days."))])
+        code, response = self.call("/documents", alice, method="POST", body=body,
+                                   headers={"Content-Type": content_type})
+        assert code == 202
+        job_id = json.loads(response)["job"]["id"]
+        # jobs are private to their user
+        assert self.call(f"/jobs/{job_id}", bob)[0] == 404
+        job = self.wait_for(job_id, alice)
+        assert job["status"] == "done" and job["result"]["files"] == ["manual.pdf"] and job["result"]["chunks"] == 2
+        assert json.loads(self.call("/documents", alice)[1])["documents"] == [{"name": "manual.pdf"}]
+        assert json.loads(self.call("/documents", bob)[1])["documents"] == []
+
+        code, stream = self.call("/ask", alice, method="POST",
+                                 body=json.dumps({"question": "How long is the warranty?"}))
+        events = [block.split("\n", 1) for block in stream.decode().strip().split("\n\n")]
+        assert code == 200 and events[-1][0] == "event: done"
+        answer = "".join(json.loads(data[len("data: "):]) for event, data in events if event == "event: token")
+        assert answer == "The warranty lasts two years [1]."
+
+        code, response = self.call("/documents/manual.pdf", alice, method="DELETE")
+        assert code == 200 and json.loads(response)["chunks"] == 2
+        assert self.service.store("alice").count() == 0
+        assert self.call("/documents/manual.pdf", alice, method="DELETE")[0] == 404
+
+
+def test_queued_jobs_of_a_user_do_not_hold_workers():
+    jobs = JobManager(max_workers=2)
+    release = threading.Event()
+    try:
+        first = jobs.submit("alice", "ingest", lambda job: release.wait(5) and {})
+        second = jobs.submit("alice", "ingest", lambda job: {"order": first.status})
+        bob = jobs.submit("bob", "ingest", lambda job: {})
+        for _ in range(100):
+            if bob.status == DONE:
+                break
+            time.sleep(0.01)
+        # bob got the second worker while alice's second job waits for her first one
+        assert (first.status, second.status, bob.status) == (RUNNING, QUEUED, DONE)
+    finally:
+        release.set()
+        jobs.shutdown()
+    assert second.status == DONE and second.result == {"order": DONE}
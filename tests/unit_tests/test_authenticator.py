@@ -0,0 +1,36 @@
+from docmind.auth.authenticator import (
+    UsernameValidator,
+    get_authentication_handler,
+    invalidate_authentication_handler,
+    prehash_credentials,
+)
+from docmind.auth.store import YamlCredentialsStore
+
+
+def test_prehash_credentials_hashes_plaintext_once():
+    credentials = {"usernames": {"Alice": {"name": "alice", "password": "secret", "email": "a@a.com"}}}
+    assert prehash_credentials(credentials) is True
+
+    user = credentials["usernames"]["alice"]
+    assert user["password"].startswith("$2")
+    assert user["logged_in"] is False
+    assert user["failed_login_attempts"] == 0
+    assert prehash_credentials(credentials) is False
+
+
+def test_authentication_handler_is_shared_until_invalidated(tmp_path):
+    store = YamlCredentialsStore(tmp_path / "auth.yaml")
+    handler = get_authentication_handler(store)
+    assert get_authentication_handler(store) is handler
+    assert store.load()["credentials"]["usernames"]["docmind"]["password"].startswith("$2")
+
+    invalidate_authentication_handler(store)
+    assert get_authentication_handler(store) is not handler
+
+
+def test_usernames_of_application_folders_cannot_be_registered(tmp_path):
+    handler = get_authentication_handler(YamlCredentialsStore(tmp_path / "auth.yaml"))
+    assert isinstance(handler.validator, UsernameValidator)
+    assert handler.validator.validate_username("alice_2")
+    # the shared corpora live in user_data/_shared_corpora
+    assert not handler.validator.validate_username("_shared_corpora")
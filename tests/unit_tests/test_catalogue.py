@@ -0,0 +1,73 @@
+import json
+import time
+from types import SimpleNamespace
+
+from docmind.llm.catalogue import FALLBACK_MODELS, ModelCatalogue
+
+
+class StubClient:
+    def __init__(self, names, fail=False):
+        self.calls = 0
+        self.names = names
+        self.fail = fail
+        self.models = self
+
+    def list(self):
+        self.calls += 1
+        if self.fail:
+            raise ConnectionError("API unavailable")
+        return SimpleNamespace(models=[
+            SimpleNamespace(name=name, context_length=4096, endpoints=["chat", "generate"]) for name in self.names
+        ])
+
+
+def test_first_get_fetches_and_persists(tmp_path):
+    client = StubClient(["command-r"])
+    catalogue = ModelCatalogue(tmp_path / "models.json", client_factory=lambda: client)
+
+    assert catalogue.get() == {"command-r": {"context_length": 4096, "endpoints": ["chat", "generate"]}}
+    assert catalogue.get() == catalogue.get()
+    assert client.calls == 1
+    assert "command-r" in json.loads((tmp_path / "models.json").read_text())["models"]
+
+
+def test_cached_catalogue_is_served_without_api(tmp_path):
+    ModelCatalogue(tmp_path / "models.json", client_factory=lambda: StubClient(["command-r"])).get()
+
+    client = StubClient([], fail=True)
+    catalogue = ModelCatalogue(tmp_path / "models.json", client_factory=lambda: client)
+    assert "command-r" in catalogue.get()
+    assert client.calls == 0
+
+
+def test_stale_catalogue_is_refreshed_in_background(tmp_path):
+    ModelCatalogue(tmp_path / "models.json", client_factory=lambda: StubClient(["command-r"])).get()
+
+    client = StubClient(["command-r-plus"])
+    catalogue = ModelCatalogue(tmp_path / "models.json", ttl=0, client_factory=lambda: client)
+    time.sleep(0.01)
+    assert "command-r" in catalogue.get()
+    catalogue.wait_for_refresh(timeout=5)
+    assert "command-r-plus" in catalogue.get()
+
+
+def test_failed_refresh_keeps_last_known_catalogue(tmp_path):
+    ModelCatalogue(tmp_path / "models.json", client_factory=lambda: StubClient(["command-r"])).get()
+
+    catalogue = ModelCatalogue(tmp_path / "models.json", ttl=0, client_factory=lambda: StubClient([], fail=True))
+    catalogue.get()
+    catalogue.wait_for_refresh(timeout=5)
+    assert "command-r" in catalogue.get()
+
+
+def test_fallback_without_cache_and_api(tmp_path):
+    client = StubClient(["command-r"], fail=True)
+    catalogue = ModelCatalogue(tmp_path / "models.json", client_factory=lambda: client)
+    assert catalogue.get() == FALLBACK_MODELS
+
+    # later calls do not wait for the API, the fetch is retried in the background once its delay passed
+    assert catalogue.get() == FALLBACK_MODELS and client.calls == 1
+    client.fail, catalogue._retry_at = False, 0.0
+    assert catalogue.get() == FALLBACK_MODELS
+    catalogue.wait_for_refresh(timeout=5)
+    assert "command-r" in catalogue.get() and client.calls == 2
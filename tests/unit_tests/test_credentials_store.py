@@ -0,0 +1,60 @@
+import yaml
+
+from docmind.auth.store import (
+    DEFAULT_AUTH_CONFIG,
+    SqliteCredentialsStore,
+    YamlCredentialsStore,
+    get_credentials_store,
+)
+
+
+def test_yaml_store_creates_default_config(tmp_path):
+    store = YamlCredentialsStore(tmp_path / "auth.yaml")
+    config = store.load()
+    assert config == DEFAULT_AUTH_CONFIG
+    assert (tmp_path / "auth.yaml").is_file()
+
+
+def test_yaml_store_writes_only_on_change(tmp_path):
+    path = tmp_path / "auth.yaml"
+    store = YamlCredentialsStore(path)
+    config = store.load()
+    assert store.save() is False
+
+    config["credentials"]["usernames"]["docmind"]["failed_login_attempts"] = 1
+    assert store.save() is True
+    assert store.save() is False
+    assert yaml.safe_load(path.read_text())["credentials"]["usernames"]["docmind"]["failed_login_attempts"] == 1
+
+
+def test_yaml_store_merges_users_from_other_processes(tmp_path):
+    path = tmp_path / "auth.yaml"
+    first, second = YamlCredentialsStore(path), YamlCredentialsStore(path)
+    first_config, second_config = first.load(), second.load()
+
+    first_config["credentials"]["usernames"]["alice"] = {"name": "alice", "password": "x", "email": "a@a.com"}
+    first.save()
+    second_config["credentials"]["usernames"]["bob"] = {"name": "bob", "password": "y", "email": "b@b.com"}
+    second.save()
+
+    users = yaml.safe_load(path.read_text())["credentials"]["usernames"]
+    assert {"docmind", "alice", "bob"} <= set(users)
+    assert "alice" in second_config["credentials"]["usernames"]
+
+
+def test_sqlite_store_round_trip(tmp_path):
+    path = tmp_path / "auth.db"
+    store = SqliteCredentialsStore(path)
+    config = store.load()
+    config["credentials"]["usernames"]["alice"] = {"name": "alice", "password": "x", "email": "a@a.com"}
+    assert store.save() is True
+    store.close()
+
+    reloaded = SqliteCredentialsStore(path).load()
+    assert reloaded["cookie"] == DEFAULT_AUTH_CONFIG["cookie"]
+    assert set(reloaded["credentials"]["usernames"]) == {"docmind", "alice"}
+
+
+def test_store_is_shared_per_path(tmp_path):
+    assert get_credentials_store(tmp_path / "auth.yaml") is get_credentials_store(tmp_path / "auth.yaml")
+    assert isinstance(get_credentials_store(tmp_path / "auth.sqlite"), SqliteCredentialsStore)
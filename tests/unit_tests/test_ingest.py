@@ -0,0 +1,267 @@
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional, Set
+
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_text_splitters import CharacterTextSplitter
+
+from docmind.ingest.cleaning import BoilerplateStripper, ChunkDeduplicator
+from docmind.ingest.indexer import STARTED, BulkIndexer, file_hash, find_files
+from docmind.ingest.pipeline import IngestPipeline, prefetch
+from docmind.ingest.watcher import DropFolder
+from docmind.upload_and_process_files import (
+    GetRetriever,
+    delete_document,
+    documents_filter,
+)
+from docmind.vectorstore.factory import create_vectorstore
+from docmind.vectorstore.numpy_store import NumpyStore
+
+
+def fake_parser(pages_per_file: int, parsed: Optional[List[int]] = None):
+    def parse(path: Path):
+        for page in range(pages_per_file):
+            if parsed is not None:
+                parsed.append(page)
+            yield Document(page_content="" if page == 0 else f"{path.stem} page {page}",
+                           metadata={"source": path.name, "page": page})
+    return parse
+
+
+@pytest.fixture
+def files(tmp_path):
+    paths = []
+    for name in ("a", "b", "c"):
+        path = tmp_path / f"{name}.pdf"
+        path.write_bytes(b"%PDF")
+        paths.append(path)
+    return paths
+
+
+def test_pipeline_streams_batches_into_the_store(tmp_path, files):
+    store = NumpyStore(tmp_path / "vectors", DeterministicFakeEmbedding(size=8))
+    parsed, searchable = [], []
+    pipeline = IngestPipeline(store, batch_size=4, queue_size=1, parser=fake_parser(40, parsed))
+    stats = pipeline.run(files, on_batch=lambda running: searchable.append((len(parsed), store.count())))
+
+    # the empty first page of every file is dropped
+    assert (stats.files, stats.pages, stats.chunks) == (3, 120, 117)
+    assert stats.processed_files == files
+    assert store.count() == 117
+    # the first batch is searchable while parsing is at most a few batches ahead, in the first file
+    assert searchable[0][1] == 4
+    assert searchable[0][0] <= 8 * 4
+
+
+def test_pipeline_splits_pages(tmp_path, files):
+    store = NumpyStore(tmp_path / "vectors", DeterministicFakeEmbedding(size=8))
+    splitter = CharacterTextSplitter(separator=" ", chunk_size=4, chunk_overlap=0)
+    stats = IngestPipeline(store, splitter=splitter, parser=fake_parser(2)).run(files[:1])
+    assert stats.chunks == 3
+    assert {doc.page_content for doc, _ in store.search("a page 1", k=3)} == {"a", "page", "1"}
+
+
+def test_prefetch_is_bounded_and_stops_early():
+    produced = []
+
+    def numbers():
+        for i in range(1000):
+            produced.append(i)
+            yield i
+
+    items = prefetch(numbers(), maxsize=2)
+    assert next(items) == 0
+    items.close()
+    # the consumer took one item, the producer is at most a full queue and one item ahead
+    assert len(produced) <= 4
+    assert not [thread for thread in threading.enumerate() if thread.name == "docmind-prefetch"]
+
+
+def test_prefetch_raises_errors_of_the_producer():
+    def failing():
+        yield 1
+        raise RuntimeError("parse failed")
+
+    with pytest.raises(RuntimeError, match="parse failed"):
+        list(prefetch(failing()))
+
+
+def manual_parser(pages: List[str]):
+    def parse(path: Path):
+        for number, text in enumerate(pages):
+            yield Document(page_content=text, metadata={"source": path.name, "page": number})
+    return parse
+
+
+def test_boilerplate_is_stripped_from_every_page():
+    topics = ["pumps", "valves", "seals", "motors", "filters", "gears", "belts", "fans", "pipes", "tanks", "hoses",
+              "wires"]
+    pages = [Document(page_content=f"ACME Corp confidential\nThis section covers {topic}.\nPage {i} of 12",
+                      metadata={"source": "a.pdf"}) for i, topic in enumerate(topics)]
+    stripper = BoilerplateStripper(window=4)
+    stripped = list(stripper.strip(pages))
+    assert [doc.page_content for doc in stripped[:2]] == ["This section covers pumps.", "This section covers valves."]
+    assert all("ACME" not in doc.page_content and "Page" not in doc.page_content for doc in stripped)
+    assert stripper.removed_lines == 24 and stripper.removed_tokens > 0
+
+
+def test_near_duplicates_are_skipped_across_runs(tmp_path, files):
+    text = " ".join(f"word{i}" for i in range(200))
+    revised = text.replace("word100", "changed")
+    store = NumpyStore(tmp_path / "vectors", DeterministicFakeEmbedding(size=8))
+    dedup = ChunkDeduplicator(tmp_path / "dedup.db")
+    stats = IngestPipeline(store, deduplicator=dedup, parser=manual_parser([text, revised, "something else"])) \
+        .run(files[:1])
+    assert (stats.chunks, stats.duplicates) == (2, 1)
+    assert stats.tokens_saved > 0
+    dedup.close()
+
+    # a revision uploaded later under another name is recognized from the persisted signatures
+    dedup = ChunkDeduplicator(tmp_path / "dedup.db")
+    stats = IngestPipeline(store, deduplicator=dedup, parser=manual_parser([revised, "another page"])).run(files[1:2])
+    assert (stats.chunks, stats.duplicates) == (1, 1)
+    assert store.count() == 3
+    dedup.clear()
+    assert dedup.check(text, {"source": "a.pdf"}) is not None
+
+
+@pytest.mark.parametrize("backend, sharding", [("numpy", None), ("numpy", "document"), ("chroma", None)])
+def test_chunks_repeated_by_other_documents_are_kept_until_the_last_one_is_deleted(tmp_path, files, backend, sharding):
+    text, other = (" ".join(f"{word}{i}" for i in range(200)) for word in ("word", "other"))
+    pages = {"a.pdf": [text, "only in a"], "b.pdf": [other, text], "c.pdf": [other]}
+
+    def parse(path: Path):
+        for number, page in enumerate(pages[path.name]):
+            yield Document(page_content=page, metadata={"source": path.name, "page": number})
+
+    (tmp_path / "store").mkdir()
+    store = create_vectorstore("alice", tmp_path / "store", DeterministicFakeEmbedding(size=8), backend=backend,
+                               sharding=sharding)
+    for group in (files[:1], files[1:]):
+        dedup = ChunkDeduplicator(tmp_path / "dedup.db")
+        stats = IngestPipeline(store, deduplicator=dedup, parser=parse).run(group)
+        dedup.close()
+    # b.pdf repeats a page of a.pdf and c.pdf one of b.pdf, neither is embedded again
+    assert (stats.chunks, stats.duplicates) == (1, 2) and store.count() == 3
+
+    def found(source: str) -> Set[str]:
+        retriever = GetRetriever(vectorstore=store, filter_criteria=documents_filter(tmp_path, [source]))
+        return {doc.page_content for doc in retriever.get_retriever().invoke(text)}
+
+    assert found("b.pdf") == {text, other} and found("c.pdf") == {other}
+
+    # the pages repeated by a document move to it when their own document is deleted
+    assert delete_document(store, tmp_path, "a.pdf") == 1
+    assert found("b.pdf") == {text, other} and found("a.pdf") == set()
+    assert [doc.metadata["page"] for doc, _ in store.search(text, k=1, filter={"source": "b.pdf"})] == [1]
+    assert delete_document(store, tmp_path, "b.pdf") == 1
+    assert found("c.pdf") == {other} and store.count() == 1
+    assert delete_document(store, tmp_path, "c.pdf") == 1 and store.count() == 0
+
+
+def test_deduplicator_matches_chunks_recorded_per_document_across_documents(tmp_path):
+    dedup = ChunkDeduplicator(tmp_path / "dedup.db")
+    texts = [" ".join(f"{word}{i}" for i in range(200)) for word in ("word", "other")]
+    signatures = [dedup.signature(text) for text in texts]
+    dedup.close()
+    # the bands of the chunks recorded while duplicates were only looked for within their document
+    with sqlite3.connect(str(tmp_path / "dedup.db")) as conn:
+        conn.execute("DROP TABLE signatures")
+        conn.execute("DROP TABLE bands")
+        conn.execute("CREATE TABLE signatures (chunk_id TEXT PRIMARY KEY, signature BLOB NOT NULL)")
+        conn.execute("CREATE TABLE bands (band INTEGER NOT NULL, bucket TEXT NOT NULL, chunk_id TEXT NOT NULL, "
+                     "source TEXT)")
+        for chunk_id, signature, source in zip(["1", "2"], signatures, [None, "a.pdf"]):
+            conn.execute("INSERT INTO signatures VALUES (?, ?)", (chunk_id, signature.tobytes()))
+            buckets = enumerate(dedup._buckets(signature))
+            conn.executemany("INSERT INTO bands VALUES (?, ?, ?, ?)",
+                             [(band, bucket, chunk_id, source) for band, bucket in buckets])
+    conn.close()
+
+    dedup = ChunkDeduplicator(tmp_path / "dedup.db")
+    assert dedup.check(texts[0], {"source": "b.pdf"}) is None and dedup.check(texts[1], {"source": "b.pdf"}) is None
+    assert dedup.check(texts[1], {"source": "a.pdf"}) is None
+    assert dedup.source_filter(["b.pdf"]) == {"$or": [{"source": {"$in": ["b.pdf"]}},
+                                                      {"chunk_id": {"$in": ["1", "2"]}}]}
+    assert dedup.source_filter(["a.pdf"]) == {"source": {"$in": ["a.pdf"]}}
+    dedup.close()
+
+
+def text_parser(path: Path):
+    """One page per line, picklable for the parsing processes."""
+    for number, line in enumerate(path.read_text().splitlines()):
+        yield Document(page_content=line, metadata={"source": path.name, "page": number})
+
+
+def test_bulk_indexer_parses_in_processes_and_resumes(tmp_path):
+    archive = tmp_path / "archive"
+    (archive / "2023").mkdir(parents=True)
+    for name in ("a", "b", "c"):
+        (archive / "2023" / f"{name}.pdf").write_text("\n".join(f"{name} covers {topic}" for topic in
+                                                                ("pumps", "valves", "seals", "motors", "gears")))
+    (archive / "notes.txt").write_text("not a pdf")
+    user_dir = tmp_path / "alice"
+    store = NumpyStore(user_dir / "vectors", DeterministicFakeEmbedding(size=8))
+    files = find_files([str(archive)])
+    assert [path.name for path in files] == ["a.pdf", "b.pdf", "c.pdf"]
+
+    indexer = BulkIndexer(store, user_dir, parse_workers=2, embed_workers=2, batch_size=4, group_size=2,
+                          parser=text_parser)
+    report = indexer.run(files)
+    assert (report.files, report.pages, report.chunks) == (3, 15, 15)
+    assert sorted(path.name for path in (user_dir / "reference").iterdir()) == ["a.pdf", "b.pdf", "c.pdf"]
+
+    # unchanged files are skipped, a changed one replaces its previous chunks
+    (archive / "2023" / "b.pdf").write_text("b revised")
+    report = indexer.run(find_files([str(archive / "**" / "*.pdf")]))
+    assert (report.files, report.skipped, report.replaced) == (1, 2, 1)
+    assert store.count() == 11 and len(store.ids_where({"source": "b.pdf"})) == 1
+
+    # a group left half done by an interrupted run is indexed again from scratch
+    indexer.manifest.mark([(files[0], file_hash(files[0]))], STARTED)
+    report = indexer.run(files)
+    assert (report.files, report.skipped) == (1, 2)
+    assert store.count() == 11
+    indexer.close()
+    store.close()
+
+
+def test_drop_folder_syncs_additions_changes_and_deletions(tmp_path):
+    drop = tmp_path / "drop"
+    drop.mkdir()
+    user_dir = tmp_path / "alice"
+    store = NumpyStore(user_dir / "vectors", DeterministicFakeEmbedding(size=8))
+    folder = DropFolder(drop, BulkIndexer(store, user_dir, parser=text_parser), debounce=10)
+
+    manual = drop / "manual.pdf"
+    manual.write_text("pumps\nvalves\nseals")
+    folder.notify(manual)
+    folder.notify(drop / "manual.pdf.part")
+    # events are held back until the file stayed quiet for the debounce period
+    assert folder.due() == []
+    paths = folder.due(now=time.monotonic() + 10)
+    assert paths == [manual.resolve()] and folder.due(now=time.monotonic() + 10) == []
+    folder.sync(paths)
+    assert store.count() == 3
+
+    manual.write_text("pumps\nmotors")
+    folder.sync([manual.resolve()])
+    assert len(store.ids_where({"source": "manual.pdf"})) == 2
+
+    manual.unlink()
+    folder.sync([manual.resolve()])
+    assert store.count() == 0 and folder.indexer.manifest.path("manual.pdf") is None
+
+    # files added and removed while nobody watched are caught up with on start
+    (drop / "gears.pdf").write_text("gears\nbelts")
+    folder.reconcile()
+    assert store.count() == 2
+    (drop / "gears.pdf").unlink()
+    folder.reconcile()
+    assert store.count() == 0
+    folder.indexer.close()
+    store.close()
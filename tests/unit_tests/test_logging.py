@@ -1,10 +1,12 @@
 import io
+import json
 import logging
 import unittest
+from logging.handlers import QueueHandler
 from pathlib import Path
 from unittest.mock import patch
 
-from docmind.utils.log import LogConfig
+from docmind.utils.log import CustomFilters, JsonFormatter, LogConfig
 
 
 class TestLogConfig(unittest.TestCase):
@@ -32,7 +34,7 @@ class TestLogConfig(unittest.TestCase):
 
     def test_get_logger(self):
         """Test the get_logger method."""
-        with patch("logging.FileHandler"):
+        with patch("docmind.utils.log.RotatingFileHandler"):
             log = LogConfig()
             logger = log.get_logger()
             assert isinstance(logger, logging.Logger)
@@ -43,11 +45,38 @@ class TestLogConfig(unittest.TestCase):
         temp_log_file.touch()
         with patch.object(Path, "exists", return_value=True), patch.object(
                 Path, "unlink"
-        ) as mock_unlink, patch("logging.FileHandler"):
+        ) as mock_unlink, patch("docmind.utils.log.RotatingFileHandler"):
             log = LogConfig(log_file_path=temp_log_file, clean_log_file=True)
             log.get_logger()
             mock_unlink.assert_called_once()
 
+    def test_get_logger_configures_once(self):
+        """Test that repeated calls with the same configuration keep a single handler."""
+        with patch("docmind.utils.log.RotatingFileHandler") as mock_handler:
+            log = LogConfig(log_file_path="once.log", level="DEBUG")
+            log.get_logger()
+            log.get_logger()
+            LogConfig(log_file_path="once.log", level="DEBUG").get_logger()
+            mock_handler.assert_called_once()
+            queue_handlers = [h for h in logging.getLogger().handlers if isinstance(h, QueueHandler)]
+            self.assertEqual(len(queue_handlers), 1)
+
+    def test_custom_filters(self):
+        """Test that records are filtered by logger name and raw message."""
+        log_filter = CustomFilters(["watchdog.observers", "heartbeat"])
+        make_record = logging.getLogger("x").makeRecord
+        watchdog_record = make_record("watchdog.observers.inotify", logging.INFO, "", 0, "x", (), None)
+        self.assertFalse(log_filter.filter(watchdog_record))
+        self.assertFalse(log_filter.filter(make_record("app", logging.INFO, "", 0, "heartbeat %s", (1,), None)))
+        self.assertTrue(log_filter.filter(make_record("app", logging.INFO, "", 0, "hello %s", (1,), None)))
+
+    def test_json_formatter(self):
+        """Test that the JSON formatter emits one parsable object."""
+        record = logging.getLogger("app").makeRecord("app", logging.WARNING, "", 0, "hello %s", ("world",), None)
+        entry = json.loads(JsonFormatter().format(record))
+        self.assertEqual(entry["message"], "hello world")
+        self.assertEqual(entry["level"], "WARNING")
+
 
 if __name__ == '__main__':
     unittest.main()
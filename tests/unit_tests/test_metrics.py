@@ -0,0 +1,49 @@
+from typing import List
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.language_models import FakeListChatModel
+from langchain_core.retrievers import BaseRetriever
+
+from docmind.llm.callbacks import StageTimingCallback
+from docmind.llm.create_llm_chain import create_llm_with_retriever_chain
+from docmind.utils.metrics import MetricsRegistry, span
+
+
+class StaticRetriever(BaseRetriever):
+    docs: List[Document]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self.docs
+
+
+def test_span_records_histograms():
+    registry = MetricsRegistry()
+    with span("parse", registry=registry, documents=3) as parse_span:
+        parse_span.attributes["bytes"] = 2048
+
+    text = registry.to_prometheus()
+    assert 'docmind_stage_duration_seconds_count{stage="parse"} 1' in text
+    assert 'docmind_stage_documents_bucket{stage="parse",le="5"} 1' in text
+    assert 'docmind_stage_bytes_sum{stage="parse"} 2048' in text
+
+
+def test_stage_timing_callback_reports_rag_stages():
+    registry = MetricsRegistry()
+    retriever = StaticRetriever(docs=[Document(page_content="DocMind answers questions.",
+                                               metadata={"source": "a.pdf"})])
+    llm = FakeListChatModel(responses=["What does DocMind do?", "It answers questions [1]."])
+    chain = create_llm_with_retriever_chain(llm, retriever)
+
+    timings = StageTimingCallback(registry=registry)
+    answer = "".join(chain.stream(
+        {"question": "And what does it do?", "chat_history": [{"human": "Hi", "ai": "Hello"}]},
+        config={"callbacks": [timings]},
+    ))
+
+    assert answer == "It answers questions [1]."
+    stages = {row["stage"]: row for row in timings.breakdown()}
+    assert {"condense_question", "vector_search", "retrieval", "format_docs", "generate"} <= set(stages)
+    assert stages["vector_search"]["documents"] == 1
+    assert "first_token" in stages["generate"]
+    assert 'docmind_stage_duration_seconds_count{stage="generate"} 1' in registry.to_prometheus()
@@ -0,0 +1,38 @@
+import sys
+import threading
+import time
+
+from docmind.utils.profiling import RerunProfiler
+
+
+def slow_page():
+    time.sleep(0.05)
+
+
+def run_page(profiler: RerunProfiler):
+    profiler.start(sys._getframe())
+    slow_page()
+
+
+def test_profiler_writes_profile_when_run_ends(tmp_path):
+    profiler = RerunProfiler(tmp_path, "page", interval=0.001)
+    thread = threading.Thread(target=run_page, args=(profiler,))
+    thread.start()
+    thread.join()
+
+    assert profiler.wait(timeout=5)
+    folded = profiler.folded_path.read_text()
+    assert "run_page (test_profiling.py" in folded
+    assert "slow_page (test_profiling.py" in folded
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in folded.splitlines())
+    assert "allocation sites" in profiler.allocations_path.read_text()
+
+
+def test_profiler_retention(tmp_path):
+    for _ in range(3):
+        profiler = RerunProfiler(tmp_path, "page", interval=0.001, retention=2)
+        run_page(profiler)
+        assert profiler.wait(timeout=5)
+
+    assert len(list(tmp_path.glob("*.folded"))) == 2
+    assert len(list(tmp_path.glob("*.alloc.txt"))) == 2
@@ -0,0 +1,60 @@
+from typing import List
+
+from langchain_core.documents import Document
+from langchain_core.language_models import FakeListChatModel
+
+from docmind.llm.callbacks import StageTimingCallback
+from docmind.llm.create_llm_chain import create_llm_with_retriever_chain
+from docmind.llm.rerank import LexicalReranker, LocalReranker
+from docmind.utils.metrics import MetricsRegistry
+from tests.unit_tests.test_metrics import StaticRetriever
+
+DOCS = [
+    Document(page_content="The weather was mild in spring.", metadata={"source": "a.pdf"}),
+    Document(page_content="DocMind answers questions about documents.", metadata={"source": "b.pdf"}),
+    Document(page_content="DocMind stores documents.", metadata={"source": "c.pdf"}),
+]
+
+
+class CountingScorer:
+    def __init__(self):
+        self.batches: List[int] = []
+
+    def __call__(self, pairs):
+        self.batches.append(len(pairs))
+        return [len(text) for _, text in pairs]
+
+
+def test_lexical_reranker_keeps_top_n():
+    ranked = LexicalReranker().rerank("What questions does DocMind answer?", DOCS, top_n=2)
+
+    assert [doc.metadata["source"] for doc in ranked] == ["b.pdf", "c.pdf"]
+    assert ranked[0].metadata["relevance_score"] > ranked[1].metadata["relevance_score"]
+    assert "relevance_score" not in DOCS[1].metadata
+
+
+def test_scores_are_batched_and_cached():
+    scorer = CountingScorer()
+    reranker = LocalReranker(scorer, batch_size=2)
+
+    reranker.rerank("query", DOCS)
+    reranker.rerank("query", DOCS)
+    reranker.rerank("other query", DOCS[:1])
+
+    assert scorer.batches == [2, 1, 1]
+    assert len(reranker.cache) == 4
+
+
+def test_chain_sends_reranked_docs_to_the_prompt():
+    retriever = StaticRetriever(docs=DOCS)
+    llm = FakeListChatModel(responses=["It answers questions [1]."])
+    chain = create_llm_with_retriever_chain(llm, retriever, reranker=LexicalReranker(), top_n=1)
+
+    timings = StageTimingCallback(registry=MetricsRegistry())
+    answer = chain.invoke({"question": "What does DocMind answer?", "chat_history": []},
+                          config={"callbacks": [timings]})
+
+    assert answer == "It answers questions [1]."
+    stages = {row["stage"]: row for row in timings.breakdown()}
+    assert stages["vector_search"]["documents"] == 3
+    assert stages["rerank"]["documents"] == 1
@@ -0,0 +1,199 @@
+import asyncio
+import json
+import threading
+import time
+from typing import List, Tuple
+
+import pytest
+import tornado.httpserver
+import tornado.ioloop
+import tornado.netutil
+import tornado.web
+from langchain_core.messages import HumanMessage
+
+from docmind.llm.chat_models import DocMindChatCohere
+from docmind.llm.embeddings import DocMindCohereEmbeddings
+from docmind.llm.resilience import (
+    CircuitOpenError,
+    LLMUnavailableError,
+    ResilienceSettings,
+    StreamTimeoutError,
+    configure_resilience,
+    get_circuit_breaker,
+)
+from docmind.llm.scheduler import configure_scheduler
+
+TOKENS = ["The ", "warranty ", "lasts ", "two ", "years."]
+
+# a fault is (status, seconds to stall before the first token, seconds to stall after the first token)
+Fault = Tuple[int, float, float]
+
+
+class FaultyCohere:
+    """Local stub of the chat and embed endpoints failing its next requests as told by `faults`."""
+
+    def __init__(self):
+        self.faults: List[Fault] = []
+        self.requests = 0
+        self.url = self._start()
+
+    def next_fault(self) -> Fault:
+        self.requests += 1
+        return self.faults.pop(0) if self.faults else (200, 0.0, 0.0)
+
+    def _start(self) -> str:
+        sockets = tornado.netutil.bind_sockets(0, "127.0.0.1")
+        stub = self
+
+        class ChatHandler(tornado.web.RequestHandler):
+            async def post(self):
+                status, stall, stall_after_first = stub.next_fault()
+                await asyncio.sleep(stall)
+                if status != 200:
+                    self.set_status(status)
+                    self.write({"message": "injected fault"})
+                    return
+                body = json.loads(self.request.body)
+                response = {"text": "".join(TOKENS), "generation_id": "g", "finish_reason": "COMPLETE",
+                            "chat_history": []}
+                if not body.get("stream"):
+                    self.write(response)
+                    return
+                for index, token in enumerate(TOKENS):
+                    self.write(json.dumps({"event_type": "text-generation", "text": token, "is_finished": False})
+                               + "\n")
+                    await self.flush()
+                    if not index:
+                        await asyncio.sleep(stall_after_first)
+                self.write(json.dumps({"event_type": "stream-end", "finish_reason": "COMPLETE",
+                                       "response": response, "is_finished": True}) + "\n")
+
+        class EmbedHandler(tornado.web.RequestHandler):
+            async def post(self):
+                status, stall, _ = stub.next_fault()
+                await asyncio.sleep(stall)
+                if status != 200:
+                    self.set_status(status)
+                    self.write({"message": "injected fault"})
+                    return
+                texts = json.loads(self.request.body)["texts"]
+                self.write({"id": "e", "texts": texts, "response_type": "embeddings_floats",
+                            "embeddings": [[1.0, 0.0] for _ in texts]})
+
+        def serve():
+            asyncio.set_event_loop(asyncio.new_event_loop())
+            server = tornado.httpserver.HTTPServer(tornado.web.Application([
+                (r"/v1/chat", ChatHandler), (r"/v1/embed", EmbedHandler)]))
+            server.add_sockets(sockets)
+            started.set()
+            tornado.ioloop.IOLoop.current().start()
+
+        started = threading.Event()
+        threading.Thread(target=serve, daemon=True).start()
+        started.wait()
+        return f"http://127.0.0.1:{sockets[0].getsockname()[1]}"
+
+
+@pytest.fixture(scope="module")
+def stub() -> FaultyCohere:
+    return FaultyCohere()
+
+
+@pytest.fixture(autouse=True)
+def settings(stub):
+    stub.faults, stub.requests = [], 0
+    yield configure_resilience(ResilienceSettings(first_token_timeout=0.5, inter_token_timeout=0.5,
+                                                  request_timeout=5.0, attempts=3, base_delay=0.01,
+                                                  failure_threshold=3, reset_timeout=0.3, hedge_after=0.2))
+    configure_resilience(ResilienceSettings())
+
+
+def chat(stub: FaultyCohere, **kwargs) -> DocMindChatCohere:
+    return DocMindChatCohere(model="command-r", cohere_api_key="fake", base_url=stub.url, username="alice", **kwargs)
+
+
+def test_stream_is_retried_until_its_first_token_then_times_out_without_retry(stub):
+    # a server error, then a stream not starting in time, then an answer
+    stub.faults = [(503, 0.0, 0.0), (200, 1.0, 0.0)]
+    answer = "".join(chunk.content for chunk in chat(stub).stream([HumanMessage(content="warranty?")]))
+    assert answer == "".join(TOKENS) and stub.requests == 3
+
+    # a stream stalling after its first token is not started over
+    stub.faults, stub.requests = [(200, 0.0, 1.0)], 0
+    received = []
+    with pytest.raises(StreamTimeoutError, match="next token"):
+        for chunk in chat(stub).stream([HumanMessage(content="warranty?")]):
+            received.append(chunk.content)
+    assert received[:1] == TOKENS[:1] and stub.requests == 1
+
+    # client errors are not retried and do not count against the circuit
+    stub.faults, stub.requests = [(400, 0.0, 0.0)], 0
+    with pytest.raises(Exception) as raised:
+        list(chat(stub).stream([HumanMessage(content="warranty?")]))
+    assert not isinstance(raised.value, LLMUnavailableError) and stub.requests == 1
+    assert get_circuit_breaker("chat").state == "closed"
+
+
+def test_circuit_opens_after_repeated_failures_and_closes_after_a_successful_trial(stub):
+    embeddings = DocMindCohereEmbeddings(model="embed-english-v3.0", cohere_api_key="fake", base_url=stub.url)
+    stub.faults = [(500, 0.0, 0.0)] * 3
+    with pytest.raises(LLMUnavailableError, match="3 attempts"):
+        embeddings.embed_query("warranty")
+    assert get_circuit_breaker("embed").state == "open"
+    with pytest.raises(CircuitOpenError):
+        embeddings.embed_query("warranty")
+    assert stub.requests == 3
+
+    # the chat endpoint has its own circuit
+    assert get_circuit_breaker("chat").state == "closed"
+
+    time.sleep(0.35)
+    assert get_circuit_breaker("embed").state == "half-open"
+    assert embeddings.embed_query("warranty") == [1.0, 0.0]
+    assert get_circuit_breaker("embed").state == "closed" and stub.requests == 4
+
+
+def test_embed_retry_backoff_does_not_hold_a_scheduler_slot(stub, monkeypatch):
+    monkeypatch.setattr("docmind.llm.resilience.random.uniform", lambda low, high: high)
+    configure_resilience(ResilienceSettings(attempts=2, base_delay=1.0))
+    scheduler = configure_scheduler(max_concurrency=1)
+    embeddings = DocMindCohereEmbeddings(model="embed-english-v3.0", cohere_api_key="fake", base_url=stub.url,
+                                         username="alice")
+    stub.faults = [(500, 0.0, 0.0)]
+    try:
+        bulk = threading.Thread(target=lambda: embeddings.embed_documents(["warranty"]))
+        bulk.start()
+        time.sleep(0.2)
+
+        # the failed bulk call sleeps before its retry without its slot, a question is not kept waiting
+        assert scheduler.running == 0
+        started = time.monotonic()
+        assert embeddings.embed_query("warranty") == [1.0, 0.0]
+        assert time.monotonic() - started < 0.5
+        bulk.join()
+        assert stub.requests == 3
+    finally:
+        configure_scheduler()
+
+
+def test_slow_condense_call_is_hedged(stub):
+    condenser = chat(stub).condenser()
+    stub.faults = [(200, 2.0, 0.0)]
+    started = time.monotonic()
+    message = condenser.invoke([HumanMessage(content="and the returns?")])
+    assert message.content == "".join(TOKENS)
+    assert time.monotonic() - started < 1.5 and stub.requests == 2
+
+    # without hedging the slow call is waited for
+    stub.faults, stub.requests = [(200, 0.5, 0.0)], 0
+    message = chat(stub).invoke([HumanMessage(content="and the returns?")])
+    assert message.content == "".join(TOKENS) and stub.requests == 1
+
+
+def test_settings_follow_the_project_configuration():
+    from docmind.utils.config import ProjectConfiguration
+
+    settings = ResilienceSettings.from_config(ProjectConfiguration(llm_retries=0, llm_hedge_after=0.4))
+    assert settings.attempts == 1 and settings.hedge_after == 0.4
+    assert all(0 <= settings.delay(attempt) <= settings.max_delay for attempt in range(1, 10))
+
@@ -0,0 +1,62 @@
+import threading
+import time
+
+import pytest
+
+from docmind.llm.scheduler import BULK, INTERACTIVE, CohereScheduler, track_waits
+from docmind.utils.metrics import MetricsRegistry
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not met"
+        time.sleep(0.005)
+
+
+def test_waiting_calls_are_served_by_priority_then_fairly_between_users():
+    scheduler = CohereScheduler(max_concurrency=1, registry=MetricsRegistry())
+    served = []
+
+    def call(username, priority):
+        with scheduler.slot(username, priority):
+            served.append((username, priority))
+
+    held = scheduler.acquire("carol", INTERACTIVE)
+    threads = []
+    for username, priority in [("carol", BULK)] + [("alice", INTERACTIVE)] * 3 + [("bob", INTERACTIVE)] * 2:
+        threads.append(threading.Thread(target=call, args=(username, priority)))
+        threads[-1].start()
+        wait_until(lambda: scheduler.queued == len(threads))
+    assert scheduler.running == 1
+
+    with track_waits() as waits:
+        scheduler.release(held)
+        for thread in threads:
+            thread.join()
+    # questions before the bulk call queued first, alice's burst alternating with bob's questions
+    assert served == [("alice", INTERACTIVE), ("bob", INTERACTIVE), ("alice", INTERACTIVE), ("bob", INTERACTIVE),
+                      ("alice", INTERACTIVE), ("carol", BULK)]
+    assert scheduler.running == 0
+    # waits of calls made in other threads are not tracked by this context
+    assert waits == []
+
+
+def test_token_budget_delays_calls_until_the_window_frees_up():
+    registry = MetricsRegistry()
+    scheduler = CohereScheduler(max_concurrency=None, tokens_per_minute=100, registry=registry)
+    with track_waits() as waits:
+        with scheduler.slot("alice", tokens=80) as slot:
+            slot.add_tokens(10)
+        with pytest.raises(TimeoutError):
+            scheduler.acquire("bob", tokens=30, timeout=0.05)
+        # a call fitting in what is left of the budget is not delayed
+        with scheduler.slot("bob", tokens=10):
+            pass
+    assert len(waits) == 2 and scheduler.queued == 0
+    assert "docmind_cohere_queue_wait_seconds_count{priority=\"interactive\"} 2" in registry.to_prometheus()
+
+    # a call larger than the whole budget runs alone once the window is empty
+    scheduler = CohereScheduler(tokens_per_minute=100, registry=registry)
+    with scheduler.slot("carol", tokens=500):
+        pass
@@ -0,0 +1,100 @@
+import threading
+import time
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from docmind.utils.config import ProjectConfiguration
+from docmind.vectorstore.cache import (
+    StoreCache,
+    get_store_cache,
+    get_user_vectorstore,
+    warm_up_user_vectorstore,
+)
+from docmind.vectorstore.numpy_store import NumpyStore
+
+DOCS = [Document(page_content=f"chunk {i}", metadata={"source": f"{i % 3}.pdf", "page": i}) for i in range(20)]
+
+
+class OpenedStores:
+    """Opens numpy stores slowly and records which ones were opened, searched and closed."""
+
+    def __init__(self, embedding):
+        self.embedding = embedding
+        self.opened, self.searched, self.closed = [], [], []
+
+    def opener(self, directory):
+        def open_store():
+            time.sleep(0.05)
+            store = NumpyStore(directory / "vectors", self.embedding)
+            if not store.count():
+                store.add_documents(DOCS)
+            search, close = store.search_by_vector, store.close
+            store.search_by_vector = lambda *args, **kwargs: self.searched.append(directory) or search(*args, **kwargs)
+            store.close = lambda: self.closed.append(directory) or close()
+            self.opened.append(directory)
+            return store
+
+        return open_store
+
+
+def test_store_is_opened_once_and_warmed_up_without_embedding(tmp_path):
+    stores = OpenedStores(DeterministicFakeEmbedding(size=16))
+    cache = StoreCache()
+    key, directory = (str(tmp_path), "fake"), tmp_path
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get(key, directory, stores.opener(directory))))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == 4 and all(store is results[0] for store in results)
+    assert stores.opened == [directory] and key in cache and cache.resident_bytes > 0
+
+    # warming up an open store only loads its index with a search for a stored vector
+    assert cache.warm_up(key, directory, stores.opener(directory)).result(timeout=5) is results[0]
+    assert stores.opened == [directory] and stores.searched == [directory]
+
+
+def test_cold_stores_are_closed_over_the_memory_budget(tmp_path):
+    stores = OpenedStores(DeterministicFakeEmbedding(size=16))
+    cache = StoreCache(min_idle=0.0)
+    alice, bob = tmp_path / "alice", tmp_path / "bob"
+    cache.get((str(alice), "fake"), alice, stores.opener(alice))
+    cache.get((str(bob), "fake"), bob, stores.opener(bob))
+
+    # the budget holds one store: the least recently used one is closed, never the one just used
+    cache.get((str(alice), "fake"), alice, stores.opener(alice))
+    cache.configure(cache.resident_bytes // 2 + 1)
+    assert stores.closed == [bob] and (str(alice), "fake") in cache
+    cache.get((str(bob), "fake"), bob, stores.opener(bob))
+    assert stores.closed == [bob, alice] and stores.opened == [alice, bob, bob]
+
+    # a pinned store stays open however long it is used, e.g. by an upload
+    bob_store = cache.get((str(bob), "fake"), bob, stores.opener(bob))
+    with cache.pin(bob_store):
+        cache.get((str(alice), "fake"), alice, stores.opener(alice))
+        assert stores.closed == [bob, alice] and cache.resident_bytes > cache.memory_budget
+    assert stores.closed == [bob, alice, bob]
+
+    # stores used recently stay open over the budget, a session may still be searching them
+    cache.min_idle = 60.0
+    cache.get((str(bob), "fake"), bob, stores.opener(bob))
+    assert stores.closed == [bob, alice, bob] and cache.resident_bytes > cache.memory_budget
+
+
+def test_user_store_is_warmed_up_for_its_embedding_model(tmp_path):
+    config = ProjectConfiguration(vectorstore_backend="numpy")
+    embedding = DeterministicFakeEmbedding(size=16)
+    store = get_user_vectorstore(config, "alice", tmp_path, embedding)
+    store.add_documents(DOCS)
+
+    # the store already open for the model is not opened again, another model gets its own
+    model = "DeterministicFakeEmbedding"
+    assert warm_up_user_vectorstore(config, "alice", tmp_path, model, lambda _: embedding) is None
+    warmed = warm_up_user_vectorstore(config, "alice", tmp_path, "other", lambda _: embedding).result(timeout=5)
+    assert warmed is not store and get_store_cache().get((str(tmp_path.resolve()), "other"), tmp_path, None) is warmed
+    get_store_cache().discard(tmp_path.resolve())
+    assert get_user_vectorstore(config, "alice", tmp_path, embedding) is not store
+    get_store_cache().discard(tmp_path.resolve())
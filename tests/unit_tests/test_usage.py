@@ -0,0 +1,51 @@
+from types import SimpleNamespace
+
+from langchain_core.documents import Document
+from langchain_core.language_models import FakeListChatModel
+
+from docmind.llm.callbacks import UsageCallback
+from docmind.llm.create_llm_chain import create_llm_with_retriever_chain
+from docmind.llm.embeddings import billed_input_tokens
+from docmind.utils.usage import UsageLedger, estimate_tokens
+from tests.unit_tests.test_metrics import StaticRetriever
+
+
+def test_ledger_aggregates(tmp_path):
+    ledger = UsageLedger(tmp_path / "usage.db")
+    ledger.record("alice", "generate", conversation="chat_1.json", model="command-r", input_tokens=100,
+                  output_tokens=20, settings={"temperature": 0.3}, latency=0.5)
+    ledger.record("alice", "embed", embedded_tokens=300)
+    ledger.record("bob", "generate", conversation="chat_2.json", input_tokens=10, output_tokens=5)
+
+    totals = ledger.totals(username="alice")
+    assert (totals["requests"], totals["input_tokens"], totals["embedded_tokens"]) == (2, 100, 300)
+    assert [row["username"] for row in ledger.by_user()] == ["alice", "bob"]
+    assert {row["stage"] for row in ledger.by_stage(username="alice")} == {"generate", "embed"}
+    assert ledger.totals(conversation="chat_2.json")["output_tokens"] == 5
+    assert {row["settings"] for row in ledger.by_settings(username="alice")} == {'{"temperature": 0.3}', None}
+    ledger.close()
+
+
+def test_usage_callback_records_rag_stages(tmp_path):
+    ledger = UsageLedger(tmp_path / "usage.db")
+    retriever = StaticRetriever(docs=[Document(page_content="DocMind answers questions.",
+                                               metadata={"source": "a.pdf"})])
+    llm = FakeListChatModel(responses=["What does DocMind do?", "It answers questions [1]."])
+    chain = create_llm_with_retriever_chain(llm, retriever)
+
+    usage = UsageCallback(ledger, "alice", conversation="docs_chat_history/chat_1.json")
+    "".join(chain.stream({"question": "And what does it do?", "chat_history": [{"human": "Hi", "ai": "Hello"}]},
+                         config={"callbacks": [usage]}))
+
+    stages = {row["stage"]: row for row in ledger.by_stage(username="alice")}
+    assert set(stages) == {"rephrase", "generate"}
+    # the fake model reports no usage, so the tokens are estimated from the text
+    assert stages["generate"]["output_tokens"] == estimate_tokens("It answers questions [1].")
+    assert stages["generate"]["input_tokens"] > 0
+    assert ledger.totals(conversation="docs_chat_history/chat_1.json")["requests"] == 2
+
+
+def test_billed_input_tokens():
+    response = SimpleNamespace(meta=SimpleNamespace(billed_units=SimpleNamespace(input_tokens=42)))
+    assert billed_input_tokens(response) == 42
+    assert billed_input_tokens(SimpleNamespace(meta=None)) is None
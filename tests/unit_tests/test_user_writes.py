@@ -0,0 +1,85 @@
+import subprocess
+import sys
+import textwrap
+import threading
+import time
+from pathlib import Path
+
+from docmind.utils.user_writes import UserWriter, get_user_writer
+
+
+class CountingStore:
+    def __init__(self):
+        self.flushes = 0
+
+    def flush(self):
+        self.flushes += 1
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not met"
+        time.sleep(0.005)
+
+
+def test_writes_take_turns_in_arrival_order_and_flush_once_per_burst(tmp_path):
+    writer = UserWriter(tmp_path)
+    store = CountingStore()
+    order = []
+
+    def write(name):
+        with writer.write(name):
+            order.append(name)
+            writer.flush_later(store)
+
+    with writer.write("first"):
+        threads = []
+        for name in ("second", "third"):
+            threads.append(threading.Thread(target=write, args=(name,)))
+            threads[-1].start()
+            wait_until(lambda: writer.waiting == len(threads))
+        order.append("first")
+        writer.flush_later(store)
+    for thread in threads:
+        thread.join()
+
+    assert order == ["first", "second", "third"]
+    # the three writes ran as one burst, the store was flushed once and the lock file given up after it
+    assert store.flushes == 1 and not writer.file_lock.is_locked
+    assert get_user_writer(tmp_path) is get_user_writer(tmp_path / ".." / tmp_path.name)
+
+    # a burst is cut after max_burst writes, other processes get the lock in between
+    writer = UserWriter(tmp_path, max_burst=1)
+    with writer.write("first"):
+        thread = threading.Thread(target=write, args=("fourth",))
+        thread.start()
+        wait_until(lambda: writer.waiting == 1)
+        writer.flush_later(store)
+    thread.join()
+    assert store.flushes == 3
+
+
+def test_writers_of_other_processes_are_excluded(tmp_path):
+    log = tmp_path / "log.txt"
+    child = subprocess.Popen([sys.executable, "-c", textwrap.dedent(f"""
+        import time
+        from docmind.utils.user_writes import UserWriter
+
+        with UserWriter({str(tmp_path)!r}).write():
+            print("locked", flush=True)
+            time.sleep(0.5)
+            with open({str(log)!r}, "a") as file:
+                file.write("child\\n")
+    """)], stdout=subprocess.PIPE, text=True, cwd=Path(__file__).resolve().parents[2])
+    try:
+        assert child.stdout.readline().strip() == "locked"
+        started = time.monotonic()
+        with UserWriter(tmp_path).write():
+            waited = time.monotonic() - started
+            with open(log, "a") as file:
+                file.write("parent\n")
+    finally:
+        child.wait(timeout=30)
+    assert log.read_text().split() == ["child", "parent"]
+    assert waited > 0.2
@@ -0,0 +1,338 @@
+import numpy as np
+import pytest
+import yaml
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from docmind.upload_and_process_files import GetRetriever
+from docmind.utils.config import ProjectConfiguration
+from docmind.vectorstore.base import filter_sources, match_filter
+from docmind.vectorstore.cache import get_corpus_vectorstore, get_store_cache
+from docmind.vectorstore.chromadb import create_userdb
+from docmind.vectorstore.factory import create_vectorstore, open_user_vectorstore
+from docmind.vectorstore.numpy_store import NumpyStore
+from docmind.vectorstore.routing import DocumentIndex, RoutedStore
+from docmind.vectorstore.shared import CorpusRegistry, MergedStore
+from docmind.vectorstore.tuning import (
+    load_vectors,
+    main,
+    recommend,
+    sample_queries,
+    tune_hnsw,
+)
+
+DOCS = [Document(page_content=f"chunk {i}", metadata={"source": f"{i % 3}.pdf", "page": i}) for i in range(30)]
+
+
+def test_match_filter():
+    metadata = {"source": "A.pdf", "page": 3}
+    assert match_filter(metadata, None)
+    assert match_filter(metadata, {"source": "A.pdf"})
+    assert match_filter(metadata, {"source": {"$in": ["A.pdf", "B.pdf"]}})
+    assert not match_filter(metadata, {"source": {"$nin": ["A.pdf"]}})
+    assert match_filter(metadata, {"$and": [{"page": {"$gte": 3}}, {"page": {"$lt": 4}}]})
+    assert match_filter(metadata, {"$or": [{"source": "B.pdf"}, {"page": 3}]})
+    with pytest.raises(ValueError):
+        match_filter(metadata, {"page": {"$like": 3}})
+
+
+@pytest.fixture(params=["chroma", "numpy"])
+def store(request, tmp_path):
+    embedding = DeterministicFakeEmbedding(size=16)
+    if request.param == "chroma":
+        store = create_userdb("alice", tmp_path, embedding)
+    else:
+        store = NumpyStore(tmp_path / "vectors", embedding)
+    yield store
+    store.close()
+
+
+def test_store_interface(store, tmp_path):
+    ids = store.add_documents(DOCS, ids=[str(i) for i in range(len(DOCS))])
+    assert store.count() == 30
+
+    results = store.search("chunk 4", k=3, filter={"source": "1.pdf"})
+    assert results[0][0].page_content == "chunk 4"
+    assert all(doc.metadata["source"] == "1.pdf" for doc, _ in results)
+    assert results[0][1] >= results[1][1] >= results[2][1]
+
+    store.delete(ids[:10])
+    assert store.count() == 20
+    assert "chunk 4" not in [doc.page_content for doc, _ in store.search("chunk 4", k=5)]
+
+    # an existing id is overwritten
+    store.add_documents([Document(page_content="chunk 4 again", metadata={"source": "1.pdf"})], ids=["10"])
+    assert store.count() == 20
+
+    retriever = GetRetriever(vectorstore=store, filter_criteria={"source": {"$in": ["2.pdf"]}}).get_retriever()
+    docs = retriever.invoke("chunk 11")
+    assert docs and all(doc.metadata["source"] == "2.pdf" for doc in docs)
+
+    assert store.snapshot(tmp_path / "snapshot").is_dir()
+    store.drop()
+
+
+def test_numpy_store_persists_and_snapshots(tmp_path):
+    embedding = DeterministicFakeEmbedding(size=16)
+    store = NumpyStore(tmp_path / "vectors", embedding)
+    store.add_documents(DOCS)
+    store.snapshot(tmp_path / "snapshot")
+    store.close()
+
+    for directory in (tmp_path / "vectors", tmp_path / "snapshot"):
+        reopened = NumpyStore(directory, embedding)
+        assert reopened.count() == 30
+        assert reopened.search("chunk 7", k=1)[0][0].page_content == "chunk 7"
+        reopened.close()
+
+
+@pytest.mark.parametrize("index", ["ivf", "hnsw"])
+def test_approximate_indexes_match_exact_search(tmp_path, index):
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(20, 32))
+    vectors = (centers[rng.integers(20, size=2000)] + 0.3 * rng.normal(size=(2000, 32))).astype(np.float32)
+    embedding = DeterministicFakeEmbedding(size=32)
+    exact = NumpyStore(tmp_path / "exact", embedding)
+    approximate = NumpyStore(tmp_path / index, embedding, index=index, ivf_min_size=500, nprobe=16)
+    for store in (exact, approximate):
+        store.add_embeddings([str(i) for i in range(len(vectors))], vectors, ids=[str(i) for i in range(len(vectors))])
+
+    recalls = []
+    for query in vectors[:20] + 0.1 * rng.normal(size=(20, 32)):
+        expected = {doc.page_content for doc, _ in exact.search_by_vector(query, k=10)}
+        found = {doc.page_content for doc, _ in approximate.search_by_vector(query, k=10)}
+        recalls.append(len(expected & found) / 10)
+    assert np.mean(recalls) >= 0.8
+
+
+@pytest.mark.parametrize("quantization,truncate_dim", [("int8", None), ("int8", 24), ("binary", None)])
+def test_quantized_search_rescores_exactly(tmp_path, quantization, truncate_dim):
+    rng = np.random.default_rng(1)
+    vectors = rng.normal(size=(1000, 32)).astype(np.float32)
+    embedding = DeterministicFakeEmbedding(size=32)
+    exact = NumpyStore(tmp_path / "exact", embedding)
+    quantized = NumpyStore(tmp_path / "quantized", embedding, quantization=quantization, truncate_dim=truncate_dim,
+                           rescore_factor=10)
+    ids = [str(i) for i in range(len(vectors))]
+    for store in (exact, quantized):
+        store.add_embeddings(ids, vectors, ids=ids)
+
+    query = vectors[3] + 0.01 * rng.normal(size=32)
+    expected = exact.search_by_vector(query, k=5)
+    found = quantized.search_by_vector(query, k=5)
+    assert found[0][0].page_content == "3"
+    # the scores of the shortlisted chunks are exact
+    assert found[0][1] == pytest.approx(expected[0][1], abs=1e-4)
+    assert quantized.memory_usage()["search"] < quantized.memory_usage()["vectors"]
+
+    # the codes are rebuilt when the store is reopened without them matching
+    quantized.close()
+    reopened = NumpyStore(tmp_path / "quantized", embedding, quantization="int8", truncate_dim=16)
+    assert reopened.search_by_vector(query, k=1)[0][0].page_content == "3"
+
+    # the HNSW graph searches the full precision vectors, codes would only take memory
+    with pytest.raises(ValueError, match="hnsw"):
+        NumpyStore(tmp_path / "hnsw", embedding, index="hnsw", quantization=quantization)
+
+
+def test_hnsw_params_are_recorded_per_collection(tmp_path):
+    embedding = DeterministicFakeEmbedding(size=16)
+    store = create_userdb("alice", tmp_path, embedding, hnsw_params={"M": 8, "search_ef": 50})
+    store.add_documents(DOCS[:5])
+    assert store.hnsw_params == {"M": 8, "construction_ef": 100, "search_ef": 50}
+    # an existing collection keeps the parameters its graph was built with
+    assert create_userdb("alice", tmp_path, embedding, hnsw_params={"M": 32}).hnsw_params["M"] == 8
+    assert create_userdb("bob", tmp_path, embedding).hnsw_params["M"] == 16
+    with pytest.raises(ValueError):
+        create_userdb("carol", tmp_path, embedding, hnsw_params={"ef": 10})
+
+
+def test_tune_hnsw_recommends_a_setting_reaching_the_target(tmp_path):
+    rng = np.random.default_rng(2)
+    vectors = rng.normal(size=(500, 16)).astype(np.float32)
+    store = NumpyStore(tmp_path / "vectors", DeterministicFakeEmbedding(size=16))
+    store.add_embeddings([str(i) for i in range(len(vectors))], vectors)
+    loaded = load_vectors(store)
+    assert loaded.shape == vectors.shape
+
+    results = tune_hnsw(loaded, sample_queries(loaded, 20), k=5, m_values=[4, 16], construction_ef_values=[50],
+                        search_ef_values=[5, 100])
+    assert len(results) == 4
+    best, reached = recommend(results, target_recall=0.9)
+    assert reached and best.recall >= 0.9
+    _, reached = recommend(results, target_recall=1.1)
+    assert not reached
+
+
+def test_tuning_opens_the_configured_store_and_embeds_the_queries_in_batches(tmp_path, monkeypatch, capsys):
+    class FakeCohereEmbeddings:
+        calls = []
+
+        def __init__(self, model):
+            self.calls.append(model)
+
+        def embed(self, texts, input_type=None):
+            self.calls.append((len(texts), input_type))
+            return [[float(i)] * 16 for i in range(len(texts))]
+
+    monkeypatch.setattr("langchain_cohere.CohereEmbeddings", FakeCohereEmbeddings)
+    settings = {"vectorstore_backend": "numpy", "vectorstore_distance_metric": "ip", "vectorstore_sharding": "size"}
+    config = ProjectConfiguration(**settings)
+    store = open_user_vectorstore(config, "alice", tmp_path / "alice", DeterministicFakeEmbedding(size=16))
+    store.add_documents(DOCS)
+    store.close()
+    (tmp_path / "config.yaml").write_text(yaml.dump(settings))
+    (tmp_path / "queries.txt").write_text("\n".join(f"question {i}" for i in range(100)))
+
+    assert main(["--user-data-dir", str(tmp_path / "alice"), "--username", "alice", "--config",
+                 str(tmp_path / "config.yaml"), "--queries", str(tmp_path / "queries.txt"), "--m", "4",
+                 "--construction-ef", "20", "--search-ef", "10"]) == 0
+    # one client embeds the questions 96 at a time, the sharded store is searched with its metric
+    out = capsys.readouterr().out
+    assert FakeCohereEmbeddings.calls == ["embed-english-v3.0", (96, "search_query"), (4, "search_query")]
+    assert f"{len(DOCS)} chunks of dimension 16" in out and "space=ip" in out
+
+
+def test_shared_corpus_is_mounted_read_only_and_merged_by_score(tmp_path):
+    embedding = DeterministicFakeEmbedding(size=16)
+    registry = CorpusRegistry(tmp_path / "shared")
+    registry.create("manuals", embedding_model="fake", backend="numpy")
+    registry.grant("manuals", ["alice"])
+    manual = tmp_path / "manual.pdf"
+    manual.write_bytes(b"%PDF")
+
+    def parser(path):
+        return iter([Document(page_content=f"manual {topic}", metadata={"source": path.name})
+                     for topic in ("pumps", "valves", "seals", "motors", "filters")])
+
+    assert registry.ingest("manuals", [manual], embedding, parser=parser).chunks == 5
+    # ingesting the same manual again embeds nothing
+    assert registry.ingest("manuals", [manual], embedding, parser=parser).duplicates == 5
+    assert registry.documents("manuals") == ["manual.pdf"]
+
+    assert [corpus.name for corpus in registry.corpora_for("alice")] == ["manuals"]
+    assert registry.corpora_for("bob") == []
+    with pytest.raises(PermissionError):
+        registry.open("manuals", embedding, username="bob")
+    registry.grant("manuals", ["*"])
+    assert registry.can_read("manuals", "bob")
+
+    private = NumpyStore(tmp_path / "alice", embedding)
+    private.add_documents(DOCS[:5])
+    shared = registry.open("manuals", embedding, username="alice")
+    with pytest.raises(PermissionError):
+        shared.add_documents(DOCS[:1])
+    merged = MergedStore(private, [shared])
+
+    results = merged.search("manual motors", k=4)
+    assert results[0][0].page_content == "manual motors" and results[0][0].metadata["corpus"] == "manuals"
+    assert [score for _, score in results] == sorted([score for _, score in results], reverse=True)
+    assert {doc.page_content for doc, _ in merged.search("chunk 2", k=10)} >= {"chunk 2", "manual pumps"}
+    assert len(merged.max_marginal_relevance_search("chunk 2", k=6, fetch_k=10)) == 6
+    # writes and deletes only reach the private collection
+    merged.add_documents(DOCS[5:6])
+    assert (merged.count(), shared.count()) == (6, 5)
+    merged.close()
+
+    # scores of another distance metric are not comparable
+    registry.create("glossary", embedding_model="fake", backend="numpy", distance_metric="cosine")
+    with pytest.raises(ValueError, match="cosine"):
+        MergedStore(private, [registry.open("glossary", embedding)])
+
+    # the pages take corpora from the store cache, opened once per process and checked for every user
+    mounted = get_corpus_vectorstore(registry, "manuals", embedding, "alice")
+    assert get_corpus_vectorstore(registry, "manuals", embedding, "bob") is mounted
+    registry.revoke("manuals", ["*"])
+    with pytest.raises(PermissionError):
+        get_corpus_vectorstore(registry, "manuals", embedding, "bob")
+    get_store_cache().discard((tmp_path / "shared" / "manuals").resolve())
+    registry.close()
+
+
+def test_filter_sources():
+    assert filter_sources(None) is None
+    assert filter_sources({"page": 3}) is None
+    assert filter_sources({"source": "A.pdf"}) == {"A.pdf"}
+    assert filter_sources({"$and": [{"source": {"$in": ["A.pdf", "B.pdf"]}}, {"source": {"$ne": "A.pdf"}}]}) \
+        == {"A.pdf", "B.pdf"}
+    assert filter_sources({"$or": [{"source": "A.pdf"}, {"source": {"$eq": "C.pdf"}}]}) == {"A.pdf", "C.pdf"}
+    assert filter_sources({"$or": [{"source": "A.pdf"}, {"page": 1}]}) is None
+
+
+@pytest.mark.parametrize("strategy", ["document", "size"])
+def test_sharded_store_prunes_shards_and_merges_results(tmp_path, strategy):
+    embedding = DeterministicFakeEmbedding(size=16)
+    sharded = create_vectorstore("alice", tmp_path, embedding, backend="numpy", sharding=strategy, shard_size=10)
+    unsharded = NumpyStore(tmp_path / "unsharded", embedding)
+    for store in (sharded, unsharded):
+        store.add_documents(DOCS, ids=[str(i) for i in range(len(DOCS))])
+
+    assert sharded.count() == 30
+    assert len(sharded.shards_for()) == 3
+    assert len(sharded.shards_for({"source": {"$in": ["1.pdf"]}})) == 1
+    assert sharded.shards_for({"source": "missing.pdf"}) == []
+    # the merged top k of the shards is the top k of the whole collection
+    for query, where in (("chunk 4", None), ("chunk 7", {"source": {"$in": ["1.pdf", "2.pdf"]}})):
+        assert [doc.page_content for doc, _ in sharded.search(query, k=5, filter=where)] \
+            == [doc.page_content for doc, _ in unsharded.search(query, k=5, filter=where)]
+    assert len(sharded.max_marginal_relevance_search("chunk 4", k=6, fetch_k=12)) == 6
+
+    sharded.delete(["4"])
+    assert sharded.count() == 29
+    sharded.close()
+    reopened = create_vectorstore("alice", tmp_path, embedding, backend="numpy", sharding=strategy, shard_size=10)
+    assert reopened.shards_for({"source": "1.pdf"}) and reopened.count() == 29
+    reopened.drop()
+    assert reopened.count() == 0
+    reopened.close()
+
+
+def test_routed_store_searches_the_closest_documents_only(tmp_path):
+    rng = np.random.default_rng(0)
+    topics = rng.normal(size=(12, 16))
+    texts, vectors, metadatas = [], [], []
+    for doc in range(12):
+        for page in range(5):
+            texts.append(f"document {doc} page {page}")
+            vectors.append(topics[doc] + 0.1 * rng.normal(size=16))
+            metadatas.append({"source": f"{doc}.pdf", "page": page})
+    plain = NumpyStore(tmp_path / "plain", DeterministicFakeEmbedding(size=16))
+    plain.add_embeddings(texts, vectors, metadatas)
+    routed = RoutedStore(NumpyStore(tmp_path / "vectors", plain.embedding), DocumentIndex(tmp_path / "documents.db"),
+                         top_n=2)
+    ids = routed.add_embeddings(texts, vectors, metadatas)
+
+    assert len(routed.index) == 12 and routed.index.summaries()["3.pdf"].startswith("document 3 page 0")
+    assert routed.index.route(topics[3], 2)[0][0] == "3.pdf"
+    found = routed.search_by_vector(topics[3], k=10)
+    assert {doc.metadata["source"] for doc, _ in found} <= {source for source, _ in routed.index.route(topics[3], 2)}
+    assert [doc.page_content for doc, _ in found[:5]] == [doc.page_content for doc, _ in plain.search_by_vector(
+        topics[3], k=5)]
+    # a filter naming the documents is kept as it is
+    assert {doc.metadata["source"] for doc, _ in routed.search_by_vector(topics[3], k=10,
+                                                                       filter={"source": "7.pdf"})} == {"7.pdf"}
+    assert len(routed.max_marginal_relevance_search_by_vector(topics[3], k=4, fetch_k=10)) == 4
+
+    routed.delete(ids[:5])
+    assert "0.pdf" not in routed.index.summaries() and routed.index.chunk_count() == 55
+    routed.drop()
+    assert len(routed.index) == 0
+    routed.close()
+    plain.close()
+
+
+def test_routed_store_falls_back_when_the_index_misses_chunks(tmp_path):
+    store = NumpyStore(tmp_path / "vectors", DeterministicFakeEmbedding(size=16))
+    store.add_documents(DOCS)
+    routed = RoutedStore(store, DocumentIndex(tmp_path / "documents.db"), top_n=1)
+    routed.add_documents([Document(page_content="late", metadata={"source": "3.pdf"}),
+                          Document(page_content="later", metadata={"source": "4.pdf"})])
+    assert len({doc.metadata["source"] for doc, _ in routed.search("chunk 1", k=31)}) == 5
+    routed.close()
+
+
+def test_ids_where_finds_the_chunks_of_a_document(store):
+    ids = store.add_documents(DOCS)
+    assert sorted(store.ids_where({"source": "1.pdf"})) == sorted(ids[1::3])
+    store.delete(store.ids_where({"source": "1.pdf"}))
+    assert store.count() == 20 and store.ids_where({"source": "1.pdf"}) == []